@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Measures per-request overhead of the webhook path at high rates.
+
+``chain`` times a chain of awaits as deep as the path from
+``DeploymentHandler`` to the Github transport, built on ``gen.coroutine``
+and on native coroutines.  ``webhook`` serves hindsight and the Github stub
+in one process without latency, sends webhooks with unique commits as fast
+as ``--concurrency`` allows, and reports latency and CPU seconds of each
+webhook.  Run ``webhook`` on two commits to compare them::
+
+    python benchmarks/bench_overhead.py chain
+    python benchmarks/bench_overhead.py webhook --requests 2000 --loop uvloop
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from tornado import concurrent
+from tornado import gen
+from tornado import httpclient
+from tornado import httpserver
+from tornado import ioloop
+from tornado import testing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import github_stub  # noqa: E402
+import load  # noqa: E402
+from hindsight import app  # noqa: E402
+
+# Handler, report_build, _report_build, find_pull, finder, scheduler,
+# transport.
+DEPTH = 7
+
+_CONFIG = """
+[server]
+listen = "127.0.0.1:0"
+
+[github]
+access_token = "bench-token"
+host = "http://127.0.0.1:{port}"
+
+[repo.demo]
+owner = "asyncat"
+name = "demo"
+secret = "mock-secret"
+builder = "rundeploy"
+"""
+
+
+def _resolve_soon():
+    """Returns a future resolved on next iteration, as a response is."""
+    future = concurrent.Future()
+    ioloop.IOLoop.current().add_callback(future.set_result, None)
+    return future
+
+
+@gen.coroutine
+def legacy_chain(depth):
+    if depth:
+        result = yield legacy_chain(depth - 1)
+        raise gen.Return(result)
+    yield _resolve_soon()
+    raise gen.Return(depth)
+
+
+async def native_chain(depth):
+    if depth:
+        return await native_chain(depth - 1)
+    await _resolve_soon()
+    return depth
+
+
+async def run_chain(chain, number):
+    """Returns seconds of awaiting ``chain`` ``number`` times."""
+    start = time.perf_counter()
+    for _ in range(number):
+        await chain(DEPTH)
+    return time.perf_counter() - start
+
+
+def bench_chain(args):
+    loop = ioloop.IOLoop.current()
+    print("{:>8} {:>14}".format("style", "us per call"))
+    for name, chain in (("legacy", legacy_chain), ("native", native_chain)):
+        seconds = min(loop.run_sync(lambda: run_chain(chain, args.number))
+                      for _ in range(3))
+        print("{:>8} {:>14.1f}".format(name, seconds / args.number * 1e6))
+
+
+async def bench_webhook(args):
+    stub_sock, stub_port = testing.bind_unused_port()
+    stub_server = httpserver.HTTPServer(
+        github_stub.make_app(github_stub.Stub()))
+    stub_server.add_sockets([stub_sock])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config_file = os.path.join(tmpdir, "cfg.toml")
+        with open(config_file, "w") as f:
+            f.write(_CONFIG.format(port=stub_port))
+        app_sock, app_port = testing.bind_unused_port()
+        app_server = httpserver.HTTPServer(app.Application(config_file))
+        app_server.add_sockets([app_sock])
+
+        payload, = load.load_payloads(None, "mock-secret")
+        url = "http://127.0.0.1:{}{}".format(app_port, payload["path"])
+        client = httpclient.AsyncHTTPClient(
+            force_instance=True, max_clients=args.concurrency)
+        latencies = []
+        codes = {}
+        # Built before timing, only hindsight and the stub are measured.
+        bodies = iter([load.make_unique(payload, seq)
+                       for seq in range(args.requests)])
+
+        async def send():
+            for body in bodies:
+                start = time.time()
+                resp = await client.fetch(
+                    url, method="POST", headers=payload["headers"],
+                    body=body, raise_error=False)
+                latencies.append(time.time() - start)
+                codes[resp.code] = codes.get(resp.code, 0) + 1
+
+        start, cpu_start = time.time(), time.process_time()
+        await asyncio.gather(*[send() for _ in range(args.concurrency)])
+        elapsed = time.time() - start
+        cpu = time.process_time() - cpu_start
+
+        client.close()
+        app_server.stop()
+        stub_server.stop()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    latencies.sort()
+    print("loop:        {}".format(type(asyncio.get_event_loop()).__name__))
+    print("requests:    {} {}".format(args.requests, codes))
+    print("rps:         {:.0f}".format(args.requests / elapsed))
+    print("p50/p99 ms:  {:.2f} / {:.2f}".format(
+        load.percentile(latencies, 50) * 1000,
+        load.percentile(latencies, 99) * 1000))
+    # Includes the client and the stub, they are the same across commits.
+    print("CPU ms/req:  {:.3f}".format(cpu / args.requests * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loop", choices=("asyncio", "uvloop"),
+                        default="asyncio")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    chain_parser = subparsers.add_parser("chain")
+    chain_parser.add_argument("--number", type=int, default=5000)
+    webhook_parser = subparsers.add_parser("webhook")
+    webhook_parser.add_argument("--requests", type=int, default=1000)
+    webhook_parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.loop == "uvloop":
+        app.install_uvloop()
+    if args.command == "webhook":
+        ioloop.IOLoop.current().run_sync(lambda: bench_webhook(args))
+    else:
+        bench_chain(args)
+
+
+if __name__ == "__main__":
+    main()
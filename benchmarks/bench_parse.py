@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Compares decoding Buildbot 8 packets at once with :func:`iter_packets`.
+
+Usage: python benchmarks/bench_parse.py [number of builds]
+"""
+from __future__ import print_function, division, unicode_literals
+
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hindsight.deployment import BuildbotBuild  # noqa: E402
+from hindsight.packets import iter_packets  # noqa: E402
+
+EVENTS = frozenset(["buildStarted", "buildFinished"])
+
+
+def make_packets(builds):
+    """Returns packets of ``builds`` builds, each has 10 steps."""
+    packets = []
+    for i in range(builds):
+        properties = [
+            ["buildername", "builder-{}".format(i % 5), "Builder"],
+            ["revision", "{:040x}".format(i), "Build"],
+            ["got_revision", "{:040x}".format(i), "Build"],
+        ] + [["p{}".format(j), "v" * 20, "src"] for j in range(20)]
+        build = {
+            "properties": properties,
+            "text": ["build", "successful"],
+            "results": 0,
+            "steps": [
+                {"name": "s{}".format(j), "text": ["x"] * 5,
+                 "logs": [["stdio", "http://ci/{}".format(j)]]}
+                for j in range(10)
+            ],
+        }
+        packets.append({"event": "buildStarted",
+                        "payload": {"build": build}})
+        for j in range(10):
+            packets.append({
+                "event": "stepFinished",
+                "payload": {
+                    "step": {"name": "s{}".format(j),
+                             "text": ["log line " * 50]},
+                    "properties": properties,
+                },
+            })
+        packets.append({"event": "buildFinished",
+                        "payload": {"build": build}})
+    return json.dumps(packets)
+
+
+def parse_at_once(text):
+    return [BuildbotBuild(p) for p in json.loads(text)
+            if p["event"] in EVENTS]
+
+
+def parse_streaming(text):
+    return [BuildbotBuild(p) for p in iter_packets(text, EVENTS)]
+
+
+def main():
+    builds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    text = make_packets(builds)
+    print("{} builds, {} KiB of packets".format(builds, len(text) // 1024))
+
+    for parse in (parse_at_once, parse_streaming):
+        elapsed = min(timeit.repeat(lambda: parse(text), number=5,
+                                    repeat=3)) / 5
+        tracemalloc.start()
+        parse(text)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:<16} {:8.1f} ms {:8d} KiB peak".format(
+            parse.__name__, elapsed * 1000, peak // 1024))
+
+
+if __name__ == "__main__":
+    main()
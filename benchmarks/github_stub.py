@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Local stub of Github API for benchmarks.
+
+Every commit belongs to a pull request whose number is derived from the
+sha, so lookups always succeed unless errors are injected.  Point
+``github.host`` of hindsight to it::
+
+    python benchmarks/github_stub.py --port 9200 --latency 50 --jitter 20
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import collections
+import itertools
+import json
+import random
+import re
+import time
+
+from tornado import gen
+from tornado import ioloop
+from tornado import web
+
+_REPO_RE = r"/repos/([^/]+)/([^/]+)"
+
+
+def get_pull_number(sha):
+    """Returns number of the pull request ``sha`` belongs to."""
+    digits = re.sub(r"[^0-9a-f]", "", sha.lower())[:6] or "0"
+    return int(digits, 16) % 10000 + 1
+
+
+class Stub(object):
+    """Behavior and counters of the stub."""
+    def __init__(self, latency=0, jitter=0, rate_limit=0, reset_interval=3600,
+                 error_rate=0, error_status=502):
+        """Initialize
+
+        :param latency: milliseconds to wait before responding
+        :param jitter: max extra milliseconds added to ``latency``
+        :param int rate_limit: requests of a token in ``reset_interval``, 0
+                               disables rate limit
+        :param int reset_interval: seconds between resets of rate limit
+        :param error_rate: ratio of requests fail with ``error_status``
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.reset_interval = reset_interval
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+        #: Number of requests by call.
+        self.calls = collections.Counter()
+        #: Number of injected errors by status code.
+        self.errors = collections.Counter()
+
+        # token -> (reset, used)
+        self._quotas = {}
+        self._comment_ids = itertools.count(1)
+
+    def take_quota(self, token):
+        """Returns ``(remaining, reset)`` of ``token`` after a request."""
+        now = int(time.time())
+        reset, used = self._quotas.get(token, (0, 0))
+        if reset <= now:
+            reset, used = now + self.reset_interval, 0
+        used += 1
+        self._quotas[token] = (reset, used)
+        return self.rate_limit - used, reset
+
+    def next_comment_id(self):
+        return next(self._comment_ids)
+
+    def stats(self):
+        return {
+            "calls": dict(self.calls),
+            "total": sum(self.calls.values()),
+            "errors": dict(self.errors),
+        }
+
+    def reset(self):
+        self.calls.clear()
+        self.errors.clear()
+        self._quotas.clear()
+
+
+class BaseHandler(web.RequestHandler):
+    call = None
+
+    def initialize(self, stub):
+        self.stub = stub
+
+    @gen.coroutine
+    def prepare(self):
+        stub = self.stub
+        stub.calls[self.call] += 1
+
+        delay = stub.latency + random.uniform(0, stub.jitter)
+        if delay:
+            yield gen.sleep(delay / 1000)
+
+        if stub.rate_limit:
+            token = self.request.headers.get("Authorization", "")
+            remaining, reset = stub.take_quota(token)
+            self.set_header("X-RateLimit-Limit", str(stub.rate_limit))
+            self.set_header("X-RateLimit-Remaining", str(max(remaining, 0)))
+            self.set_header("X-RateLimit-Reset", str(reset))
+            if remaining < 0:
+                stub.errors[403] += 1
+                self.set_status(403)
+                self.finish({"message": "API rate limit exceeded"})
+                return
+
+        if stub.error_rate and random.random() < stub.error_rate:
+            stub.errors[stub.error_status] += 1
+            self.set_status(stub.error_status)
+            self.finish({"message": "Injected error"})
+
+    def get_json(self):
+        return json.loads(self.request.body.decode("utf8") or "{}")
+
+
+class SearchHandler(BaseHandler):
+    call = "search"
+
+    def get(self):
+        match = re.search(r"\b([0-9a-f]{7,40})\b", self.get_argument("q"))
+        if match is None:
+            self.write({"total_count": 0, "items": []})
+            return
+        self.write({"total_count": 1, "items": [
+            {"number": get_pull_number(match.group(1))}]})
+
+
+class PullHandler(BaseHandler):
+    call = "pull"
+
+    def get(self, owner, name, num):
+        self.write({
+            "number": int(num),
+            "state": "open",
+            "title": "Pull request #{}".format(num),
+            "body": "",
+            "base": {"ref": "master"},
+            "head": {"ref": "branch-{}".format(num),
+                     "repo": {"full_name": "{}/{}".format(owner, name)}},
+            "maintainer_can_modify": False,
+        })
+
+
+class CommitHandler(BaseHandler):
+    call = "commit"
+
+    def get(self, owner, name, sha):
+        self.write({
+            "sha": sha,
+            "commit": {"message": "Merge pull request #{} from {}/branch"
+                                  .format(get_pull_number(sha), owner)},
+            "parents": [{"sha": sha}],
+        })
+
+
+class CommentsHandler(BaseHandler):
+    call = "create_comment"
+
+    def post(self, owner, name, num):
+        self.set_status(201)
+        self.write({"id": self.stub.next_comment_id(),
+                    "body": self.get_json().get("body")})
+
+
+class CommentHandler(BaseHandler):
+    call = "edit_comment"
+
+    def patch(self, owner, name, comment_id):
+        self.write({"id": int(comment_id),
+                    "body": self.get_json().get("body")})
+
+
+class GraphQLHandler(BaseHandler):
+    call = "graphql"
+
+    def post(self):
+        query = self.get_json()["query"]
+        data = {}
+        repo = None
+        for line in query.splitlines():
+            match = re.match(r"\s*(r\d+): repository", line)
+            if match:
+                repo = data[match.group(1)] = {}
+                continue
+            match = re.match(r'\s*(c\d+): object\(oid: "([^"]+)"\)', line)
+            if match and repo is not None:
+                repo[match.group(1)] = {"associatedPullRequests": {
+                    "nodes": [{"number": get_pull_number(match.group(2))}],
+                }}
+        self.write({"data": data})
+
+
+class StatsHandler(web.RequestHandler):
+    def initialize(self, stub):
+        self.stub = stub
+
+    def get(self):
+        self.write(self.stub.stats())
+
+    def delete(self):
+        self.stub.reset()
+
+
+def make_app(stub):
+    kwargs = {"stub": stub}
+    return web.Application([
+        (r"/search/issues", SearchHandler, kwargs),
+        (_REPO_RE + r"/pulls/(\d+)", PullHandler, kwargs),
+        (_REPO_RE + r"/commits/([^/]+)", CommitHandler, kwargs),
+        (_REPO_RE + r"/issues/(\d+)/comments", CommentsHandler, kwargs),
+        (_REPO_RE + r"/issues/comments/(\d+)", CommentHandler, kwargs),
+        (r"/graphql", GraphQLHandler, kwargs),
+        (r"/_stats", StatsHandler, kwargs),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds to wait before responding")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="max extra milliseconds of latency")
+    parser.add_argument("--rate-limit", type=int, default=0,
+                        help="requests of a token per reset interval")
+    parser.add_argument("--reset-interval", type=int, default=3600)
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="ratio of requests fail")
+    parser.add_argument("--error-status", type=int, default=502)
+    args = parser.parse_args()
+
+    stub = Stub(args.latency, args.jitter, args.rate_limit,
+                args.reset_interval, args.error_rate, args.error_status)
+    make_app(stub).listen(args.port, "127.0.0.1")
+    print("Github stub on http://127.0.0.1:{}".format(args.port))
+    ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
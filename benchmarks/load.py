@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Replays webhook payloads against a running hindsight at a target rate.
+
+Run hindsight with ``github.host`` pointed to ``github_stub.py``, then::
+
+    python benchmarks/load.py run --url http://127.0.0.1:9100 \\
+        --stub http://127.0.0.1:9200 --pid $(pgrep -f hindsight.app) \\
+        --rps 50 --duration 30 --output results/new.json
+    python benchmarks/load.py compare results/old.json results/new.json
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import subprocess
+import time
+
+try:
+    from urllib import urlencode
+    from urlparse import parse_qsl
+except ImportError:
+    from urllib.parse import parse_qsl, urlencode
+
+from tornado import gen
+from tornado import httpclient
+from tornado import ioloop
+
+_SHA_RE = re.compile(r"\b[0-9a-f]{40}\b")
+
+_PACKETS_FILE = os.path.join(os.path.dirname(__file__), "..", "tests",
+                             "_buildbot-packets.json")
+
+
+def load_payloads(path, secret):
+    """Returns requests recorded by ``recorder.py``, or a request of the
+    packets in tests if ``path`` is ``None``.
+    """
+    if path is None:
+        with io.open(_PACKETS_FILE, encoding="utf8") as f:
+            packets = f.read()
+        return [{
+            "path": "/deployment",
+            "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+            "body": urlencode({"secret": secret, "packets": packets}),
+        }]
+
+    with io.open(path, encoding="utf8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_unique(payload, seq):
+    """Returns body of ``payload`` whose commit shas are replaced with shas
+    unique to ``seq``, so requests are not answered by cache.
+    """
+    def replace(text):
+        return _SHA_RE.sub(
+            lambda m: hashlib.sha1("{}-{}".format(m.group(0), seq).encode(
+                "utf8")).hexdigest(),
+            text,
+        )
+
+    content_type = payload["headers"].get("Content-Type", "")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return urlencode([(name, replace(value)) for name, value
+                          in parse_qsl(payload["body"])])
+    return replace(payload["body"])
+
+
+def percentile(values, percent):
+    """Returns nearest-rank ``percent`` percentile of sorted ``values``."""
+    if not values:
+        return None
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def read_memory(pid):
+    """Returns current and peak RSS in KiB of process ``pid`` on Linux."""
+    memory = {}
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    memory[name] = int(value.split()[0])
+    except IOError:
+        return None
+    return {"rss_kb": memory.get("VmRSS"), "max_rss_kb": memory.get("VmHWM")}
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"]).decode("utf8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@gen.coroutine
+def fetch_json(url, method="GET"):
+    resp = yield httpclient.AsyncHTTPClient().fetch(
+        url, method=method, raise_error=False,
+        body=None if method == "GET" else "",
+        allow_nonstandard_methods=True,
+    )
+    if resp.code != 200 or not resp.body:
+        raise gen.Return(None)
+    raise gen.Return(json.loads(resp.body.decode("utf8")))
+
+
+@gen.coroutine
+def run(args):
+    client = httpclient.AsyncHTTPClient()
+    payloads = load_payloads(args.payloads, args.secret)
+    total = int(args.rps * args.duration)
+
+    if args.stub:
+        yield fetch_json(args.stub + "/_stats", method="DELETE")
+
+    latencies = []
+    codes = {}
+
+    @gen.coroutine
+    def send(seq, payload):
+        if args.unique_shas:
+            body = make_unique(payload, seq)
+        else:
+            body = payload["body"]
+        start = time.time()
+        resp = yield client.fetch(
+            args.url + payload["path"], method="POST",
+            headers=payload["headers"], body=body, raise_error=False,
+            request_timeout=args.timeout,
+        )
+        latencies.append(time.time() - start)
+        codes[resp.code] = codes.get(resp.code, 0) + 1
+
+    # Open loop, requests are sent on schedule even if responses are slow.
+    start = time.time()
+    futures = []
+    for seq, payload in zip(range(total), itertools.cycle(payloads)):
+        delay = start + seq / args.rps - time.time()
+        if delay > 0:
+            yield gen.sleep(delay)
+        futures.append(send(seq, payload))
+    yield futures
+    elapsed = time.time() - start
+
+    # Builds queued by async ingest are reported after responses.
+    yield gen.sleep(args.settle)
+
+    latencies.sort()
+    result = {
+        "label": args.label or get_revision(),
+        "time": time.time(),
+        "target_rps": args.rps,
+        "requests": total,
+        "rps": total / elapsed,
+        "codes": {str(code): count for code, count in sorted(codes.items())},
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "github": None,
+        "memory": read_memory(args.pid) if args.pid else None,
+    }
+    if args.stub:
+        github = yield fetch_json(args.stub + "/_stats")
+        github["per_webhook"] = github["total"] / total if total else None
+        result["github"] = github
+    raise gen.Return(result)
+
+
+def _flatten(result):
+    """Returns ``[(name, value)]`` compared between results."""
+    latency = result["latency"]
+    github = result.get("github") or {}
+    memory = result.get("memory") or {}
+    errors = sum(count for code, count in result["codes"].items()
+                 if not code.startswith("2"))
+    return [
+        ("rps", result["rps"]),
+        ("p50 ms", latency["p50"] and latency["p50"] * 1000),
+        ("p95 ms", latency["p95"] and latency["p95"] * 1000),
+        ("p99 ms", latency["p99"] and latency["p99"] * 1000),
+        ("errors", errors),
+        ("github/webhook", github.get("per_webhook")),
+        ("max rss KiB", memory.get("max_rss_kb")),
+    ]
+
+
+def compare(paths):
+    results = []
+    for path in paths:
+        with io.open(path, encoding="utf8") as f:
+            results.append(json.load(f))
+
+    print("{:<16}".format("") + "".join(
+        "{:>22}".format(r["label"] or os.path.basename(p))
+        for r, p in zip(results, paths)))
+    base = _flatten(results[0])
+    rows = [_flatten(r) for r in results]
+    for i, (name, base_value) in enumerate(base):
+        cells = []
+        for row in rows:
+            value = row[i][1]
+            if value is None:
+                cells.append("{:>22}".format("-"))
+                continue
+            cell = "{:.2f}".format(value)
+            if base_value and row is not rows[0]:
+                cell += " ({:+.1f}%)".format(
+                    (value - base_value) / base_value * 100)
+            cells.append("{:>22}".format(cell))
+        print("{:<16}".format(name) + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="replay payloads")
+    run_parser.add_argument("--url", default="http://127.0.0.1:9100",
+                            help="URL of hindsight")
+    run_parser.add_argument("--payloads",
+                            help="file recorded by recorder.py, defaults "
+                                 "to packets in tests")
+    run_parser.add_argument("--secret", default="mock-secret",
+                            help="secret of default payload")
+    run_parser.add_argument("--rps", type=float, default=20)
+    run_parser.add_argument("--duration", type=float, default=10,
+                            help="seconds to send requests")
+    run_parser.add_argument("--unique-shas", action="store_true",
+                            help="use new commit shas in each request")
+    run_parser.add_argument("--stub", help="URL of github_stub.py")
+    run_parser.add_argument("--pid", type=int,
+                            help="process of hindsight to read memory")
+    run_parser.add_argument("--settle", type=float, default=2,
+                            help="seconds to wait for queued builds")
+    run_parser.add_argument("--timeout", type=float, default=60)
+    run_parser.add_argument("--label", help="defaults to git revision")
+    run_parser.add_argument("--output", help="file to save result in JSON")
+
+    compare_parser = subparsers.add_parser("compare",
+                                           help="compare saved results")
+    compare_parser.add_argument("results", nargs="+")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.results)
+        return
+    if args.command != "run":
+        parser.error("command is required")
+
+    httpclient.AsyncHTTPClient.configure(None, max_clients=1000)
+    result = ioloop.IOLoop.current().run_sync(lambda: run(args))
+    print(json.dumps(result, indent=2, sort_keys=True))
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
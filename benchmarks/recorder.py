@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Records webhook requests of Buildbot 8/9 for replay by ``load.py``.
+
+Point Buildbot to the recorder instead of hindsight, or use ``--forward``
+to keep reporting via hindsight while recording::
+
+    python benchmarks/recorder.py --port 9101 --output payloads.jsonl \\
+        --forward http://127.0.0.1:9100
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import io
+import json
+
+from tornado import gen
+from tornado import httpclient
+from tornado import ioloop
+from tornado import web
+
+# Headers needed to replay a request.
+_HEADERS = ("Authorization", "Content-Type")
+
+
+class RecordHandler(web.RequestHandler):
+    def initialize(self, output, forward):
+        self.output = output
+        self.forward = forward
+
+    @gen.coroutine
+    def post(self):
+        record = {
+            "path": self.request.path,
+            "headers": {
+                name: self.request.headers[name] for name in _HEADERS
+                if name in self.request.headers
+            },
+            "body": self.request.body.decode("utf8"),
+        }
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+        if self.forward is None:
+            self.write("OK")
+            return
+
+        resp = yield httpclient.AsyncHTTPClient().fetch(
+            self.forward + self.request.uri, method="POST",
+            headers=record["headers"], body=self.request.body,
+            raise_error=False,
+        )
+        self.set_status(resp.code if resp.code >= 200 else 502)
+        if resp.body:
+            self.write(resp.body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--output", default="payloads.jsonl",
+                        help="JSON lines file to append requests")
+    parser.add_argument("--forward", help="URL of hindsight to forward to")
+    args = parser.parse_args()
+
+    output = io.open(args.output, "a", encoding="utf8")
+    web.Application([
+        (r"/.*", RecordHandler, {
+            "output": output,
+            "forward": args.forward and args.forward.rstrip("/"),
+        }),
+    ]).listen(args.port)
+    print("Record to {} on port {}".format(args.output, args.port))
+    ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,73 +3,841 @@
 """Server of zenref to handle Github Webhook"""
 from __future__ import print_function, division, unicode_literals
 
-import sys
-import collections
+import argparse
+import asyncio
+import copy
+import signal
 
 import toml
-
+from tornado import gen
 from tornado import web
 from tornado import httpserver
 from tornado import ioloop
 from tornado import log
+from tornado import netutil
+from tornado import process
+from tornado.log import gen_log
 
-from asyncat.client import AsyncGithubClient
+from asyncat.repository import Repository
 
+from . import cache
+from . import comment
+from . import dedup
 from . import deployment
 from . import finder
+from . import graphql
+from . import httpcache
+from . import index
+from . import journal
+from . import metrics
+from . import registry
+from . import reporter
+from . import resilience
+from . import scheduler
+from . import state
+from . import stats
+from . import transport
+from . import tracing
+from . import webhook
+from . import worker
+
+# Seconds between checks of a pull request looked up by another process.
+_LOOKUP_POLL_INTERVAL = 0.1
+
+
+def check_state_config(state_config, processes):
+    """Check ``[state]`` config can serve ``processes`` worker processes.
+
+    :raises ValueError: if the backend is not shared by multiple processes
+    """
+    if processes > 1 and (state_config.get("backend") or
+                          "memory") == state.MemoryBackend.name:
+        raise ValueError("[state] backend shared by processes is "
+                         "required by multiple worker processes")
+
+
+def _load_config(config_file):
+    """Returns config, registry and signature of sources loaded."""
+    config, repo_registry = registry.load_config(config_file)
+    return config, repo_registry, registry.get_signature(config_file, config)
 
 
 class Application(web.Application):
     """Application."""
-    def __init__(self, config_file):
-        """Use config file to initialize application."""
-        with open(config_file) as f:
-            self.config = toml.load(f)
+    def __init__(self, config_file, process_index=0, processes=1):
+        """Use config file to initialize application.
+
+        :param int process_index: index of current worker process
+        :param int processes: number of worker processes
+        :raises ValueError: if ``[state]`` is not shared by multiple
+                            processes
+        """
+        self.config_file = config_file
+        self.process_index = process_index
+        self.processes = processes
+        self.config, self.registry = registry.load_config(config_file)
+        self._config_signature = registry.get_signature(config_file,
+                                                        self.config)
+        #: Number of reloads of repository configs.
+        self.reloads = 0
+
+        # (owner, name, priority) -> Repository, cleared when reloaded.
+        self._repo_instances = {}
+        # (owner, name) -> reporters, cleared when reloaded.
+        self._reporters = {}
+
+        state_config = self.config.get("state", {})
+        check_state_config(state_config, processes)
+        if state_config.get("backend"):
+            self.state = state.make_backend(state_config)
+        else:
+            self.state = None
+        # Seconds to wait for a pull request looked up by another process.
+        self._lookup_wait = state_config.get("lookup_wait", 2)
+
+        github_config = self.config["github"]
+        tokens = (github_config.get("access_tokens") or
+                  [github_config["access_token"]])
+        self.metrics = metrics.PipelineMetrics()
+        self.metrics.add_collector(self._collect_metrics)
+        # (owner, name) -> RepoMetrics, bound again when reloaded.
+        self._repo_metrics = self._bind_repo_metrics()
 
-        self._secret_builder_to_repo = collections.defaultdict(dict)
+        resilience_config = self.config.get("resilience", {})
+        if resilience_config.get("enabled", False):
+            backoff = resilience.Backoff(
+                retries=resilience_config.get("retries", 2),
+                base=resilience_config.get("backoff", 0.5),
+                cap=resilience_config.get("max_backoff", 10),
+            )
+            self.circuit_breakers = resilience.CircuitBreakers(
+                failure_threshold=resilience_config.get("failure_threshold",
+                                                        5),
+                reset_timeout=resilience_config.get("reset_timeout", 30),
+            )
+        else:
+            backoff = self.circuit_breakers = None
 
-        for name, config in self.config["repo"].items():
-            secret = config["secret"]
-            builder = config.get("builder")
+        http_cache_config = self.config.get("http_cache", {})
+        if http_cache_config.get("enabled", False):
+            self.response_cache = httpcache.ResponseCache(
+                size=http_cache_config.get("size", 4096),
+                path=self._get_process_path(http_cache_config.get("path")),
+            )
+        else:
+            self.response_cache = None
 
-            self._secret_builder_to_repo[secret][builder] = name
+        if github_config.get("http_backend"):
+            self.transport = transport.PooledTransport(
+                backend=github_config["http_backend"],
+                max_clients=github_config.get("max_clients", 10),
+                connect_timeout=github_config.get("connect_timeout", 20),
+                request_timeout=github_config.get("request_timeout", 20),
+                http2=github_config.get("http2", False),
+                metrics=self.metrics,
+            )
+        else:
+            self.transport = None
 
-        self._secrets_map = {
-            config["secret"]: name
-            for name, config in self.config["repo"].items()
+        self.github_client = scheduler.GithubScheduler(
+            tokens, metrics=self.metrics,
+            host=github_config.get("host") or None,
+            backoff=backoff, breakers=self.circuit_breakers,
+            response_cache=self.response_cache,
+            transport=self.transport,
+        )
+        self._prioritized_clients = {
+            priority: self.github_client.prioritized(priority)
+            for priority in (scheduler.PRIORITY_HIGH,
+                             scheduler.PRIORITY_NORMAL,
+                             scheduler.PRIORITY_LOW)
         }
 
-        access_token = self.config["github"]["access_token"]
-        self.github_client = AsyncGithubClient(access_token)
+        cache_config = self.config.get("cache", {})
+        self.pull_cache = cache.LRUCache(
+            size=cache_config.get("size", 1024),
+            ttl=cache_config.get("ttl", 3600),
+        )
+        self._negative_ttl = cache_config.get("negative_ttl", 60)
+        # Commits are immutable, so keep them as long as possible.
+        self.commit_cache = cache.LRUCache(
+            size=cache_config.get("commit_size", 1024),
+            ttl=cache_config.get("commit_ttl", 86400),
+        )
+
+        # Github webhook maintains the index.
+        self._github_webhook = bool(
+            self.config["github"].get("webhook_secret"))
+
+        index_config = self.config.get("index", {})
+        if index_config.get("enabled", False) or self._github_webhook:
+            self.pull_index = index.PullRequestIndex(
+                self._prioritized_clients[scheduler.PRIORITY_LOW],
+                path=self._get_process_path(index_config.get("path")),
+                max_pages=index_config.get("max_pages", 10),
+            )
+        else:
+            self.pull_index = None
+
+        finder_config = self.config.get("finder", {})
+        self._speculative = finder_config.get("speculative", False)
+
+        graphql_config = self.config.get("graphql", {})
+        if graphql_config.get("enabled", False):
+            self.resolver = graphql.BatchResolver(
+                self.github_client,
+                max_batch=graphql_config.get("max_batch", 50),
+                window=graphql_config.get("window", 0.01),
+                host=graphql_config.get("host") or None,
+            )
+        else:
+            self.resolver = None
+
+        # Lookups in progress, keyed same as ``pull_cache``.
+        self._inflight_pulls = {}
+
+        ingest_config = self.config.get("ingest", {})
+        # Max number of builds in one request reported concurrently.
+        self.batch_concurrency = ingest_config.get("batch_concurrency", 4)
+        if ingest_config.get("mode", "sync") == "async":
+            self.workers = worker.WorkerPool(
+                self._report_queued_build,
+                workers=ingest_config.get("workers", 4),
+                per_repo=ingest_config.get("per_repo", 2),
+                max_queue=ingest_config.get("max_queue", 1000),
+            )
+        else:
+            self.workers = None
+
+        comment_config = self.config.get("comment", {})
+        if comment_config.get("mode", "new") == "edit":
+            self.status_board = comment.StatusBoard(
+                debounce=comment_config.get("debounce", 2),
+                state=self.state,
+            )
+        else:
+            self.status_board = None
+
+        journal_config = self.config.get("journal", {})
+        if self.workers is not None and journal_config.get("path"):
+            self.journal = journal.BuildJournal(
+                journal_config["path"],
+                batch_size=journal_config.get("batch_size", 100),
+                flush_interval=journal_config.get("flush_interval", 0.05),
+                synchronous=journal_config.get("synchronous", "NORMAL"),
+                timeout=journal_config.get("busy_timeout", 0.1),
+                shared=processes > 1,
+            )
+        else:
+            self.journal = None
+
+        # Ids of builds in journal queued by current process.
+        self._queued_ids = set()
+        self._last_claimed = 0
+
+        dedup_config = self.config.get("dedup", {})
+        if dedup_config.get("enabled", False) and self.state is not None:
+            self.dedup = state.StateDedupSet(
+                self.state, window=dedup_config.get("window", 600))
+        elif dedup_config.get("enabled", False):
+            self.dedup = dedup.DedupSet(
+                size=dedup_config.get("size", 10000),
+                window=dedup_config.get("window", 600),
+                bloom_capacity=dedup_config.get("bloom_capacity", 0),
+                bloom_error_rate=dedup_config.get("bloom_error_rate",
+                                                  0.0001),
+            )
+        else:
+            self.dedup = None
+
+        tracing_config = self.config.get("tracing", {})
+        if tracing_config.get("enabled", False):
+            self.tracer = tracing.Tracer(
+                size=tracing_config.get("size", 100),
+                slowest_ttl=tracing_config.get("slowest_ttl", 3600),
+                profile_every=tracing_config.get("profile_every", 0),
+            )
+        else:
+            self.tracer = None
+
+        handlers = [
+            (r'/deployment', deployment.DeploymentHandler),
+            (r'/stats', stats.StatsHandler),
+            (r'/metrics', metrics.MetricsHandler),
+        ]
+        if self._github_webhook:
+            handlers.append((r'/github', webhook.GithubWebhookHandler))
+        if self.tracer is not None:
+            handlers.append((r'/debug/traces', tracing.TracesHandler))
 
-        super(Application, self).__init__(
-            [
-                (r'/deployment', deployment.DeploymentHandler),
-            ],
-            **self.config["server"])
+        super(Application, self).__init__(handlers, **self.config["server"])
+
+    def iter_repos(self):
+        """Iterates ``(owner, name)`` of configured repositories."""
+        return iter(self.registry)
+
+    def iter_owned_repos(self):
+        """Iterates ``(owner, name)`` of configured repositories owned by
+        current process.
+        """
+        return (key for key in self.registry if self.owns_repo(*key))
+
+    def iter_indexed_repos(self):
+        """Iterates ``(owner, name)`` of configured repositories current
+        process indexes.  Builds are reported by any process receiving them,
+        unless the journal hands them over to the owners.
+        """
+        if self.journal is not None:
+            return self.iter_owned_repos()
+        return self.iter_repos()
+
+    def owns_repo(self, owner, name):
+        """Returns True if current process reports builds of repository when
+        builds are queued.
+        """
+        return state.get_owner(owner, name,
+                               self.processes) == self.process_index
+
+    def _get_process_path(self, path):
+        """Returns ``path`` of a file not shared by processes."""
+        if path is None or self.processes <= 1:
+            return path
+        return "{}.{}".format(path, self.process_index)
+
+    @staticmethod
+    def get_priority(build):
+        """Returns priority of requests to report ``build``, finished builds
+        are prior to others when rate limit is exhausted.
+        """
+        if build.get_status() in (deployment.BuildStatus.success,
+                                  deployment.BuildStatus.failure):
+            return scheduler.PRIORITY_HIGH
+        return scheduler.PRIORITY_NORMAL
+
+    def get_github_client(self, build):
+        """Returns Github client to report ``build``."""
+        return self._prioritized_clients[self.get_priority(build)]
+
+    def get_repo(self, owner, name, build):
+        """Returns :class:`asyncat.repository.Repository` to report
+        ``build``, instances are reused until repository configs reload.
+        """
+        priority = self.get_priority(build)
+        key = (owner, name, priority)
+        repo = self._repo_instances.get(key)
+        if repo is None:
+            repo = self._repo_instances[key] = Repository(
+                self._prioritized_clients[priority], owner, name)
+        return repo
+
+    def get_reporters(self, owner, name):
+        """Returns reporters of repository, see
+        :func:`~hindsight.reporter.make_reporters`.
+        """
+        key = (owner, name)
+        reporters = self._reporters.get(key)
+        if reporters is None:
+            reporters = self._reporters[key] = reporter.make_reporters(
+                self.registry.get_config(owner, name), self.status_board,
+                self.state)
+        return reporters
 
     def find_repo_config(self, secret, builder=None):
         """Use secret and builder to find repo config."""
-        name = self._secret_builder_to_repo[secret][builder]
-        return self.config["repo"][name]
+        return self.registry.find(secret, builder)
+
+    @gen.coroutine
+    def reload_config(self):
+        """Reload repository configs in a thread, and replace lookup indexes
+        at once when done, other sections need restart to take effect.
+
+        :returns: False if failed to load
+        """
+        try:
+            config, repo_registry, signature = yield ioloop.IOLoop.current(
+            ).run_in_executor(None, _load_config, self.config_file)
+        except Exception:   # pylint: disable=W0703
+            gen_log.error("Could not reload config %s", self.config_file,
+                          exc_info=True)
+            raise gen.Return(False)
+
+        self.config["repos"] = config.get("repos", {})
+        self.registry = repo_registry
+        # Not reloaded again by the next poll of reload_if_changed.
+        self._config_signature = signature
+        self._repo_instances = {}
+        self._reporters = {}
+        self._repo_metrics = self._bind_repo_metrics()
+        self.reloads += 1
+        gen_log.info("Reloaded %d repositories from %s", len(repo_registry),
+                     self.config_file)
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def reload_if_changed(self):
+        """Reload repository configs if any of their sources changed.
+
+        :returns: True if reloaded
+        """
+        signature = yield ioloop.IOLoop.current().run_in_executor(
+            None, registry.get_signature, self.config_file, self.config)
+        if signature == self._config_signature:
+            raise gen.Return(False)
+
+        self._config_signature = signature
+        reloaded = yield self.reload_config()
+        raise gen.Return(reloaded)
+
+    async def find_pull(self, repo, sha, trace=None):
+        """Find pull request in repository via commit sha, the result is
+        cached by ``(owner, name, sha)`` include
+        :class:`~hindsight.finder.NoSuchPullRequest`.
 
-    def find_pull(self, repo, sha):
-        """Find pull request in repository via commit sha.
+        Concurrent calls with the same commit share one lookup, they all get
+        its result or its exception.  Steps of the lookup are recorded in the
+        trace of the call started it.
 
+        :type trace: :class:`~hindsight.tracing.Trace`
         :rtype: :class:`asyncat.repository.PullRequest`
         """
-        return finder.PullRequestFinder(repo, sha).find()
+        trace = tracing.NULL_TRACE if trace is None else trace
+        key = (repo.owner, repo.label, sha)
+        try:
+            pull = self.pull_cache[key]
+        except KeyError:
+            pass
+        else:
+            with trace.span("find_pull", sha=sha, source="cache"):
+                if pull is None:
+                    raise finder.NoSuchPullRequest(sha)
+                return pull
+
+        future = self._inflight_pulls.get(key)
+        if future is None:
+            source = "lookup"
+            future = asyncio.ensure_future(
+                self._lookup_pull(repo, sha, key, trace))
+            self._inflight_pulls[key] = future
+            future.add_done_callback(
+                lambda f: self._inflight_pulls.pop(key, None))
+        else:
+            source = "coalesced"
+
+        with trace.span("find_pull", sha=sha, source=source):
+            # A caller cancelled doesn't cancel the lookup shared by others.
+            return await asyncio.shield(future)
+
+    async def _lookup_pull(self, repo, sha, key, trace):
+        """Find pull request via :class:`~hindsight.finder.PullRequestFinder`
+        and cache the result with ``key``, the result is shared with other
+        processes and nodes if :attr:`state` is enabled.
+        """
+        if self.state is not None:
+            try:
+                found, num, locked = await self.state.begin_lookup(
+                    key, self._lookup_wait)
+                if not (found or locked):
+                    # Being looked up by another process.
+                    found, num = await self._wait_shared_pull(key)
+            except state.StateError as e:
+                gen_log.warning("Could not get shared pull of %s: %s",
+                                sha, e)
+                found = False
+            if found:
+                pull = await self._get_shared_pull(repo, sha, key, num, trace)
+                return pull
+
+        try:
+            pull = await finder.PullRequestFinder(
+                repo, sha, index=self.pull_index,
+                parsers=self.registry.get_parsers(repo.owner, repo.label),
+                commit_cache=self.commit_cache,
+                speculative=self._speculative,
+                resolver=self.resolver,
+                trace=trace,
+            ).find()
+        except finder.NoSuchPullRequest:
+            await self._set_pull(key, None)
+            raise
+
+        await self._set_pull(key, pull)
+        return pull
+
+    async def _wait_shared_pull(self, key):
+        """Returns ``(found, num)`` of ``key`` looked up by another process,
+        waits at most :attr:`_lookup_wait` seconds.
+        """
+        deadline = ioloop.IOLoop.current().time() + self._lookup_wait
+        while ioloop.IOLoop.current().time() < deadline:
+            await gen.sleep(_LOOKUP_POLL_INTERVAL)
+            found, num = await self.state.get_pull(key)
+            if found:
+                return found, num
+        return False, None
+
+    async def _get_shared_pull(self, repo, sha, key, num, trace):
+        with trace.span("shared", num=num):
+            if num is None:
+                self.pull_cache.set(key, None, ttl=self._negative_ttl)
+                raise finder.NoSuchPullRequest(sha)
+            pull = await repo.pull(num)
+        self.pull_cache.set(key, pull)
+        return pull
+
+    async def _set_pull(self, key, pull):
+        """Cache ``pull`` of ``key``, ``None`` if not found."""
+        if pull is None:
+            ttl = self._negative_ttl
+            self.pull_cache.set(key, None, ttl=ttl)
+        else:
+            ttl = self.pull_cache.ttl
+            self.pull_cache.set(key, pull)
+        if self.state is not None:
+            try:
+                await self.state.finish_lookup(key, pull and pull.num, ttl)
+            except state.StateError as e:
+                gen_log.warning("Could not share pull of %s: %s", key[2], e)
+
+    async def share_pulls(self, owner, name, shas, num):
+        """Share pull request ``num`` of ``shas`` with other processes and
+        nodes if :attr:`state` is enabled, so they don't search them.
+        """
+        if self.state is None:
+            return
+        try:
+            await self.state.set_pulls([(owner, name, sha) for sha in shas],
+                                       num, self.pull_cache.ttl)
+        except state.StateError as e:
+            gen_log.warning("Could not share pull #%s: %s", num, e)
+
+    async def report_build(self, repo, build, trace=None):
+        """Report status of build to the pull request that the commit of
+        build belongs to.
+
+        :type repo: :class:`asyncat.repository.Repository`
+        :type build: :class:`~hindsight.deployment.BaseCIBuild`
+        :type trace: :class:`~hindsight.tracing.Trace`
+        :raises asyncat.client.GithubError: if failed to request Github
+        """
+        trace = tracing.NULL_TRACE if trace is None else trace
+        start = metrics.now()
+        result = "error"
+        try:
+            await self._report_build(repo, build, trace)
+            result = "reported"
+        except finder.NoSuchPullRequest:
+            result = "not_found"
+        except resilience.CircuitOpen:
+            result = "circuit_open"
+            raise
+        finally:
+            self._get_repo_metrics(repo.owner, repo.label).observe_report(
+                build.get_name(), metrics.now() - start, result)
+
+    def _get_repo_metrics(self, owner, name):
+        """Returns :class:`~hindsight.metrics.RepoMetrics` of repository,
+        bound when the registry is loaded.
+        """
+        key = (owner, name)
+        repo_metrics = self._repo_metrics.get(key)
+        if repo_metrics is None:
+            repo_metrics = self._repo_metrics[key] = self.metrics.bind_repo(
+                owner, name)
+        return repo_metrics
+
+    def _bind_repo_metrics(self):
+        """Returns report metrics of configured repositories, so reports
+        don't build labels.
+        """
+        return {key: self.metrics.bind_repo(*key) for key in self.registry}
+
+    async def _report_build(self, repo, build, trace):
+        pull = None
+        for report in self.get_reporters(repo.owner, repo.label):
+            if report.needs_pull and pull is None:
+                pull = await self._find_build_pull(repo, build, trace)
+            with trace.span(report.name):
+                await report.report(repo, build, pull)
+
+    async def _find_build_pull(self, repo, build, trace):
+        gen_log.info(
+            "Try find pull requset via %s in %s/%s", build.get_sha(),
+            repo.owner, repo.label,
+        )
+
+        try:
+            pull = await self.find_pull(repo, build.get_sha(), trace)
+        except finder.NoSuchPullRequest:
+            gen_log.error(
+                "Could not find any pull request via %s in %s/%s",
+                build.get_sha(), repo.owner, repo.label,
+                exc_info=True,
+            )
+            raise
+
+        gen_log.info(
+            "Found pull request #%s via %s in %s/%s", pull.num,
+            build.get_sha(), repo.owner, repo.label,
+        )
+
+        # The pull request is cached and shared by other builds, comment
+        # with the client of current build on a copy of it.
+        pull = copy.copy(pull)
+        pull.client = repo.client
+        pull.repo = repo
+        return pull
+
+    def enqueue_build(self, repo, build):
+        """Queue build to report by background workers, and keep it in journal
+        until reported if journal is enabled.
+
+        With multiple processes and journal, a build of repository owned by
+        another process is handed over to it through journal.
+
+        :raises hindsight.worker.QueueFull: if the queue is full
+        :raises hindsight.journal.JournalError: if journal failed
+        """
+        worker_index = None
+        if self.journal is not None and self.processes > 1:
+            worker_index = state.get_owner(repo.owner, repo.label,
+                                           self.processes)
+            if worker_index != self.process_index:
+                self.journal.append(repo.owner, repo.label,
+                                    build.to_record(), worker_index)
+                return
+
+        if self.workers.full():
+            raise worker.QueueFull()
+
+        build_id = None
+        if self.journal is not None:
+            build_id = self.journal.append(repo.owner, repo.label,
+                                           build.to_record(), worker_index)
+            if worker_index is not None:
+                self._queued_ids.add(build_id)
+        self.workers.put_nowait(repo, build, build_id)
+
+    def replay_journal(self):
+        """Queue builds in journal not queued yet, they are left by last run
+        or handed over by other processes.
+
+        :returns: number of builds
+        """
+        if self.processes > 1:
+            worker_index = self.process_index
+            after = self._last_claimed
+        else:
+            # Only replayed when started.
+            worker_index = None
+            after = 0
+
+        count = 0
+        for build_id, owner, name, record in self.journal.iter_pending(
+                worker_index, after):
+            if worker_index is not None:
+                self._last_claimed = build_id
+                if build_id in self._queued_ids:
+                    continue
+                self._queued_ids.add(build_id)
+            build = deployment.BuildbotBuild.from_record(record)
+            repo = self.get_repo(owner, name, build)
+            self.workers.put(repo, build, build_id)
+            count += 1
+        return count
+
+    async def _report_queued_build(self, repo, build, build_id=None):
+        deferred = False
+        try:
+            await self.report_build(repo, build)
+        except resilience.CircuitOpen as e:
+            # Queue it again when the circuit may close, and keep it in
+            # journal meanwhile.
+            gen_log.warning("Defer build %s of %s/%s for %.0fs: %s",
+                            build.get_sha(), repo.owner, repo.label,
+                            e.retry_after, e)
+            ioloop.IOLoop.current().call_later(
+                e.retry_after, self.workers.put, repo, build, build_id)
+            deferred = True
+        finally:
+            if build_id is not None and not deferred:
+                self._queued_ids.discard(build_id)
+                self.journal.ack(build_id)
+
+    def log_request(self, handler):
+        """Record latency of ``handler`` after logged."""
+        super(Application, self).log_request(handler)
+        self.metrics.handler_seconds.labels(
+            type(handler).__name__, handler.get_status(),
+        ).observe(handler.request.request_time())
+
+    def _collect_metrics(self):
+        caches = metrics.Counter("hindsight_cache_requests_total",
+                                 "Cache lookups by result.",
+                                 ("cache", "result"))
+        for name, lru in (("pull", self.pull_cache),
+                          ("commit", self.commit_cache)):
+            caches.labels(name, "hit").value = lru.hits
+            caches.labels(name, "miss").value = lru.misses
+        if self.response_cache is not None:
+            caches.labels("response", "revalidated").value = (
+                self.response_cache.revalidated)
+            caches.labels("response", "miss").value = (
+                self.response_cache.misses)
+        collected = [caches]
+
+        if self.dedup is not None:
+            suppressed = metrics.Counter(
+                "hindsight_dedup_suppressed_total",
+                "Duplicate builds answered without reporting.")
+            suppressed.labels().value = self.dedup.suppressed
+            collected.append(suppressed)
+
+        if self.transport is not None:
+            pool = metrics.Gauge(
+                "hindsight_http_pool_requests",
+                "Github requests in flight or waiting for a slot.",
+                ("state",))
+            pool.labels("active").value = self.transport.active
+            pool.labels("waiting").value = self.transport.waiting
+            collected.append(pool)
+
+        if self.circuit_breakers is not None:
+            rejected = metrics.Counter(
+                "hindsight_circuit_rejected_total",
+                "Github requests rejected by open circuits.")
+            rejected.labels().value = self.circuit_breakers.rejected
+            collected.append(rejected)
+        return collected
+
+    async def sync_quotas(self):
+        """Exchange rate limits of tokens via :attr:`state`."""
+        try:
+            await self.github_client.sync_quotas(self.state)
+        except state.StateError as e:
+            gen_log.warning("Could not sync rate limits: %s", e)
+
+    def get_stats(self):
+        """Returns runtime statistics."""
+        stats = {
+            "github": self.github_client.stats(),
+            "pull_cache": self.pull_cache.stats(),
+            "commit_cache": self.commit_cache.stats(),
+            "inflight_pulls": len(self._inflight_pulls),
+            "repos": {
+                "count": len(self.registry),
+                "reloads": self.reloads,
+            },
+        }
+        if self.workers is not None:
+            stats["workers"] = self.workers.stats()
+        if self.journal is not None:
+            stats["journal"] = self.journal.stats()
+        if self.pull_index is not None:
+            stats["index"] = self.pull_index.stats()
+        if self.resolver is not None:
+            stats["graphql"] = self.resolver.stats()
+        if self.status_board is not None:
+            stats["comments"] = self.status_board.stats()
+        if self.dedup is not None:
+            stats["dedup"] = self.dedup.stats()
+        if self.state is not None:
+            stats["state"] = self.state.stats()
+        if self.processes > 1:
+            stats["process"] = {
+                "index": self.process_index,
+                "count": self.processes,
+            }
+        return stats
+
+
+def install_uvloop():
+    """Run asyncio, and tornado on it, with the event loop of uvloop.
+
+    :raises ImportError: if uvloop is not installed
+    """
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 def main():
-    app = Application(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Hindsight server.")
+    parser.add_argument("config", help="path of config file")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes, 0 for one per CPU, "
+                             "overrides server.workers")
+    parser.add_argument("--uvloop", action="store_true", default=None,
+                        help="use uvloop, overrides server.uvloop")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = toml.load(f)
+    server_config = config["server"]
+    use_uvloop = args.uvloop
+    if use_uvloop is None:
+        use_uvloop = server_config.get("uvloop", False)
+    if use_uvloop:
+        # Before any event loop is created.
+        install_uvloop()
+    processes = args.workers
+    if processes is None:
+        processes = server_config.get("workers", 1)
+    address, port = server_config["listen"].split(":")
 
-    http_server = httpserver.HTTPServer(app)
-    address, port = app.config["server"]["listen"].split(":")
-    http_server.listen(int(port), address)
-    http_server.start()
-    print("Start server on {}".format(app.config["server"]["listen"]))
+    if processes == 1:
+        app = Application(args.config)
+        http_server = httpserver.HTTPServer(app)
+        http_server.listen(int(port), address)
+        http_server.start()
+    else:
+        # Fork before Application is created, so each process has its own
+        # IOLoop, HTTP clients and database connections.
+        processes = processes or process.cpu_count()
+        try:
+            # Before forking, or every child fails and is restarted.
+            check_state_config(config.get("state", {}), processes)
+        except ValueError as e:
+            parser.error(str(e))
+        sockets = netutil.bind_sockets(int(port), address)
+        app = Application(args.config,
+                          process_index=process.fork_processes(processes),
+                          processes=processes)
+        http_server = httpserver.HTTPServer(app)
+        http_server.add_sockets(sockets)
+    print("Start server on {}".format(server_config["listen"]))
     log.enable_pretty_logging()
+    if app.journal is not None:
+        gen_log.info("Replay %d builds from journal", app.replay_journal())
+    index_config = app.config.get("index", {})
+    if index_config.get("enabled", False):
+        app.pull_index.start(
+            app.iter_indexed_repos,
+            index_config.get("refresh_interval", 300),
+        )
+
+    io_loop = ioloop.IOLoop.current()
+    if app.journal is not None and app.processes > 1:
+        ioloop.PeriodicCallback(
+            app.replay_journal,
+            app.config["journal"].get("claim_interval", 1) * 1000,
+        ).start()
+    sync_interval = app.config.get("state", {}).get("sync_interval", 5)
+    if app.state is not None and sync_interval:
+        ioloop.PeriodicCallback(
+            lambda: io_loop.spawn_callback(app.sync_quotas),
+            sync_interval * 1000,
+        ).start()
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(
+            signal.SIGHUP,
+            lambda signum, frame: io_loop.add_callback_from_signal(
+                app.reload_config),
+        )
+    watch_interval = app.config.get("repos", {}).get("watch_interval", 0)
+    if watch_interval:
+        ioloop.PeriodicCallback(
+            lambda: io_loop.spawn_callback(app.reload_if_changed),
+            watch_interval * 1000,
+        ).start()
     ioloop.IOLoop.current().start()
 
 
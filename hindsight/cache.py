@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Bounded caches."""
+from __future__ import print_function, division, unicode_literals
+
+import collections
+import time
+
+
+class LRUCache(object):
+    """A bounded mapping evicts the least recently used entry when full, each
+    entry expires after its own TTL.
+    """
+    def __init__(self, size=1024, ttl=3600, timer=time.time):
+        """Initialize
+
+        :param int size: max number of entries
+        :param ttl: default seconds to live of an entry
+        :param timer: function returns current time in seconds
+        """
+        self.size = size
+        self.ttl = ttl
+        self.timer = timer
+
+        #: Count of lookups that found a live entry.
+        self.hits = 0
+        #: Count of lookups that found nothing or an expired entry.
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self.timer()
+
+    def __getitem__(self, key):
+        """Returns value of ``key`` and mark it as recently used.
+
+        :raises KeyError: if ``key`` is missing or expired
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= self.timer():
+            self.misses += 1
+            raise KeyError(key)
+
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[1]
+
+    def get(self, key, default=None):
+        """Returns value of ``key``, or ``default`` if it's missing."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Set ``value`` of ``key``, evicts the least recently used entry
+        if the cache is full.
+
+        :param ttl: seconds to live, defaults to :attr:`ttl`
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        self._entries.pop(key, None)
+        self._entries[key] = (self.timer() + ttl, value)
+
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove ``key`` and returns its value."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def items(self):
+        """Returns list of ``(key, value)`` of live entries, they are not
+        marked as used.
+        """
+        now = self.timer()
+        return [(key, entry[1]) for key, entry in self._entries.items()
+                if entry[0] > now]
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries.clear()
+
+    def stats(self):
+        """Returns counters of current cache."""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
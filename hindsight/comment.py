@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Aggregated status comment of pull requests."""
+from __future__ import print_function, division, unicode_literals
+
+import collections
+
+from asyncat.client import GithubError
+from tornado import gen
+from tornado import ioloop
+from tornado.log import gen_log
+
+from .cache import LRUCache
+from .deployment import BuildStatus
+from .state import StateError
+
+# Seconds a process may hold the lock of writing a shared comment.
+_LOCK_TTL = 30
+
+# Times a failed write is retried, after doubled ``debounce`` each time.
+_RETRIES = 3
+
+
+class _PullComment(object):     # pylint: disable=R0903
+    """State of the status comment on a pull request."""
+    __slots__ = ("pull", "comment_id", "statuses", "changes", "failures",
+                 "timeout", "writing")
+
+    def __init__(self, pull):
+        self.pull = pull
+        self.comment_id = None
+        self.statuses = collections.OrderedDict()
+        # Statuses updated since the last write.
+        self.changes = collections.OrderedDict()
+        self.failures = 0
+        self.timeout = None
+        self.writing = False
+
+
+class StatusBoard(object):
+    """Keeps one comment on each pull request which lists latest status of
+    each builder, and edits it when a status changes.  Updates within
+    ``debounce`` seconds are written by one edit in background, so callers
+    never wait for the comment.
+
+    With ``state``, ids and statuses of comments are shared by processes
+    and nodes, one writes a comment at a time, and the comment lists statuses
+    updated by all of them.
+    """
+    def __init__(self, debounce=2, size=1024, ttl=7 * 24 * 3600,
+                 state=None):
+        """Initialize
+
+        :param debounce: seconds to gather updates before writing
+        :param int size: max number of pull requests to remember
+        :param ttl: seconds to remember a pull request
+        :param state: backend to share comments
+        :type state: :class:`~hindsight.state.StateBackend`
+        """
+        self.debounce = debounce
+        self.ttl = ttl
+        self.state = state
+
+        #: Number of comments created.
+        self.creates = 0
+        #: Number of comments edited.
+        self.edits = 0
+        #: Number of failed writes.
+        self.failures = 0
+
+        self._comments = LRUCache(size=size, ttl=ttl)
+
+    @staticmethod
+    def render(statuses):
+        """Returns body of comment.
+
+        :param statuses: ordered mapping of builder to
+                         :class:`~hindsight.deployment.BuildStatus`
+        """
+        lines = [
+            "Deployment status",
+            "",
+            "| Builder | Status |",
+            "| --- | --- |",
+        ]
+        for builder, status in statuses.items():
+            lines.append("| {} | {} |".format(builder, status.value))
+        return "\n".join(lines)
+
+    def update(self, pull, builder, status):
+        """Set status of ``builder`` on ``pull``, the comment is written
+        ``debounce`` seconds later.  A failed write is retried, then logged
+        and written with the next update.
+
+        :type pull: :class:`asyncat.repository.PullRequest`
+        :type status: :class:`~hindsight.deployment.BuildStatus`
+        """
+        key = (pull.repo.owner, pull.repo.label, pull.num)
+        state = self._comments.get(key)
+        if state is None:
+            state = _PullComment(pull)
+        # Refresh the entry, and comment with the latest client.
+        self._comments.set(key, state)
+        state.pull = pull
+
+        state.changes[builder] = status
+        if state.timeout is None and not state.writing:
+            self._write_later(state, self.debounce)
+
+    def _write_later(self, state, delay):
+        state.timeout = ioloop.IOLoop.current().call_later(
+            delay, self._write, state)
+
+    @gen.coroutine
+    def _write(self, state):
+        state.timeout = None
+        state.writing = True
+        changes, state.changes = state.changes, collections.OrderedDict()
+
+        # Write updates made while writing.
+        delay = self.debounce
+        try:
+            written = yield self._write_comment(state, changes)
+        except Exception as e:    # pylint: disable=W0703
+            self.failures += 1
+            self._restore(state, changes)
+            state.failures += 1
+            if state.failures <= _RETRIES:
+                delay = self.debounce * 2 ** state.failures
+                gen_log.warning("Could not write status comment of #%s, "
+                                "retry in %ss: %s", state.pull.num, delay, e)
+            else:
+                gen_log.warning("Could not write status comment of #%s: %s",
+                                state.pull.num, e)
+                state.failures = 0
+                delay = None
+        else:
+            if written:
+                state.failures = 0
+            else:
+                # Another process is writing, try again later.
+                self._restore(state, changes)
+        finally:
+            state.writing = False
+
+        if state.changes and delay is not None:
+            self._write_later(state, delay)
+
+    @staticmethod
+    def _restore(state, changes):
+        for builder, status in changes.items():
+            # Keep newer updates.
+            state.changes.setdefault(builder, status)
+
+    @gen.coroutine
+    def _write_comment(self, state, changes):
+        pull = state.pull
+        key = (pull.repo.owner, pull.repo.label, pull.num)
+
+        locked = False
+        statuses = state.statuses
+        if self.state is not None:
+            try:
+                locked, comment_id, shared = yield self.state.begin_comment(
+                    key, _LOCK_TTL)
+            except StateError as e:
+                gen_log.warning("Could not get status comment of #%s: %s",
+                                pull.num, e)
+            else:
+                if not locked:
+                    raise gen.Return(False)
+                if comment_id is not None:
+                    state.comment_id = comment_id
+                if shared:
+                    statuses = collections.OrderedDict(
+                        (builder, BuildStatus(value))
+                        for builder, value in shared)
+        statuses.update(changes)
+        state.statuses = statuses
+
+        try:
+            yield self._edit_or_create(state, self.render(statuses))
+        except Exception:
+            if locked:
+                yield self._share(self.state.release_comment(key), pull)
+            raise
+
+        if locked:
+            yield self._share(self.state.finish_comment(
+                key, state.comment_id,
+                [(builder, status.value)
+                 for builder, status in statuses.items()],
+                self.ttl), pull)
+        raise gen.Return(True)
+
+    @staticmethod
+    @gen.coroutine
+    def _share(future, pull):
+        try:
+            yield future
+        except StateError as e:
+            gen_log.warning("Could not share status comment of #%s: %s",
+                            pull.num, e)
+
+    @gen.coroutine
+    def _edit_or_create(self, state, body):
+        pull = state.pull
+        if state.comment_id is not None:
+            try:
+                yield pull.client.request(
+                    "{}/issues/comments/{}".format(pull.repo.base_path,
+                                                   state.comment_id),
+                    params={"body": body},
+                    method="PATCH",
+                )
+            except GithubError as e:
+                if e.status_code != 404:
+                    raise
+                gen_log.warning("Status comment %s of #%s is deleted",
+                                state.comment_id, pull.num)
+            else:
+                self.edits += 1
+                return
+
+        resp = yield pull.create_comment(body)
+        state.comment_id = resp.data["id"]
+        self.creates += 1
+
+    def stats(self):
+        """Returns number of pull requests, created and edited comments, and
+        failed writes.
+        """
+        return {
+            "pulls": len(self._comments),
+            "creates": self.creates,
+            "edits": self.edits,
+            "failures": self.failures,
+        }
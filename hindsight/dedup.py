@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Suppression of duplicate builds resent by CI."""
+from __future__ import print_function, division, unicode_literals
+
+import hashlib
+import math
+import struct
+import time
+
+from tornado import gen
+
+from .cache import LRUCache
+
+
+def make_key(secret, build):
+    """Returns idempotency key of ``build`` posted with ``secret``.
+
+    :type build: :class:`~hindsight.deployment.BaseCIBuild`
+    :rtype: bytes
+    """
+    parts = (secret, build.get_name(), build.get_sha(),
+             build.get_status().value, build.get_number())
+    return hashlib.sha1("\0".join(
+        "" if part is None else "{}".format(part) for part in parts
+    ).encode("utf8")).digest()[:16]
+
+
+class BloomFilter(object):
+    """Set of digests may report false positives at ``error_rate`` when it
+    holds ``capacity`` digests, never false negatives.
+    """
+    def __init__(self, capacity, error_rate):
+        """Initialize
+
+        :param int capacity: expected number of digests
+        :param float error_rate: rate of false positives at capacity
+        """
+        self.size = max(int(-capacity * math.log(error_rate) /
+                            math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing on two 64 bits halves of the digest.
+        h1, h2 = struct.unpack("<QQ", digest[:16])
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def __contains__(self, digest):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(digest))
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+
+class DedupSet(object):
+    """Remembers keys of builds reported in the last ``window`` seconds.
+
+    Recent keys are kept exactly in a LRU cache of ``size``.  With
+    ``bloom_capacity``, keys are also added to two Bloom filters swapped
+    every half ``window``, which remember many more keys in fixed memory at
+    the cost of suppressing a new build at ``bloom_error_rate``.
+    """
+    def __init__(self, size=10000, window=600, bloom_capacity=0,
+                 bloom_error_rate=0.0001, timer=time.time):
+        """Initialize
+
+        :param int size: max number of keys kept exactly
+        :param window: seconds to remember a key
+        :param int bloom_capacity: keys added in half ``window`` expected by
+                                   each Bloom filter, 0 disables them
+        :param float bloom_error_rate: rate of false positives of a filter
+        :param timer: function returns current time in seconds
+        """
+        self.window = window
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.timer = timer
+
+        #: Number of keys checked.
+        self.checked = 0
+        #: Number of duplicates suppressed.
+        self.suppressed = 0
+
+        self._recent = LRUCache(size=size, ttl=window, timer=timer)
+        # Keys being reported, a duplicate of them is suppressed too.
+        self._inflight = set()
+
+        if bloom_capacity:
+            self._blooms = [self._make_bloom(), self._make_bloom()]
+            self._rotate_at = timer() + window / 2
+        else:
+            self._blooms = []
+
+    def _make_bloom(self):
+        return BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+
+    def _rotate(self):
+        now = self.timer()
+        if now < self._rotate_at:
+            return
+        if now >= self._rotate_at + self.window / 2:
+            # Idle longer than the window, forget all.
+            self._blooms = [self._make_bloom(), self._make_bloom()]
+        else:
+            self._blooms = [self._make_bloom(), self._blooms[0]]
+        self._rotate_at = now + self.window / 2
+
+    def __contains__(self, key):
+        if key in self._inflight or key in self._recent:
+            return True
+        if self._blooms:
+            self._rotate()
+            return any(key in bloom for bloom in self._blooms)
+        return False
+
+    def begin(self, key):
+        """Start reporting a build with ``key``.
+
+        :returns: False if it's a duplicate, it should be suppressed
+        """
+        self.checked += 1
+        if key in self:
+            self.suppressed += 1
+            return False
+        self._inflight.add(key)
+        return True
+
+    def finish(self, key, reported=True):
+        """Finish reporting a build with ``key``, it's remembered only if
+        ``reported``, so a build failed to report can be retried.
+        """
+        self._inflight.discard(key)
+        if reported:
+            self._recent.set(key, True)
+            if self._blooms:
+                self._rotate()
+                self._blooms[0].add(key)
+
+    @gen.coroutine
+    def begin_all(self, keys):
+        """Same as :meth:`begin` of each key, returns a future resolves to
+        list of bool.
+        """
+        raise gen.Return([self.begin(key) for key in keys])
+
+    def finish_all(self, keys, reported=True):
+        """Same as :meth:`finish` of each key."""
+        for key in keys:
+            self.finish(key, reported)
+
+    def stats(self):
+        """Returns number of checked and suppressed builds."""
+        return {
+            "checked": self.checked,
+            "suppressed": self.suppressed,
+            "inflight": len(self._inflight),
+            "recent": len(self._recent),
+        }
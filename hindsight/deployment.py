@@ -6,18 +6,32 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import asyncio
 import base64
+import collections
 import json
+import math
 
 import enum
 
 from asyncat.client import GithubError
-from asyncat.repository import Repository
-from tornado import gen
+from tornado import locks
 from tornado import web
 from tornado.log import gen_log
 
-from .finder import NoSuchPullRequest
+from . import metrics
+from .dedup import make_key
+from .journal import JournalError
+from .packets import iter_packets
+from .resilience import CircuitOpen
+from .tracing import NULL_TRACE
+from .worker import QueueFull
+
+# Events of build in Buildbot 8 packets.
+_BUILD_EVENTS = frozenset(["buildStarted", "buildFinished"])
+
+# Properties of build used to report.
+_PROPERTIES = frozenset(["buildername", "revision", "got_revision"])
 
 
 class BuildStatus(enum.Enum):
@@ -30,6 +44,8 @@ class BuildStatus(enum.Enum):
 
 class BaseCIBuild(object):
     """Base class the ci builds."""
+    __slots__ = ("payload",)
+
     def __init__(self, payload):
         """Initialize.
 
@@ -41,6 +57,23 @@ class BaseCIBuild(object):
     def prepare(self):
         pass
 
+    def to_record(self):
+        """Returns fields of current build in a dict can be encoded to JSON,
+        fields are named by ``__slots__`` of subclass.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_record(cls, record):
+        """Returns a build from the result of :meth:`to_record`, fields
+        missing in older records are ``None``.
+        """
+        build = cls.__new__(cls)
+        build.payload = None
+        for name in cls.__slots__:
+            setattr(build, name, record.get(name))
+        return build
+
     def get_name(self):
         """Returns the name of current builder.  Returns ``None`` if current
         CI do not support.
@@ -58,6 +91,12 @@ class BaseCIBuild(object):
         """Returns the sha of current build."""
         raise NotImplementedError()     # pragma: no cover
 
+    def get_number(self):
+        """Returns the number of current build in its builder.  Returns
+        ``None`` if current CI do not support.
+        """
+        raise NotImplementedError()     # pragma: no cover
+
     def is_valid(self):
         """Returns True if current build is valid."""
         return True
@@ -79,43 +118,63 @@ class BaseCIWebhook(object):
         """
         raise NotImplementedError()     # pragma: no cover
 
+    def make_builds(self):
+        """Returns a list of objects represent builds in request.
+
+        :rtype: list of :class:`BaseCIBuild`
+        """
+        build = self.make_build()
+        return [] if build is None else [build]
+
     def get_secret(self):
         """Returns secret in request."""
         raise NotImplementedError()
 
 
 class BuildbotBuild(BaseCIBuild):
-    """Represents a build of buildbot."""
+    """Represents a build of buildbot, only fields used to report are kept
+    and the payload is dropped.
+    """
+    __slots__ = ("event", "name", "sha", "number", "results", "text")
+
     def prepare(self):
-        self.is_nine = self.payload.get("is_nine", False)
-        if self.is_nine:
-            if self.payload["complete"]:
+        payload, self.payload = self.payload, None
+
+        if payload.get("is_nine", False):
+            if payload["complete"]:
                 self.event = "buildFinished"
             else:
                 self.event = "buildStarted"
 
-            self.info = {
-                "results": self.payload["results"],
-                "text": self.payload["state_string"],
-            }
-            self.properties = {
-                k: v[0] for k, v in self.payload["properties"].items()
+            self.number = payload.get("number")
+            self.results = payload["results"]
+            self.text = payload["state_string"]
+            properties = {
+                k: v[0] for k, v in payload["properties"].items()
+                if k in _PROPERTIES
             }
         else:
-            self.event = self.payload["event"]
-            self.info = self.payload["payload"]["build"]
-            self.properties = dict(x[:2] for x in self.info['properties'])
+            self.event = payload["event"]
+            info = payload["payload"]["build"]
+            self.number = info.get("number")
+            self.results = info.get("results")
+            self.text = info.get("text")
+            properties = {
+                x[0]: x[1] for x in info["properties"] if x[0] in _PROPERTIES
+            }
+
+        self.name = properties.get("buildername")
         self.sha = (
-            self.properties["revision"] or
-            self.properties.get("got_revision")
+            properties.get("revision") or
+            properties.get("got_revision")
         )
 
     def get_name(self):
-        return self.properties["buildername"]
+        return self.name
 
     def get_status(self):
         if self.event == "buildFinished":
-            if "successful" in self.info["text"] or self.info["results"] == 0:
+            if "successful" in self.text or self.results == 0:
                 return BuildStatus.success
             else:
                 return BuildStatus.failure
@@ -127,6 +186,9 @@ class BuildbotBuild(BaseCIBuild):
     def get_sha(self):
         return self.sha
 
+    def get_number(self):
+        return self.number
+
     def is_valid(self):
         return bool(self.sha)
 
@@ -174,13 +236,8 @@ class BuildbotWebhook(BaseCIWebhook):
                 yield build
             return
 
-        packets = json.loads(self.handler.get_argument("packets"))
-        for payload in packets:
-            if payload["event"] not in ["buildStarted", "buildFinished"]:
-                continue
-
-            payload["is_nine"] = self.is_nine
-
+        packets = self.handler.get_argument("packets")
+        for payload in iter_packets(packets, _BUILD_EVENTS):
             build = BuildbotBuild(payload)
             if not build.is_valid():
                 continue
@@ -206,16 +263,77 @@ class BuildbotWebhook(BaseCIWebhook):
         # started event if payload includes finished event.
         return finished_build or started_build
 
+    def make_builds(self):
+        """Returns the latest build of each builder and commit, a finished
+        build is later than a started one.
+
+        :rtype: list of :class:`BuildbotBuild`
+        """
+        builds = collections.OrderedDict()
+
+        for build in self.iter_builds():
+            key = (build.get_name(), build.get_sha())
+            current = builds.get(key)
+            if (current is None or
+                    build.get_status() is not BuildStatus.pending or
+                    current.get_status() is BuildStatus.pending):
+                builds[key] = build
+
+        return list(builds.values())
+
 
 class DeploymentHandler(web.RequestHandler):
-    @gen.coroutine
-    def post(self):
-        hook = BuildbotWebhook(self)
+    def prepare(self):
+        # build -> idempotency key, until the build is reported.
+        self._dedup_keys = {}
+        # Seconds until open circuits of failed builds may close.
+        self._retry_after = None
+
+        tracer = self.application.tracer
+        if tracer is None:
+            self.trace = NULL_TRACE
+        else:
+            self.trace = tracer.start("deployment")
+
+    def on_finish(self):
+        # Builds not reported can be retried.
+        if self._dedup_keys:
+            self.application.dedup.finish_all(
+                list(self._dedup_keys.values()), reported=False)
 
-        build = hook.make_build()
+        if self.trace is not NULL_TRACE:
+            self.trace.set(status=self.get_status())
+            self.application.tracer.finish(self.trace)
 
-        if build is not None:
-            yield self._on_build(hook, build)
+    def write_error(self, status_code, **kwargs):
+        if status_code == 503 and self._retry_after is not None:
+            self.set_header("Retry-After",
+                            "{:.0f}".format(math.ceil(self._retry_after)))
+        super(DeploymentHandler, self).write_error(status_code, **kwargs)
+
+    async def post(self):
+        hook = BuildbotWebhook(self)
+
+        start = metrics.now()
+        with self.trace.span("parse") as span:
+            builds = hook.make_builds()
+            span.set(builds=len(builds))
+        self.application.metrics.parse_seconds.labels().observe(
+            metrics.now() - start)
+
+        if builds and self.application.dedup is not None:
+            with self.trace.span("dedup") as span:
+                builds = await self._drop_duplicates(hook, builds)
+                span.set(builds=len(builds))
+
+        if builds:
+            repos = self._get_repos(hook, builds)
+            if self.application.workers is None:
+                await self._on_builds(repos)
+            else:
+                # Reported after the response, not traced.
+                with self.trace.span("enqueue", builds=len(repos)):
+                    self._enqueue_builds(repos)
 
         self.write("OK")
 
@@ -224,48 +342,132 @@ class DeploymentHandler(web.RequestHandler):
         :class:`BaseCIWebhook` and :class:`BaseCIBuild`.
         """
 
-        secret = hook.get_secret()
-        gen_log.info("Got secret from hook %s", secret)
-        try:
-            config = self.application.find_repo_config(
-                secret,
-                build.get_name(),
-            )
-        except KeyError:
-            gen_log.warn("Could not find config with secret: %s.", secret)
+        with self.trace.span("get_repo", builder=build.get_name()) as span:
+            secret = hook.get_secret()
+            gen_log.info("Got secret from hook %s", secret)
+            try:
+                config = self.application.find_repo_config(
+                    secret,
+                    build.get_name(),
+                )
+            except KeyError:
+                gen_log.warn("Could not find config with secret: %s.",
+                             secret)
+                raise web.HTTPError(403)
+
+            repo_name = "{}/{}".format(config["owner"], config["name"])
+            span.set(repo=repo_name)
+            self.trace.add_repo(repo_name)
+            return self.application.get_repo(config["owner"],
+                                             config["name"], build)
+
+    def _get_repos(self, hook, builds):
+        """Returns list of ``(repo, build)``, builds without config are
+        skipped.
+
+        :raises tornado.web.HTTPError: 403 if no build has config
+        """
+        repos = []
+        for build in builds:
+            try:
+                repos.append((self._get_repo(hook, build), build))
+            except web.HTTPError:
+                # Others of a batch are still reported.
+                pass
+
+        if not repos:
             self.write("Secret mismatch.")
             raise web.HTTPError(403)
+        return repos
 
-        return Repository(
-            self.application.github_client, config["owner"],
-            config["name"],
-        )
-
-    @gen.coroutine
-    def _on_build(self, hook, build):
-        repo = self._get_repo(hook, build)
-
-        gen_log.info(
-            "Try find pull requset via %s in %s/%s", build.get_sha(),
-            repo.owner, repo.label,
-        )
-
+    async def _drop_duplicates(self, hook, builds):
+        """Returns builds not seen recently, duplicates are answered without
+        reporting.  Keys of all builds are checked at once.
+        """
+        secret = hook.get_secret()
+        keys = [make_key(secret, build) for build in builds]
+        results = await self.application.dedup.begin_all(keys)
+        unique = []
+        for build, key, added in zip(builds, keys, results):
+            if added:
+                self._dedup_keys[build] = key
+                unique.append(build)
+            else:
+                gen_log.info("Suppress duplicate build #%s of %s on %s",
+                             build.get_number(), build.get_name(),
+                             build.get_sha())
+        return unique
+
+    def _mark_reported(self, builds):
+        keys = [self._dedup_keys.pop(build) for build in builds
+                if build in self._dedup_keys]
+        if keys:
+            self.application.dedup.finish_all(keys)
+
+    def _enqueue_builds(self, repos):
+        """Hand the builds over to background workers, responds 202."""
+        enqueued = []
         try:
-            pull = yield self.application.find_pull(repo, build.get_sha())
-        except (GithubError, NoSuchPullRequest) as e:
-            gen_log.error(
-                "Could not find any pull request via %s in %s/%s",
-                build.get_sha(), repo.owner, repo.label,
-                exc_info=True,
-            )
-            if isinstance(e, GithubError):
-                raise web.HTTPError(404)
-            return
-
-        gen_log.info(
-            "Found pull request #%s via %s in %s/%s", pull.num,
-            build.get_sha(), repo.owner, repo.label,
-        )
-
-        comment = "Deployment status {}".format(build.get_status())
-        yield pull.create_comment(comment)
+            for repo, build in repos:
+                try:
+                    self.application.enqueue_build(repo, build)
+                except QueueFull:
+                    gen_log.warning("Queue is full, drop build %s of %s/%s",
+                                    build.get_sha(), repo.owner, repo.label)
+                    raise web.HTTPError(503)
+                except JournalError as e:
+                    gen_log.warning("Drop build %s of %s/%s: %s",
+                                    build.get_sha(), repo.owner, repo.label,
+                                    e)
+                    raise web.HTTPError(503)
+                enqueued.append(build)
+        finally:
+            # Kept by the queue and journal from now on.
+            self._mark_reported(enqueued)
+
+        self.set_status(202)
+
+    async def _on_builds(self, repos):
+        """Report builds concurrently, responds 404 if all of them failed,
+        or 503 if any of them failed by an open circuit.
+        """
+        semaphore = locks.Semaphore(self.application.batch_concurrency)
+        if len(repos) == 1:
+            # Most requests carry one build, no task is needed.
+            results = [await self._on_build(semaphore, *repos[0])]
+        else:
+            results = await asyncio.gather(*[
+                self._on_build(semaphore, repo, build)
+                for repo, build in repos
+            ])
+        self._mark_reported([build for (_, build), reported
+                             in zip(repos, results) if reported])
+
+        if not any(results):
+            if self._retry_after is not None:
+                raise web.HTTPError(503)
+            raise web.HTTPError(404)
+
+    async def _on_build(self, semaphore, repo, build):
+        """Report build, returns False if failed."""
+        async with semaphore:
+            with self.trace.span(
+                    "report", repo="{}/{}".format(repo.owner, repo.label),
+                    builder=build.get_name(), sha=build.get_sha()):
+                try:
+                    await self.application.report_build(repo, build,
+                                                        self.trace)
+                except CircuitOpen as e:
+                    gen_log.warning("Could not report %s in %s/%s: %s",
+                                    build.get_sha(), repo.owner, repo.label,
+                                    e)
+                    self._retry_after = max(self._retry_after or 0,
+                                            e.retry_after)
+                    return False
+                except GithubError:
+                    gen_log.error(
+                        "Could not report %s in %s/%s", build.get_sha(),
+                        repo.owner, repo.label, exc_info=True,
+                    )
+                    return False
+        return True
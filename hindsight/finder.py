@@ -3,9 +3,14 @@
 """Pull request finder."""
 from __future__ import print_function, division, unicode_literals
 
-from tornado import gen
+import asyncio
+
+from asyncat.repository import PullRequest
 from tornado import log
 
+from .parsers import parse_pull_number
+from .tracing import NULL_TRACE
+
 
 class NoSuchPullRequest(Exception):
     pass
@@ -13,48 +18,182 @@ class NoSuchPullRequest(Exception):
 
 class PullRequestFinder(object):
     """Find pull request via commit sha."""
-    def __init__(self, repo, sha):
+    def __init__(self, repo, sha, index=None,   # pylint: disable=R0913
+                 parsers=None, commit_cache=None, speculative=False,
+                 resolver=None, trace=None):
         """Initialize
 
         :type repo: :class:`asyncat.repository.Repository`
         :param str sha: commit sha
+        :param index: index to look up before search
+        :type index: :class:`~hindsight.index.PullRequestIndex`
+        :param parsers:
+            parsers to find pull request number in commit message before
+            search parent commit
+        :type parsers: list of :class:`~hindsight.parsers.MessageParser`
+        :param commit_cache: cache of commit content
+        :type commit_cache: :class:`~hindsight.cache.LRUCache`
+        :param bool speculative:
+            fetch commit while searching sha, instead of after search failed
+        :param resolver: resolver used instead of search
+        :type resolver: :class:`~hindsight.graphql.BatchResolver`
+        :param trace: trace to record each step
+        :type trace: :class:`~hindsight.tracing.Trace`
         """
         self.repo = repo
         self.sha = sha
+        self.index = index
+        self.parsers = parsers or []
+        self.commit_cache = commit_cache
+        self.speculative = speculative
+        self.resolver = resolver
+        self.trace = NULL_TRACE if trace is None else trace
+
+        # Speculative lookup has found the pull request.
+        self._found = False
 
-    @gen.coroutine
-    def _find(self, sha):
+    def _find_in_index(self, sha):
+        """Returns pull request of ``sha`` in index, or ``None``."""
+        with self.trace.span("index", sha=sha) as span:
+            num = self.index.get(self.repo.owner, self.repo.label, sha)
+            span.set(num=num)
+        if num is not None:
+            return self.repo.make(PullRequest, self.repo, num)
+        return None
+
+    async def _find(self, sha):
         """Find pull reuqest via commit sha.
 
+        A pull request found in index or by resolver is not synchronized with
+        Github, only its number is available.
+
         :param str sha: commit sha
         :rtype: :class:`asyncat.Repository.PullRequest`
         """
+        if self.index is not None:
+            pull = self._find_in_index(sha)
+            if pull is not None:
+                return pull
+
+        if self.resolver is not None:
+            with self.trace.span("resolve", sha=sha) as span:
+                num = await self.resolver.resolve(
+                    self.repo.owner, self.repo.label, sha)
+                span.set(num=num)
+            if num is not None:
+                if self.index is not None:
+                    self.index.add(self.repo.owner, self.repo.label, sha, num)
+                return self.repo.make(PullRequest, self.repo, num)
+            return None
+
         # Try use build's sha to find pull request.
-        resp = yield self.repo.search_pulls(sha)
+        with self.trace.span("search", sha=sha) as span:
+            resp = await self.repo.search_pulls(sha)
+            span.set(total_count=resp.data["total_count"])
         if resp.data["total_count"] == 1:
-            pull = yield self.repo.pull(resp.data["items"][0]["number"])
-            raise gen.Return(pull)
+            num = resp.data["items"][0]["number"]
+            return await self._get_pull(sha, num)
+        return None
 
-    @gen.coroutine
-    def find(self):
-        pull = yield self._find(self.sha)
+    async def _get_pull(self, sha, num):
+        """Returns pull request ``num`` which ``sha`` belongs to."""
+        if self.index is not None:
+            self.index.add(self.repo.owner, self.repo.label, sha, num)
+        with self.trace.span("pull", num=num):
+            return await self.repo.pull(num)
 
-        if pull is None:
-            # Try use parent commit to find pull request.
-            commit = yield self.repo.commit(self.sha)
-
-            # The current commit is merge commit if that have two parents,
-            # if so use the last one to find the pull requeust, because
-            # the extra merge commit can also merge the pull request.
-            if len(commit.c["parents"]) == 2:
-                parent = commit.c["parents"][1]
-                log.gen_log.info("Try use <%s> parent commit <%s> find pull",
-                                 self.sha, parent["sha"])
-                pull = yield self._find(parent["sha"])
+    async def _get_commit(self, sha):
+        """Returns message and parents of commit, from :attr:`commit_cache`
+        if possible.  Only they are cached, not patches of files.
 
-        if pull is None:
-            exc = NoSuchPullRequest(self.sha)
+        :returns: ``(message, parent shas)``
+        """
+        key = (self.repo.owner, self.repo.label, sha)
+        if self.commit_cache is not None:
+            content = self.commit_cache.get(key)
+            if content is not None:
+                with self.trace.span("commit", sha=sha, cached=True):
+                    return content
+
+        with self.trace.span("commit", sha=sha, cached=False):
+            commit = await self.repo.commit(sha)
+        content = (commit.c.get("commit", {}).get("message", ""),
+                   tuple(parent["sha"] for parent in commit.c["parents"]))
+        if self.commit_cache is not None:
+            self.commit_cache.set(key, content)
+        return content
+
+    async def _find_via_commit(self):
+        """Find pull request via message and parent of the commit."""
+        message, parents = await self._get_commit(self.sha)
+        if self._found:
+            return None
+
+        # Merge commits created by Github or bots contain number of
+        # the pull request in message.
+        num = None
+        if self.parsers:
+            with self.trace.span("parse_message", sha=self.sha) as span:
+                num = parse_pull_number(self.parsers, message)
+                span.set(num=num)
+
+        if num is not None:
+            log.gen_log.info("Found pull #%s in message of <%s>",
+                             num, self.sha)
+            return await self._get_pull(self.sha, num)
+
+        # The current commit is merge commit if that have two parents,
+        # if so use the last one to find the pull requeust, because
+        # the extra merge commit can also merge the pull request.
+        if len(parents) == 2:
+            log.gen_log.info("Try use <%s> parent commit <%s> find pull",
+                             self.sha, parents[1])
+            return await self._find(parents[1])
+        return None
+
+    async def _find_speculative(self):
+        """Search sha and look up via commit at the same time, returns
+        whichever finds the pull request first, the other is cancelled.
+        """
+        if self.index is not None:
+            pull = self._find_in_index(self.sha)
+            if pull is not None:
+                return pull
+
+        pending = {asyncio.ensure_future(self._find(self.sha)),
+                   asyncio.ensure_future(self._find_via_commit())}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        error = future.exception()
+                    elif future.result() is not None:
+                        self._found = True
+                        return future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+        if error is not None:
+            raise error
+        return None
+
+    async def find(self):
+        """Returns pull request of the commit.
+
+        :raises NoSuchPullRequest: if not found
+        """
+        if self.speculative:
+            pull = await self._find_speculative()
         else:
-            exc = gen.Return(pull)
+            pull = await self._find(self.sha)
+            if pull is None:
+                # Try use parent commit to find pull request.
+                pull = await self._find_via_commit()
 
-        raise exc
+        if pull is None:
+            raise NoSuchPullRequest(self.sha)
+        return pull
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Batched resolution of commits via Github GraphQL API."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+
+from asyncat.client import GithubError
+from tornado import concurrent
+from tornado import gen
+from tornado import ioloop
+from tornado.log import gen_log
+
+_COMMIT_FIELDS = (
+    "... on Commit { associatedPullRequests(first: 1) { nodes { number } } }"
+)
+
+
+class GraphQLError(GithubError):
+    """Github returns errors without data."""
+    def __init__(self, errors):
+        super(GraphQLError, self).__init__()
+        self.errors = errors
+        self.args = (json.dumps(errors),)
+
+
+class BatchResolver(object):
+    """Resolves commits to numbers of pull requests, commits requested within
+    ``window`` seconds are resolved by one GraphQL query up to ``max_batch``
+    commits, across repositories.
+    """
+    def __init__(self, client, max_batch=50, window=0.01, host=None):
+        """Initialize
+
+        :type client: :class:`asyncat.client.AsyncGithubClient`
+        :param int max_batch: max number of commits in one query
+        :param window: seconds to wait for more commits before query
+        :param str host: host of GraphQL API, defaults to host of ``client``
+        """
+        self.client = client
+        self.max_batch = max_batch
+        self.window = window
+        self.host = host
+
+        #: Number of queries sent.
+        self.queries = 0
+        #: Number of commits resolved.
+        self.resolved = 0
+
+        # (owner, name, sha) -> [future]
+        self._pending = {}
+        self._flush_timeout = None
+
+    def resolve(self, owner, name, sha):
+        """Returns a future resolves number of pull request that ``sha``
+        belongs to, or ``None``.
+        """
+        future = concurrent.Future()
+        key = (owner, name, sha)
+        self._pending.setdefault(key, []).append(future)
+
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._flush_timeout is None:
+            self._flush_timeout = ioloop.IOLoop.current().call_later(
+                self.window, self.flush)
+        return future
+
+    def flush(self):
+        """Query pending commits now."""
+        if self._flush_timeout is not None:
+            ioloop.IOLoop.current().remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            ioloop.IOLoop.current().spawn_callback(self._query, pending)
+
+    @staticmethod
+    def make_query(keys):
+        """Returns GraphQL query of commits and their aliases.
+
+        :param keys: list of ``(owner, name, sha)``
+        :returns: ``(query, {key: (repo_alias, commit_alias)})``
+        """
+        repos = {}
+        for owner, name, sha in keys:
+            repos.setdefault((owner, name), []).append(sha)
+
+        aliases = {}
+        lines = ["query {"]
+        for i, ((owner, name), shas) in enumerate(repos.items()):
+            repo_alias = "r{}".format(i)
+            lines.append("  {}: repository(owner: {}, name: {}) {{".format(
+                repo_alias, json.dumps(owner), json.dumps(name)))
+            for j, sha in enumerate(shas):
+                commit_alias = "c{}".format(j)
+                aliases[(owner, name, sha)] = (repo_alias, commit_alias)
+                lines.append("    {}: object(oid: {}) {{ {} }}".format(
+                    commit_alias, json.dumps(sha), _COMMIT_FIELDS))
+            lines.append("  }")
+        lines.append("}")
+        return "\n".join(lines), aliases
+
+    @gen.coroutine
+    def _query(self, pending):
+        query, aliases = self.make_query(list(pending))
+        self.queries += 1
+
+        try:
+            resp = yield self.client.request(
+                "/graphql", {"query": query}, method="POST", host=self.host)
+            data = resp.data.get("data")
+            if data is None:
+                raise GraphQLError(resp.data.get("errors"))
+        except Exception as e:   # pylint: disable=W0703
+            for futures in pending.values():
+                for future in futures:
+                    # Cancelled by a speculative finder which found the pull
+                    # request in another way.
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        if resp.data.get("errors"):
+            gen_log.warning("GraphQL query returns errors: %s",
+                            resp.data["errors"])
+
+        for key, futures in pending.items():
+            repo_alias, commit_alias = aliases[key]
+            num = None
+            commit = (data.get(repo_alias) or {}).get(commit_alias)
+            if commit:
+                nodes = commit["associatedPullRequests"]["nodes"]
+                if nodes:
+                    num = nodes[0]["number"]
+
+            self.resolved += 1
+            for future in futures:
+                if not future.done():
+                    future.set_result(num)
+
+    def stats(self):
+        """Returns number of queries and resolved commits."""
+        return {
+            "queries": self.queries,
+            "resolved": self.resolved,
+            "pending": len(self._pending),
+        }
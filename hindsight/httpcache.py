@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Cache of Github responses revalidated by conditional requests."""
+from __future__ import print_function, division, unicode_literals
+
+import gzip
+import io
+import json
+import os
+
+from tornado import escape
+from tornado import gen
+from tornado import httputil
+from tornado import ioloop
+from tornado.log import gen_log
+
+from .cache import LRUCache
+from .metrics import get_github_call
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+# Calls whose responses are cached, commits are kept by the commit cache
+# of the finder.
+_CACHED_CALLS = frozenset(["pull", "search"])
+
+
+class CachedResponse(object):   # pylint: disable=R0903
+    """A cached response, has ``data`` and ``headers`` same as responses of
+    :class:`asyncat.client.AsyncGithubClient`.
+    """
+    __slots__ = ("body", "etag", "last_modified")
+
+    code = 200
+
+    def __init__(self, body, etag=None, last_modified=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def data(self):
+        # Decoded on each access, so callers can't change cached data.
+        return json.loads(escape.to_unicode(self.body))
+
+    @property
+    def headers(self):
+        headers = httputil.HTTPHeaders()
+        if self.etag:
+            headers["ETag"] = self.etag
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        return headers
+
+    def validators(self):
+        """Returns headers to revalidate the response."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """Keeps responses of pull requests and searches, revalidated with
+    ``If-None-Match`` or ``If-Modified-Since``, Github doesn't count a
+    ``304 Not Modified`` response against rate limit.
+
+    Least recently used responses are evicted when it's full.  With
+    ``path``, responses are saved to a gzipped JSON lines file in an
+    executor, and loaded when started.
+    """
+    def __init__(self, size=4096, path=None):
+        """Initialize
+
+        :param int size: max number of responses
+        :param str path: file to persist responses, ``None`` to keep in
+                         memory
+        """
+        self.path = path
+
+        #: Number of responses revalidated by 304.
+        self.revalidated = 0
+        #: Number of full responses of requests can be cached.
+        self.misses = 0
+
+        self._responses = LRUCache(size=size, ttl=float("inf"))
+        self._save_timeout = None
+        self._saving = False
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def get_key(path, params=None, method="GET", headers=None):
+        """Returns cache key of a request, or ``None`` if it isn't cached.
+        Requests with their own validators are left to the caller.
+        """
+        if method != "GET" or headers and (
+                "If-None-Match" in headers or
+                "If-Modified-Since" in headers):
+            return None
+        if get_github_call(path, params, method)[1] not in _CACHED_CALLS:
+            return None
+        if params:
+            return "{}?{}".format(path, urlencode(sorted(params.items())))
+        return path
+
+    def get(self, key):
+        """Returns cached response of ``key``, or ``None``."""
+        return self._responses.get(key)
+
+    def set(self, key, resp):
+        """Cache response of ``key`` if it can be served or revalidated
+        later.
+
+        :returns: True if cached
+        """
+        self.misses += 1
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if not (etag or last_modified):
+            return False
+        self._responses.set(key, CachedResponse(resp.body, etag,
+                                                last_modified))
+        return True
+
+    def touch(self, key, response):
+        """Mark ``response`` of ``key`` revalidated."""
+        self.revalidated += 1
+        self._responses.set(key, response)
+
+    def save_later(self, delay):
+        """Save responses ``delay`` seconds later, so responses cached in the
+        period are saved at once.
+        """
+        if self.path is None or self._save_timeout is not None:
+            return
+
+        self._save_timeout = ioloop.IOLoop.current().call_later(
+            delay, self._save_scheduled)
+
+    @gen.coroutine
+    def _save_scheduled(self):
+        self._save_timeout = None
+        if self._saving:
+            self.save_later(1)
+            return
+
+        self._saving = True
+        try:
+            # Cached responses are never changed, so a snapshot of entries
+            # is written in an executor not to block the IOLoop.
+            yield ioloop.IOLoop.current().run_in_executor(
+                None, self._write, list(self._responses.items()))
+        except (IOError, OSError) as e:
+            gen_log.warning("Could not save responses to %s: %s",
+                            self.path, e)
+        finally:
+            self._saving = False
+
+    def load(self):
+        """Load responses from :attr:`path`, the least recently used
+        first.
+        """
+        with gzip.open(self.path, "rb") as f:
+            for line in io.TextIOWrapper(f, encoding="utf8"):
+                key, body, etag, last_modified = json.loads(line)
+                self._responses.set(key, CachedResponse(
+                    body.encode("utf8"), etag, last_modified))
+
+    def save(self):
+        """Save responses to :attr:`path`."""
+        self._write(list(self._responses.items()))
+
+    def _write(self, entries):
+        tmp_path = self.path + ".tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            for key, response in entries:
+                f.write(json.dumps(
+                    [key, escape.to_unicode(response.body), response.etag,
+                     response.last_modified],
+                    separators=(",", ":"),
+                ).encode("utf8") + b"\n")
+        os.rename(tmp_path, self.path)
+
+    def stats(self):
+        """Returns number of cached responses, revalidations and misses."""
+        return {
+            "size": len(self._responses),
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+        }
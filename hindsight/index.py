@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Index of commit sha to pull request."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+import os
+
+from asyncat.client import GithubError
+from tornado import gen
+from tornado import ioloop
+from tornado.log import gen_log
+
+
+class PullRequestIndex(object):
+    """Maps head sha and merge commit sha of pull requests to their numbers.
+
+    The index is filled by listing pull requests of repositories in bulk,
+    which is not limited like the search API.  Pull requests are listed by
+    last update, a refresh stops at the first one it has seen, and the first
+    page is requested with ``If-None-Match`` so an unchanged repository costs
+    a 304 response only.
+    """
+    per_page = 100
+
+    def __init__(self, client, path=None, max_pages=10):
+        """Initialize
+
+        :type client: :class:`asyncat.client.AsyncGithubClient`
+        :param str path: file to persist the index, ``None`` to keep in memory
+        :param int max_pages: max pages to list in one refresh
+        """
+        self.client = client
+        self.path = path
+        self.max_pages = max_pages
+
+        # (owner, name) -> {sha: number}
+        self._shas = {}
+        # (owner, name) -> ETag of the first page
+        self._etags = {}
+        # (owner, name) -> ``updated_at`` of the latest pull request
+        self._since = {}
+        # (owner, name) -> {branch: number} of open pull requests
+        self._branches = {}
+
+        self._periodic = None
+        self._save_timeout = None
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def get(self, owner, name, sha):
+        """Returns number of pull request that ``sha`` belongs to, or
+        ``None``.
+        """
+        shas = self._shas.get((owner, name))
+        if shas is None:
+            return None
+        return shas.get(sha)
+
+    def add(self, owner, name, sha, num):
+        """Map ``sha`` to pull request ``num``."""
+        self._shas.setdefault((owner, name), {})[sha] = num
+
+    def add_pull(self, owner, name, pull):
+        """Map head sha and merge commit sha of a pull request, and map head
+        branch to it while it's open if the branch is in the same repository.
+
+        :param dict pull: pull request returned by Github
+        :returns: list of mapped shas
+        """
+        num = pull["number"]
+        head = pull["head"]
+        shas = [head["sha"]]
+        if pull.get("merge_commit_sha"):
+            shas.append(pull["merge_commit_sha"])
+        for sha in shas:
+            self.add(owner, name, sha, num)
+
+        head_repo = head.get("repo") or {}
+        if head_repo.get("full_name") != "{}/{}".format(owner, name):
+            return shas
+
+        branches = self._branches.setdefault((owner, name), {})
+        if pull["state"] == "open":
+            branches[head["ref"]] = num
+        elif branches.get(head["ref"]) == num:
+            del branches[head["ref"]]
+        return shas
+
+    def get_branch(self, owner, name, branch):
+        """Returns number of the open pull request from ``branch``, or
+        ``None``.
+        """
+        return self._branches.get((owner, name), {}).get(branch)
+
+    @gen.coroutine
+    def refresh(self, owner, name):
+        """List pull requests updated since last refresh.
+
+        :returns: number of pull requests indexed
+        """
+        key = (owner, name)
+        since = self._since.get(key)
+        path = "/repos/{}/{}/pulls".format(owner, name)
+
+        count = 0
+        latest = etag = None
+        # Whether the walk reached last refresh or the last page, the first
+        # refresh indexes at most max_pages.
+        complete = since is None
+        for page in range(1, self.max_pages + 1):
+            headers = {}
+            if page == 1 and key in self._etags:
+                headers["If-None-Match"] = self._etags[key]
+
+            try:
+                resp = yield self.client.request(path, {
+                    "state": "all",
+                    "sort": "updated",
+                    "direction": "desc",
+                    "per_page": self.per_page,
+                    "page": page,
+                }, headers=headers)
+            except GithubError as e:
+                if e.status_code == 304:
+                    complete = True
+                    break
+                raise
+
+            if page == 1:
+                etag = resp.headers.get("Etag")
+                if resp.data:
+                    latest = resp.data[0]["updated_at"]
+
+            done = len(resp.data) < self.per_page
+            for pull in resp.data:
+                if since is not None and pull["updated_at"] <= since:
+                    done = True
+                    break
+                self.add_pull(owner, name, pull)
+                count += 1
+
+            if done:
+                complete = True
+                break
+
+        if not complete:
+            # Pull requests between the last page and last refresh are not
+            # listed yet, walk from the top again next time.
+            gen_log.warning("Stopped indexing %s/%s at %d pages", owner, name,
+                            self.max_pages)
+        else:
+            if etag:
+                self._etags[key] = etag
+            if latest is not None:
+                self._since[key] = latest
+
+        raise gen.Return(count)
+
+    @gen.coroutine
+    def refresh_all(self, repos):
+        """Refresh repositories and save the index.
+
+        :param repos: iterable of ``(owner, name)``
+        """
+        for owner, name in repos:
+            try:
+                count = yield self.refresh(owner, name)
+            except GithubError:
+                gen_log.error("Failed to refresh index of %s/%s", owner, name,
+                              exc_info=True)
+            else:
+                gen_log.info("Indexed %d pull requests of %s/%s", count,
+                             owner, name)
+
+        if self.path is not None:
+            self.save()
+
+    def start(self, get_repos, interval):
+        """Refresh repositories now and then every ``interval`` seconds.
+
+        :param get_repos: function returns ``(owner, name)`` of repositories,
+                          called by each refresh
+        """
+        io_loop = ioloop.IOLoop.current()
+        io_loop.spawn_callback(self.refresh_all, list(get_repos()))
+        self._periodic = ioloop.PeriodicCallback(
+            lambda: io_loop.spawn_callback(self.refresh_all,
+                                           list(get_repos())),
+            interval * 1000,
+        )
+        self._periodic.start()
+
+    def save_later(self, delay):
+        """Save the index ``delay`` seconds later, so writes in the period
+        are saved at once.
+        """
+        if self.path is None or self._save_timeout is not None:
+            return
+
+        self._save_timeout = ioloop.IOLoop.current().call_later(
+            delay, self._save_scheduled)
+
+    def _save_scheduled(self):
+        self._save_timeout = None
+        self.save()
+
+    def load(self):
+        """Load the index from :attr:`path`."""
+        with open(self.path) as f:
+            data = json.load(f)
+
+        for label, repo in data.items():
+            key = tuple(label.split("/", 1))
+            self._shas[key] = repo["shas"]
+            if repo.get("etag"):
+                self._etags[key] = repo["etag"]
+            if repo.get("since"):
+                self._since[key] = repo["since"]
+            if repo.get("branches"):
+                self._branches[key] = repo["branches"]
+
+    def save(self):
+        """Save the index to :attr:`path`."""
+        data = {
+            "{}/{}".format(*key): {
+                "shas": shas,
+                "etag": self._etags.get(key),
+                "since": self._since.get(key),
+                "branches": self._branches.get(key),
+            }
+            for key, shas in self._shas.items()
+        }
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.rename(tmp_path, self.path)
+
+    def stats(self):
+        """Returns number of indexed commits."""
+        return {
+            "commits": sum(len(x) for x in self._shas.values()),
+        }
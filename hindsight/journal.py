@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Durable journal of accepted builds."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+import sqlite3
+
+from tornado import ioloop
+from tornado.log import gen_log
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    worker INTEGER
+)
+"""
+
+# Seconds to wait before writing again after a failed commit.
+_RETRY_DELAY = 1
+
+
+class JournalError(Exception):
+    """Database of journal failed, such as locked by another process."""
+
+
+class BuildJournal(object):
+    """Keeps builds accepted but not reported yet in a SQLite database in WAL
+    mode, so they can be replayed after restart.
+
+    Writes are committed in batches: when ``batch_size`` writes are pending or
+    ``flush_interval`` seconds after the first pending write, whichever comes
+    first.  A build accepted in the window is lost if the process crashes, set
+    ``flush_interval`` to 0 to commit every write.
+
+    A ``shared`` journal is written by multiple processes, appends are
+    committed at once so no write transaction is held open between them, only
+    acks are batched.
+    """
+    def __init__(self, path, batch_size=100,   # pylint: disable=R0913
+                 flush_interval=0.05, synchronous="NORMAL", timeout=5,
+                 shared=False):
+        """Initialize
+
+        :param str path: path of the database file
+        :param int batch_size: max number of writes in one commit
+        :param flush_interval: max seconds a write waits for commit
+        :param str synchronous: ``PRAGMA synchronous`` of SQLite
+        :param timeout:
+            seconds to wait for a lock of other processes, the IOLoop is
+            blocked while waiting
+        :param bool shared: whether other processes write the database
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.shared = shared
+
+        self._conn = sqlite3.connect(path, timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous={}".format(synchronous))
+        self._conn.execute(_SCHEMA)
+        columns = [row[1] for row in
+                   self._conn.execute("PRAGMA table_info(builds)")]
+        if "worker" not in columns:
+            # Created by older versions.
+            self._conn.execute("ALTER TABLE builds ADD COLUMN worker INTEGER")
+        self._conn.commit()
+
+        self._pending = 0
+        # Ids of acked builds not removed yet.
+        self._acks = []
+        self._flush_timeout = None
+
+        #: Number of commits.
+        self.commits = 0
+
+    def append(self, owner, name, payload, worker=None):
+        """Append payload of a build of ``owner/name``, it must can be encoded
+        to JSON.
+
+        :param int worker: index of the worker process to report it
+        :returns: id of the build in journal
+        :raises JournalError: if the build could not be written
+        """
+        try:
+            cursor = self._conn.execute(
+                "INSERT INTO builds (owner, name, payload, worker) "
+                "VALUES (?, ?, ?, ?)",
+                (owner, name, json.dumps(payload, separators=(",", ":")),
+                 worker),
+            )
+            if self.shared:
+                self._conn.commit()
+                self.commits += 1
+        except sqlite3.Error as e:
+            if self.shared and self._conn.in_transaction:
+                self._conn.rollback()
+            raise JournalError("Could not append build: {}".format(e))
+
+        if not self.shared:
+            self._written()
+        return cursor.lastrowid
+
+    def ack(self, build_id):
+        """Remove a build that has been handled, removals are written in
+        batch.
+        """
+        self._acks.append(build_id)
+        self._written()
+
+    def iter_pending(self, worker=None, after=0):
+        """Iterates builds not acked yet in order of appending.
+
+        :param int worker: only builds of the worker process, builds without
+                           worker belong to worker 0
+        :param int after: only builds whose id is greater
+        :returns: iterator of ``(id, owner, name, payload)``
+        """
+        rows = self._conn.execute(
+            "SELECT id, owner, name, payload FROM builds "
+            "WHERE id > ? AND (? IS NULL OR IFNULL(worker, 0) = ?) "
+            "ORDER BY id",
+            (after, worker, worker),
+        ).fetchall()
+        acks = set(self._acks)
+        for build_id, owner, name, payload in rows:
+            if build_id not in acks:
+                yield build_id, owner, name, json.loads(payload)
+
+    def flush(self):
+        """Commit pending writes.
+
+        :raises JournalError: if they could not be committed, they are kept
+                              to commit again
+        """
+        if self._flush_timeout is not None:
+            ioloop.IOLoop.current().remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+
+        if not self._pending:
+            return
+        try:
+            if self._acks:
+                self._conn.executemany(
+                    "DELETE FROM builds WHERE id = ?",
+                    [(build_id,) for build_id in self._acks])
+            self._conn.commit()
+        except sqlite3.Error as e:
+            raise JournalError("Could not commit journal: {}".format(e))
+        self._acks = []
+        self._pending = 0
+        self.commits += 1
+
+    def close(self):
+        """Commit pending writes and close the database."""
+        self.flush()
+        self._conn.close()
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.batch_size or self.flush_interval <= 0:
+            self._try_flush()
+        elif self._flush_timeout is None:
+            self._flush_timeout = ioloop.IOLoop.current().call_later(
+                self.flush_interval, self._try_flush)
+
+    def _try_flush(self):
+        try:
+            self.flush()
+        except JournalError as e:
+            gen_log.warning("%s, retry in %ss", e, _RETRY_DELAY)
+            self._flush_timeout = ioloop.IOLoop.current().call_later(
+                _RETRY_DELAY, self._try_flush)
+
+    def stats(self):
+        """Returns pending writes and number of commits."""
+        return {
+            "pending_writes": self._pending,
+            "commits": self.commits,
+        }
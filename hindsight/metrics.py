@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Counters and histograms exposed in Prometheus text format."""
+from __future__ import print_function, division, unicode_literals
+
+import bisect
+import re
+import time
+
+from tornado import web
+
+#: Function returns current time in seconds for measuring latency.
+now = getattr(time, "perf_counter", time.time)
+
+#: Buckets of latency histograms in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_SEARCH_REPO_RE = re.compile(r"\brepo:(\S+)")
+
+
+def _escape(value):
+    return ("{}".format(value).replace("\\", "\\\\")
+            .replace("\n", "\\n").replace('"', '\\"'))
+
+
+def format_labels(names, values, extra=None):
+    """Returns labels part of a sample, such as ``{repo="a/b"}``."""
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild(object):     # pylint: disable=R0903
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _HistogramChild(object):   # pylint: disable=R0903
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Not cumulative, the last one counts values above all buckets.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric(object):
+    """Base class of metrics.  A child keeps the value of a combination of
+    label values, it is created at the first time and reused later, so
+    recording only updates numbers in place.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        # label values -> child
+        self._children = {}
+
+    def labels(self, *values):
+        """Returns the child of label ``values``."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("{} expects labels {}".format(
+                    self.name, self.labelnames))
+            child = self._children[values] = self._make_child()
+        return child
+
+    def _make_child(self):
+        raise NotImplementedError()     # pragma: no cover
+
+    def collect(self):
+        """Iterates samples ``(suffix, labels, value)``."""
+        raise NotImplementedError()     # pragma: no cover
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+    type = "counter"
+
+    def _make_child(self):
+        return _CounterChild()
+
+    def inc(self, *values):
+        """Increase the child of label ``values`` by 1."""
+        self.labels(*values).value += 1
+
+    def collect(self):
+        for values, child in self._children.items():
+            yield "", format_labels(self.labelnames, values), child.value
+
+
+class Gauge(Counter):
+    """Value may go up and down, such as number of requests in flight."""
+    type = "gauge"
+
+
+class Histogram(Metric):
+    """Distribution of values in fixed buckets."""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _make_child(self):
+        return _HistogramChild(self.buckets)
+
+    def collect(self):
+        bounds = self.buckets + (float("inf"),)
+        for values, child in self._children.items():
+            total = 0
+            for bound, count in zip(bounds, child.counts):
+                total += count
+                yield "_bucket", format_labels(
+                    self.labelnames, values, ("le", _format_value(bound)),
+                ), total
+            labels = format_labels(self.labelnames, values)
+            yield "_sum", labels, child.sum
+            yield "_count", labels, total
+
+
+class Registry(object):
+    """Metrics rendered together."""
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Returns a new registered :class:`Counter`."""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        """Returns a new registered :class:`Histogram`."""
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """Add a function returns metrics only read when rendered, such as
+        counters kept by other objects.
+
+        :param collect: function returns list of :class:`Metric`
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """Returns metrics in Prometheus text format."""
+        metrics = list(self._metrics)
+        for collect in self._collectors:
+            metrics.extend(collect())
+
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name,
+                                               metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for suffix, labels, value in metric.collect():
+                lines.append("{}{}{} {}".format(
+                    metric.name, suffix, labels, _format_value(value)))
+        lines.append("")
+        return "\n".join(lines)
+
+
+def get_error_code(error):
+    """Returns ``code`` label of a Github request failed with ``error``, the
+    status code, or ``"timeout"`` or ``"connection"`` if no response.
+    """
+    code = getattr(error, "status_code", None)
+    if code is not None:
+        return code
+    # asyncat raises GithubError from HTTPError of the timeout.
+    cause = error.__context__ or error
+    message = str(cause).lower()
+    if (isinstance(cause, TimeoutError) or "timeout" in message or
+            "timed out" in message):
+        return "timeout"
+    return "connection"
+
+
+def get_github_call(path, params=None, method="GET"):
+    """Returns ``(repo, call)`` of a Github request, ``repo`` is empty if
+    the request isn't about a repository.
+    """
+    if path.startswith("/search/"):
+        match = _SEARCH_REPO_RE.search((params or {}).get("q", ""))
+        return (match.group(1) if match else ""), "search"
+    if path == "/graphql":
+        return "", "graphql"
+
+    # ["", "repos", owner, name, kind, ...]
+    parts = path.split("/")
+    if len(parts) < 4 or parts[1] != "repos":
+        return "", "other"
+
+    repo = parts[2] + "/" + parts[3]
+    kind = parts[4] if len(parts) > 4 else "repo"
+    if kind == "commits" and len(parts) == 6:
+        call = "commit"
+    elif kind == "pulls" and len(parts) == 6:
+        call = "pull"
+    elif kind == "issues" and parts[-1] == "comments" and method == "POST":
+        call = "create_comment"
+    elif kind == "issues" and len(parts) == 7 and parts[5] == "comments":
+        call = "edit_comment"
+    elif kind == "statuses":
+        call = "create_status"
+    else:
+        call = kind
+    return repo, call
+
+
+class GithubCallMetrics(object):
+    """Children of Github request metrics bound to ``(repo, call)`` of
+    :func:`get_github_call`, children of error codes are bound at the first
+    error of each.
+    """
+    __slots__ = ("key", "seconds", "_metrics", "_errors", "_retries")
+
+    def __init__(self, metrics, key):
+        self.key = key
+        self.seconds = metrics.github_seconds.labels(*key)
+        self._metrics = metrics
+        # code -> child
+        self._errors = {}
+        self._retries = None
+
+    def observe(self, seconds, code=None):
+        """Record a request, ``code`` is label of :func:`get_error_code` if
+        failed.
+        """
+        self.seconds.observe(seconds)
+        if code is not None:
+            child = self._errors.get(code)
+            if child is None:
+                child = self._errors[code] = (
+                    self._metrics.github_errors.labels(*self.key + (code,)))
+            child.inc()
+
+    def retried(self):
+        """Record a retry after a transient error."""
+        if self._retries is None:
+            self._retries = self._metrics.github_retries.labels(*self.key)
+        self._retries.inc()
+
+
+class RepoMetrics(object):
+    """Children of report metrics bound to a repository, children of a
+    builder are bound at its first report.
+    """
+    __slots__ = ("label", "_metrics", "_builders")
+
+    def __init__(self, metrics, owner, name):
+        self.label = "{}/{}".format(owner, name)
+        self._metrics = metrics
+        # builder -> (child of seconds, {result: child})
+        self._builders = {}
+
+    def observe_report(self, builder, seconds, result):
+        """Record a reported build."""
+        children = self._builders.get(builder)
+        if children is None:
+            children = self._builders[builder] = (
+                self._metrics.report_seconds.labels(self.label, builder), {})
+        children[0].observe(seconds)
+        child = children[1].get(result)
+        if child is None:
+            child = children[1][result] = self._metrics.reports.labels(
+                self.label, builder, result)
+        child.inc()
+
+
+class PipelineMetrics(Registry):
+    """Metrics of each stage between a build arrives and it is reported."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        super(PipelineMetrics, self).__init__()
+        self.handler_seconds = self.histogram(
+            "hindsight_handler_seconds", "Latency of handling requests.",
+            ("handler", "code"), buckets)
+        self.parse_seconds = self.histogram(
+            "hindsight_parse_seconds", "Time to parse builds of a payload.",
+            buckets=buckets)
+        self.github_seconds = self.histogram(
+            "hindsight_github_request_seconds",
+            "Latency of Github requests by call.", ("repo", "call"), buckets)
+        self.github_errors = self.counter(
+            "hindsight_github_errors_total",
+            "Failed Github requests by status code.",
+            ("repo", "call", "code"))
+        self.github_retries = self.counter(
+            "hindsight_github_retries_total",
+            "Github requests retried after transient errors.",
+            ("repo", "call"))
+        self.pool_wait_seconds = self.histogram(
+            "hindsight_http_pool_wait_seconds",
+            "Time Github requests wait for a free connection slot.",
+            buckets=buckets)
+        self.report_seconds = self.histogram(
+            "hindsight_report_seconds",
+            "Time to find the pull request and report a build.",
+            ("repo", "builder"), buckets)
+        self.reports = self.counter(
+            "hindsight_reports_total", "Builds reported by result.",
+            ("repo", "builder", "result"))
+
+        # (repo, call) -> GithubCallMetrics
+        self._github_calls = {}
+
+    def github_call(self, key):
+        """Returns :class:`GithubCallMetrics` of ``(repo, call)``, created
+        once and reused by later requests.
+        """
+        bound = self._github_calls.get(key)
+        if bound is None:
+            bound = self._github_calls[key] = GithubCallMetrics(self, key)
+        return bound
+
+    def bind_repo(self, owner, name):
+        """Returns :class:`RepoMetrics` of repository ``owner/name``."""
+        return RepoMetrics(self, owner, name)
+
+
+class MetricsHandler(web.RequestHandler):
+    """Returns metrics of application in Prometheus text format."""
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(self.application.metrics.render())
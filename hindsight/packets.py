@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Incremental parser of Buildbot 8 packets."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+import re
+
+_WHITESPACE_RE = re.compile(r'\s*')
+
+_decoder = json.JSONDecoder()
+
+
+def iter_packets(text, events):
+    """Iterates packets in JSON array ``text`` whose event is in ``events``.
+
+    Packets are decoded one by one and the others are dropped at once, so
+    only one packet is alive at a time instead of the whole array.
+    """
+    skip = _WHITESPACE_RE.match
+    pos = skip(text).end()
+    if text[pos:pos + 1] != "[":
+        raise ValueError("Packets must be an array")
+
+    pos = skip(text, pos + 1).end()
+    if text[pos:pos + 1] == "]":
+        return
+
+    while True:
+        packet, pos = _decoder.raw_decode(text, pos)
+        if not isinstance(packet, dict):
+            raise ValueError("Packet must be an object")
+        if packet.get("event") in events:
+            yield packet
+
+        pos = skip(text, pos).end()
+        delimiter = text[pos:pos + 1]
+        if delimiter == "]":
+            return
+        if delimiter != ",":
+            raise ValueError("Expecting ',' delimiter at {}".format(pos))
+        pos = skip(text, pos + 1).end()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Parsers of pull request number in commit message."""
+from __future__ import print_function, division, unicode_literals
+
+import re
+
+
+class MessageParser(object):
+    """Parses number of pull request from commit message with a regular
+    expression, the first group of it must match the number.
+    """
+    def __init__(self, pattern):
+        """Initialize
+
+        :param str pattern: regular expression
+        """
+        self.regex = re.compile(pattern, re.MULTILINE)
+
+    def parse(self, message):
+        """Returns number of pull request in ``message``, or ``None``."""
+        match = self.regex.search(message)
+        if match is None:
+            return None
+        return int(match.group(1))
+
+
+#: Builtin parsers by name.
+PARSERS = {
+    # Merge commit created by Github.
+    "github": MessageParser(r"\AMerge pull request #(\d+) from "),
+    # Merge commit created by homu.
+    "homu": MessageParser(r"\AAuto merge of #(\d+) - "),
+    # Squash commit created by Github, the title ends with number.
+    "squash": MessageParser(r"\A[^\n]* \(#(\d+)\)$"),
+}
+
+#: Parsers used if repository doesn't configure any.
+DEFAULT_PARSERS = ["github", "homu"]
+
+
+def make_parsers(names):
+    """Returns parsers by names, a name is not builtin is used as regular
+    expression.
+
+    :param names: names of builtin parsers or regular expressions
+    :rtype: list of :class:`MessageParser`
+    """
+    return [PARSERS.get(name) or MessageParser(name) for name in names]
+
+
+def parse_pull_number(parsers, message):
+    """Returns the number parsed by the first matched parser, or ``None``."""
+    for parser in parsers:
+        num = parser.parse(message)
+        if num is not None:
+            return num
+    return None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Repository configs loaded from config file, a directory or SQLite."""
+from __future__ import print_function, division, unicode_literals
+
+import collections
+import json
+import os
+import sqlite3
+
+import toml
+
+from . import parsers
+from . import reporter
+
+
+class RepoRegistry(object):
+    """Lookup indexes of repository configs.  A registry is never changed
+    after built, reloading builds a new one and replaces the old one.
+    """
+    def __init__(self, configs):
+        """Initialize
+
+        :param configs: list of repository configs, same as ``[repo.NAME]``
+                        tables of config file
+        """
+        # secret -> builder -> config
+        self._secrets = {}
+        # (owner, name) -> parsers
+        self._parsers = collections.OrderedDict()
+        # (owner, name) -> config, the first one if configured by builders
+        self._configs = {}
+
+        for config in configs:
+            self._secrets.setdefault(config["secret"], {})[
+                config.get("builder")] = config
+
+            reporter.check_names(config.get("reporters", ()))
+
+            key = (config["owner"], config["name"])
+            if key not in self._parsers:
+                self._parsers[key] = parsers.make_parsers(
+                    config.get("merge_parsers", parsers.DEFAULT_PARSERS))
+                self._configs[key] = config
+
+    def __len__(self):
+        return len(self._parsers)
+
+    def __iter__(self):
+        """Iterates ``(owner, name)`` of repositories."""
+        return iter(self._parsers)
+
+    def find(self, secret, builder=None):
+        """Returns config of repository by secret and builder.
+
+        :raises KeyError: if not found
+        """
+        return self._secrets[secret][builder]
+
+    def get_parsers(self, owner, name):
+        """Returns merge parsers of repository, or ``None``."""
+        return self._parsers.get((owner, name))
+
+    def get_config(self, owner, name):
+        """Returns config of repository, or ``None``."""
+        return self._configs.get((owner, name))
+
+
+def load_directory(path):
+    """Returns repository configs of ``*.toml`` files in ``path``, a file
+    contains ``[repo.NAME]`` tables same as config file.
+    """
+    configs = []
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith(".toml"):
+            with open(os.path.join(path, filename)) as f:
+                configs.extend(toml.load(f).get("repo", {}).values())
+    return configs
+
+
+def load_sqlite(path):
+    """Returns repository configs in SQLite database ``path``, table
+    ``repos(name TEXT PRIMARY KEY, config TEXT)`` keeps each config as JSON
+    object same as a ``[repo.NAME]`` table.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT config FROM repos ORDER BY name")
+        return [json.loads(config) for config, in rows]
+    finally:
+        conn.close()
+
+
+def get_sources(config_file, config):
+    """Returns paths of files that repository configs are loaded from."""
+    paths = [config_file]
+    repos_config = config.get("repos", {})
+    if repos_config.get("directory"):
+        directory = repos_config["directory"]
+        paths.append(directory)
+        paths.extend(
+            os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory))
+            if filename.endswith(".toml")
+        )
+    if repos_config.get("sqlite"):
+        paths.append(repos_config["sqlite"])
+    return paths
+
+
+def get_signature(config_file, config):
+    """Returns modification times of sources, changes if any of them is
+    changed, added or removed.
+    """
+    signature = []
+    for path in get_sources(config_file, config):
+        try:
+            signature.append((path, os.stat(path).st_mtime))
+        except OSError:
+            signature.append((path, None))
+    return signature
+
+
+def load_config(config_file):
+    """Returns config and :class:`RepoRegistry` of repositories in config
+    file, ``repos.directory`` and ``repos.sqlite``.
+    """
+    with open(config_file) as f:
+        config = toml.load(f)
+
+    configs = list(config.get("repo", {}).values())
+    repos_config = config.get("repos", {})
+    if repos_config.get("directory"):
+        configs.extend(load_directory(repos_config["directory"]))
+    if repos_config.get("sqlite"):
+        configs.extend(load_sqlite(repos_config["sqlite"]))
+
+    return config, RepoRegistry(configs)
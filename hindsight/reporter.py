@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Reporters of build status to Github."""
+from __future__ import print_function, division, unicode_literals
+
+from tornado.log import gen_log
+
+from .cache import LRUCache
+from .state import StateError
+
+# BuildStatus value -> state of commit status.
+_COMMIT_STATES = {
+    "pending": "pending",
+    "success": "success",
+    "failure": "failure",
+    "unknow": "error",
+}
+
+# BuildStatus value -> state of deployment status.
+_DEPLOYMENT_STATES = {
+    "pending": "in_progress",
+    "success": "success",
+    "failure": "failure",
+    "unknow": "error",
+}
+
+
+class BaseReporter(object):
+    """Base class of reporters."""
+    #: Name of reporter in ``reporters`` of repository config.
+    name = None
+    #: Whether the pull request of build is needed, the lookup is skipped if
+    #: no reporter of repository needs it.
+    needs_pull = False
+
+    def __init__(self, config):
+        """Initialize
+
+        :param config: repository config, same as a ``[repo.NAME]`` table
+        """
+        self.config = config
+
+    def report(self, repo, build, pull=None):
+        """Report ``build``.
+
+        :type repo: :class:`asyncat.repository.Repository`
+        :type build: :class:`~hindsight.deployment.BaseCIBuild`
+        :param pull: pull request of build if :attr:`needs_pull`
+        :type pull: :class:`asyncat.repository.PullRequest`
+        """
+        raise NotImplementedError()     # pragma: no cover
+
+
+class CommentReporter(BaseReporter):
+    """Comments on the pull request, or updates the status comment if
+    ``status_board`` is given.
+    """
+    name = "comment"
+    needs_pull = True
+
+    def __init__(self, config, status_board=None):
+        super(CommentReporter, self).__init__(config)
+        self.status_board = status_board
+
+    async def report(self, repo, build, pull=None):
+        if self.status_board is not None:
+            # Written in background.
+            self.status_board.update(pull, build.get_name(),
+                                     build.get_status())
+        else:
+            body = "Deployment status {}".format(build.get_status())
+            await pull.create_comment(body)
+
+
+class CommitStatusReporter(BaseReporter):
+    """Sets a commit status of the built commit, named by
+    ``status_context`` of repository config, and linked to
+    ``status_target_url`` if configured.
+    """
+    name = "status"
+
+    async def report(self, repo, build, pull=None):
+        status = build.get_status()
+        kwargs = {}
+        if self.config.get("status_target_url"):
+            kwargs["target_url"] = self.config["status_target_url"].format(
+                builder=build.get_name(), number=build.get_number(),
+                sha=build.get_sha())
+        await repo.create_status(
+            build.get_sha(), _COMMIT_STATES[status.value],
+            context=self.config.get(
+                "status_context", "hindsight/{builder}",
+            ).format(builder=build.get_name()),
+            description="Deployment {}".format(status.value),
+            **kwargs
+        )
+
+
+class DeploymentStatusReporter(BaseReporter):
+    """Creates a deployment of the built commit to environment named by
+    ``deployment_environment`` of repository config, and sets its status.
+    Statuses of the same build are set on the same deployment, ids of
+    deployments are shared by processes and nodes with ``state``.
+    """
+    name = "deployment"
+
+    def __init__(self, config, state=None, size=1024, ttl=24 * 3600):
+        """Initialize
+
+        :param config: repository config, same as a ``[repo.NAME]`` table
+        :param state: backend to share ids of deployments
+        :type state: :class:`~hindsight.state.StateBackend`
+        """
+        super(DeploymentStatusReporter, self).__init__(config)
+        self.state = state
+        self.ttl = ttl
+        # (owner, name, sha, environment, number) -> id of deployment
+        self._deployments = LRUCache(size=size, ttl=ttl)
+
+    async def report(self, repo, build, pull=None):
+        environment = self.config.get(
+            "deployment_environment", "{builder}",
+        ).format(builder=build.get_name())
+        key = (repo.owner, repo.label, build.get_sha(), environment,
+               build.get_number())
+
+        deployment_id = self._deployments.get(key)
+        if deployment_id is None and self.state is not None:
+            try:
+                deployment_id = await self.state.get_deployment_id(key)
+            except StateError as e:
+                gen_log.warning("Could not get deployment of %s: %s",
+                                build.get_sha(), e)
+        if deployment_id is None:
+            resp = await repo.client.request(
+                "{}/deployments".format(repo.base_path),
+                params={
+                    "ref": build.get_sha(),
+                    "environment": environment,
+                    "auto_merge": False,
+                    "required_contexts": [],
+                    "description": "Deployed by {}".format(build.get_name()),
+                },
+                method="POST",
+            )
+            deployment_id = resp.data["id"]
+            if self.state is not None:
+                try:
+                    await self.state.set_deployment_id(key, deployment_id,
+                                                       self.ttl)
+                except StateError as e:
+                    gen_log.warning("Could not share deployment of %s: %s",
+                                    build.get_sha(), e)
+        self._deployments.set(key, deployment_id)
+
+        await repo.client.request(
+            "{}/deployments/{}/statuses".format(repo.base_path,
+                                                deployment_id),
+            params={"state": _DEPLOYMENT_STATES[build.get_status().value]},
+            method="POST",
+        )
+
+
+#: Reporters by name.
+REPORTERS = {
+    reporter.name: reporter
+    for reporter in (CommentReporter, CommitStatusReporter,
+                     DeploymentStatusReporter)
+}
+
+#: Reporters used if repository doesn't configure any.
+DEFAULT_REPORTERS = ["comment"]
+
+
+def check_names(names):
+    """Check names of reporters.
+
+    :raises ValueError: if a name is unknown
+    """
+    for name in names:
+        if name not in REPORTERS:
+            raise ValueError("Unknown reporter {!r}, expects one of {}"
+                             .format(name, ", ".join(sorted(REPORTERS))))
+
+
+def make_reporters(config, status_board=None, state=None):
+    """Returns reporters in ``reporters`` of repository config, those don't
+    need pull request go first, so they are reported even if the pull
+    request is not found.
+
+    :param config: repository config, or ``None`` for default reporters
+    :param status_board: status comment of :class:`CommentReporter`
+    :type status_board: :class:`~hindsight.comment.StatusBoard`
+    :param state: backend to share ids of :class:`DeploymentStatusReporter`
+    :type state: :class:`~hindsight.state.StateBackend`
+    :rtype: list of :class:`BaseReporter`
+    """
+    config = config or {}
+    names = config.get("reporters", DEFAULT_REPORTERS)
+    check_names(names)
+
+    reporters = []
+    for name in names:
+        if name == CommentReporter.name:
+            reporters.append(CommentReporter(config, status_board))
+        elif name == DeploymentStatusReporter.name:
+            reporters.append(DeploymentStatusReporter(config, state))
+        else:
+            reporters.append(REPORTERS[name](config))
+    return sorted(reporters, key=lambda reporter: reporter.needs_pull)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Retries and circuit breakers of Github requests."""
+from __future__ import print_function, division, unicode_literals
+
+import random
+import time
+
+from asyncat.client import GithubError
+
+# Methods can be sent again without side effects.
+_IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "PATCH", "DELETE"])
+
+
+class CircuitOpen(GithubError):
+    """Request is rejected because its circuit is open."""
+    def __init__(self, key, retry_after):
+        super(CircuitOpen, self).__init__()
+        #: ``(repo, call)`` of the circuit.
+        self.key = key
+        #: Seconds until the circuit may close.
+        self.retry_after = retry_after
+        self.args = ("Circuit of {} is open, retry after {:.0f}s".format(
+            "/".join(key), retry_after),)
+
+
+def is_transient(error):
+    """Returns True if a request failed with ``error`` may succeed later,
+    such as 5xx responses, timeouts and connection errors.
+    """
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, GithubError):
+        # A timeout or connection error has no response.
+        return error.status_code is None or error.status_code >= 500
+    return isinstance(error, (IOError, OSError))
+
+
+def is_idempotent(path, method):
+    """Returns True if request can be retried, GraphQL queries are sent by
+    POST but don't change anything.
+    """
+    return method in _IDEMPOTENT_METHODS or path == "/graphql"
+
+
+class Backoff(object):
+    """Exponential backoff with full jitter."""
+    def __init__(self, retries=2, base=0.5, cap=10):
+        """Initialize
+
+        :param int retries: max number of retries of a request
+        :param base: seconds of the first backoff
+        :param cap: max seconds of a backoff
+        """
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        """Returns seconds to wait before retry ``attempt``, counts from 0."""
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """Opens after ``failure_threshold`` failures in a row, and rejects
+    requests for ``reset_timeout`` seconds.  Then a request is let through
+    as probe, the circuit closes if it succeeds or opens again if it fails.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    __slots__ = ("failure_threshold", "reset_timeout", "timer", "state",
+                 "failures", "opened_at", "probing")
+
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 timer=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+
+    def allow(self):
+        """Returns True if a request can be sent now."""
+        if self.state == self.OPEN:
+            if self.timer() < self.opened_at + self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.probing = False
+
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def retry_after(self):
+        """Returns seconds until a request may be let through."""
+        return max(self.opened_at + self.reset_timeout - self.timer(), 1)
+
+    def release(self):
+        """Let another request through as probe, the request allowed has
+        been cancelled without result.
+        """
+        self.probing = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if (self.state == self.HALF_OPEN or
+                self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = self.timer()
+            self.probing = False
+
+
+class CircuitBreakers(object):
+    """Circuit breakers by ``(repo, call)``."""
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 timer=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+
+        #: Number of requests rejected by open circuits.
+        self.rejected = 0
+
+        self._breakers = {}
+
+    def get(self, key):
+        """Returns the breaker of ``key``."""
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout, self.timer)
+        return breaker
+
+    def stats(self):
+        """Returns circuits not closed and number of rejected requests."""
+        return {
+            "open": sorted(
+                "/".join(key) for key, breaker in self._breakers.items()
+                if breaker.state != CircuitBreaker.CLOSED
+            ),
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Rate limit aware scheduler of Github requests."""
+from __future__ import print_function, division, unicode_literals
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+
+from asyncat.client import AsyncGithubClient, GithubError
+from tornado import concurrent
+from tornado import gen
+from tornado import ioloop
+from tornado.log import gen_log
+
+from .metrics import get_error_code, get_github_call, now
+from .resilience import CircuitOpen, is_idempotent, is_transient
+
+#: Reporting finished builds.
+PRIORITY_HIGH = 0
+#: Reporting pending builds.
+PRIORITY_NORMAL = 1
+#: Background jobs, such as refreshing index.
+PRIORITY_LOW = 2
+
+# Seconds to wait if Github limits a token without telling reset time.
+_DEFAULT_BACKOFF = 60
+
+# Seconds to gather cached responses before saving them.
+_SAVE_DELAY = 30
+
+# Resources of rate limits shared by processes.
+_RESOURCES = ("core", "search", "graphql")
+
+
+def get_resource(path):
+    """Returns rate limit resource of Github API ``path``."""
+    if path.startswith("/search/"):
+        return "search"
+    if path == "/graphql":
+        return "graphql"
+    return "core"
+
+
+def is_rate_limited(error):
+    """Returns True if :class:`asyncat.client.GithubError` is caused by rate
+    limit.
+    """
+    return (error.status_code in (403, 429) and
+            "rate limit" in str(error).lower())
+
+
+def _get_error_headers(error):
+    # asyncat raises GithubError from HTTPError, which has the response.
+    response = getattr(error.__context__, "response", None)
+    return {} if response is None else response.headers
+
+
+def get_retry_after(error):
+    """Returns seconds of ``Retry-After`` of the response failed with
+    :class:`asyncat.client.GithubError`, or ``None``.
+    """
+    try:
+        return int(_get_error_headers(error)["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class Quota(object):
+    """Rate limit of a token on a resource."""
+    __slots__ = ("limit", "remaining", "reset", "retry_at")
+
+    def __init__(self):
+        #: Requests allowed in a window, ``None`` if unknown.
+        self.limit = None
+        #: Remaining requests, ``None`` if unknown.
+        self.remaining = None
+        #: Time in seconds when the limit resets.
+        self.reset = 0
+        #: Time in seconds until which a secondary rate limit holds.
+        self.retry_at = 0
+
+    def available_at(self):
+        """Returns time in seconds when requests may be sent again."""
+        if self.remaining is not None and self.remaining <= 0:
+            return max(self.reset, self.retry_at)
+        return self.retry_at
+
+    def update(self, headers):
+        """Update from ``X-RateLimit-*`` headers of a response."""
+        if "X-RateLimit-Limit" in headers:
+            self.limit = int(headers["X-RateLimit-Limit"])
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset" in headers:
+            self.reset = int(headers["X-RateLimit-Reset"])
+
+
+class GithubScheduler(object):
+    """Routes Github requests to the token with most remaining requests on
+    the resource of the request, search and core are limited separately.
+
+    When all tokens are exhausted, requests wait until a limit resets, and
+    are resumed in order of priority.  It has the same ``request`` method as
+    :class:`asyncat.client.AsyncGithubClient`.
+    """
+    def __init__(self, tokens, timer=time.time,  # pylint: disable=R0913
+                 metrics=None, host=None, backoff=None, breakers=None,
+                 response_cache=None, transport=None):
+        """Initialize
+
+        :param tokens: list of access tokens
+        :param timer: function returns current time in seconds
+        :param metrics: metrics to record latency and errors of requests
+        :type metrics: :class:`~hindsight.metrics.PipelineMetrics`
+        :param str host: URL of Github API, such as Github Enterprise
+        :param backoff: backoff to retry transient errors, no retry if None
+        :type backoff: :class:`~hindsight.resilience.Backoff`
+        :param breakers: circuit breakers reject calls failing repeatedly
+        :type breakers: :class:`~hindsight.resilience.CircuitBreakers`
+        :param response_cache: cache to serve and revalidate responses
+        :type response_cache: :class:`~hindsight.httpcache.ResponseCache`
+        :param transport: HTTP client shared by clients of all tokens
+        :type transport: :class:`~hindsight.transport.PooledTransport`
+        """
+        if not tokens:
+            raise ValueError("At least one access token is required")
+
+        self.clients = [AsyncGithubClient(token) for token in tokens]
+        # Tokens are shared by their hashes, never in clear.
+        self._token_ids = [
+            hashlib.sha1(token.encode("utf8")).hexdigest()[:16]
+            for token in tokens
+        ]
+        if host:
+            for client in self.clients:
+                # pylint: disable=W0212
+                client._host = host.rstrip("/")
+        if transport is not None:
+            for client in self.clients:
+                # pylint: disable=W0212
+                client._httpclient = transport
+        self.transport = transport
+        self.timer = timer
+        self.metrics = metrics
+        self.backoff = backoff
+        self.breakers = breakers
+        self.response_cache = response_cache
+
+        # (client index, resource) -> Quota
+        self._quotas = {}
+        # heap of (priority, sequence, resource, future)
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup_timeout = None
+        self._wakeup_at = None
+
+    def prioritized(self, priority):
+        """Returns a client sends requests with ``priority`` via current
+        scheduler.
+        """
+        return PrioritizedClient(self, priority)
+
+    def _get_quota(self, index, resource):
+        quota = self._quotas.get((index, resource))
+        if quota is None:
+            quota = self._quotas[(index, resource)] = Quota()
+        return quota
+
+    def _usable(self, quota, now):
+        """Returns number of requests ``quota`` may send now, ``inf`` if
+        unknown.
+        """
+        if quota.retry_at > now:
+            return 0
+        if quota.remaining is not None and quota.remaining <= 0:
+            if quota.reset > now:
+                return 0
+            # The limit has been reset, assume the last known limit until a
+            # response tells the new window.
+            quota.remaining = quota.limit
+            quota.reset = now + _DEFAULT_BACKOFF
+        return float("inf") if quota.remaining is None else quota.remaining
+
+    def _pick(self, resource):
+        """Returns index of the client with most remaining requests, or
+        ``None`` if all of them are exhausted.
+        """
+        now = self.timer()
+        best = None
+        best_remaining = 0
+        for index in range(len(self.clients)):
+            remaining = self._usable(self._get_quota(index, resource), now)
+            if remaining > best_remaining:
+                best, best_remaining = index, remaining
+        return best
+
+    def _wait(self, resource, priority):
+        """Returns a future resolves when a limit of ``resource`` may have
+        been reset.
+        """
+        future = concurrent.Future()
+        heapq.heappush(self._waiters,
+                       (priority, next(self._sequence), resource, future))
+        self._schedule_wakeup([resource])
+        return future
+
+    def _schedule_wakeup(self, resources):
+        reset = min(self._get_quota(index, resource).available_at()
+                    for index in range(len(self.clients))
+                    for resource in resources)
+        wakeup_at = max(reset, self.timer()) + 1
+        if self._wakeup_timeout is not None:
+            if wakeup_at >= self._wakeup_at:
+                return
+            # Limit of this resource resets sooner than the others.
+            ioloop.IOLoop.current().remove_timeout(self._wakeup_timeout)
+        self._wakeup_at = wakeup_at
+        self._wakeup_timeout = ioloop.IOLoop.current().call_later(
+            wakeup_at - self.timer(), self._wakeup)
+
+    def _wakeup(self):
+        """Resume waiting requests in order of priority, as many as the
+        remaining requests of their resources, the others wait again.
+        """
+        self._wakeup_timeout = None
+        now = self.timer()
+        budgets = {}
+        waiters, self._waiters = self._waiters, []
+        while waiters:
+            waiter = heapq.heappop(waiters)
+            _, _, resource, future = waiter
+            if future.done():
+                # Cancelled.
+                continue
+            if resource not in budgets:
+                budgets[resource] = sum(
+                    self._usable(self._get_quota(index, resource), now)
+                    for index in range(len(self.clients)))
+            if budgets[resource] > 0:
+                budgets[resource] -= 1
+                future.set_result(None)
+            else:
+                heapq.heappush(self._waiters, waiter)
+
+        if self._waiters:
+            self._schedule_wakeup(
+                set(waiter[2] for waiter in self._waiters))
+
+    async def request(self, path, params=None, priority=PRIORITY_NORMAL,
+                      **kwargs):
+        """Send request via the client with most remaining requests.
+        Idempotent requests failed with transient errors are retried with
+        :attr:`backoff`, and requests of an open circuit fail at once.
+
+        :param int priority: lower value is resumed first if waiting
+        :raises hindsight.resilience.CircuitOpen: if the circuit is open
+        """
+        method = kwargs.get("method", "GET")
+        cache_key = cached = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.get_key(
+                path, params, method, kwargs.get("headers"))
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                kwargs["headers"] = dict(kwargs.get("headers") or {},
+                                         **cached.validators())
+
+        key = get_github_call(path, params, method)
+        breaker = None
+        if self.breakers is not None:
+            breaker = self.breakers.get(key)
+            if not breaker.allow():
+                self.breakers.rejected += 1
+                raise CircuitOpen(key, breaker.retry_after())
+        call_metrics = None
+        if self.metrics is not None:
+            call_metrics = self.metrics.github_call(key)
+
+        attempt = 0
+        while True:
+            try:
+                resp = await self._request(path, params, priority, cached,
+                                           call_metrics, **kwargs)
+            except asyncio.CancelledError:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    if breaker is not None:
+                        if isinstance(e, GithubError):
+                            # Github is responding.
+                            breaker.record_success()
+                        else:
+                            # Failed without an answer of Github.
+                            breaker.release()
+                    raise
+
+                if breaker is not None:
+                    breaker.record_failure()
+                if (self.backoff is None or
+                        attempt >= self.backoff.retries or
+                        not is_idempotent(path, method) or
+                        (breaker is not None and not breaker.allow())):
+                    raise
+
+                delay = self.backoff.delay(attempt)
+                attempt += 1
+                gen_log.warning("Retry %s %s in %.2fs: %s", method, path,
+                                delay, e)
+                if call_metrics is not None:
+                    call_metrics.retried()
+                await gen.sleep(delay)
+                continue
+
+            if breaker is not None:
+                breaker.record_success()
+            if cache_key is not None:
+                if resp is cached:
+                    self.response_cache.touch(cache_key, cached)
+                elif self.response_cache.set(cache_key, resp):
+                    self.response_cache.save_later(_SAVE_DELAY)
+            return resp
+
+    async def _request(self, path, params,  # pylint: disable=R0913
+                       priority, cached=None, call_metrics=None, **kwargs):
+        """Send request via the client with most remaining requests, retry
+        on another token if rate limited.  Returns ``cached`` if the request
+        is revalidated with it and not modified.
+
+        :type call_metrics: :class:`~hindsight.metrics.GithubCallMetrics`
+        """
+        resource = get_resource(path)
+        while True:
+            index = self._pick(resource)
+            if index is None:
+                gen_log.warning("All tokens are exhausted on %s, wait %s",
+                                resource, path)
+                await self._wait(resource, priority)
+                continue
+
+            quota = self._get_quota(index, resource)
+            if quota.remaining is not None:
+                # Count in-flight request so concurrent requests spread.
+                quota.remaining -= 1
+
+            start = now()
+            try:
+                resp = await self.clients[index].request(
+                    path, params, **kwargs)
+            except GithubError as e:
+                if e.status_code == 304 and cached is not None:
+                    if quota.remaining is not None:
+                        # Not counted by Github.
+                        quota.remaining += 1
+                    if call_metrics is not None:
+                        call_metrics.observe(now() - start)
+                    return cached
+
+                if call_metrics is not None:
+                    call_metrics.observe(now() - start, get_error_code(e))
+                if not is_rate_limited(e):
+                    raise
+                self._limited(quota, e)
+                continue
+            except (IOError, OSError) as e:
+                # Connection errors not wrapped by asyncat.
+                if call_metrics is not None:
+                    call_metrics.observe(now() - start, get_error_code(e))
+                raise
+
+            if call_metrics is not None:
+                call_metrics.observe(now() - start)
+            quota.update(resp.headers)
+            return resp
+
+    def _limited(self, quota, error):
+        """Stop using ``quota`` rate limited with ``error``.  A secondary
+        rate limit holds for ``Retry-After`` seconds and keeps the primary
+        window.
+        """
+        headers = _get_error_headers(error)
+        if headers.get("X-RateLimit-Remaining") == "0":
+            quota.update(headers)
+            if quota.reset <= self.timer():
+                quota.reset = self.timer() + _DEFAULT_BACKOFF
+            return
+
+        retry_after = get_retry_after(error)
+        if retry_after is None:
+            retry_after = _DEFAULT_BACKOFF
+        quota.retry_at = self.timer() + retry_after
+        if quota.remaining is not None:
+            # Not counted by the primary limit.
+            quota.remaining += 1
+
+    async def sync_quotas(self, backend):
+        """Exchange rate limits of tokens with other processes and nodes
+        via ``backend``.  Each one publishes the latest ``X-RateLimit-*`` it
+        has seen, the lowest remaining of the same window is taken, so a
+        token exhausted by others is not picked.
+
+        :type backend: :class:`~hindsight.state.StateBackend`
+        """
+        quotas = {}
+        local = {}
+        for index, token_id in enumerate(self._token_ids):
+            for resource in _RESOURCES:
+                name = "{}:{}".format(token_id, resource)
+                quota = local[name] = self._get_quota(index, resource)
+                if quota.remaining is not None:
+                    quotas[name] = (quota.remaining, quota.reset)
+
+        published = await backend.exchange_quotas(quotas, list(local))
+        for name, (remaining, reset) in published.items():
+            quota = local[name]
+            if reset > quota.reset or reset == quota.reset and (
+                    quota.remaining is None or remaining < quota.remaining):
+                quota.remaining = remaining
+                quota.reset = reset
+
+    def stats(self):
+        """Returns quotas of tokens, number of waiting requests, open
+        circuits and cached responses if enabled.
+        """
+        stats = {
+            "tokens": [
+                {
+                    resource: {
+                        "remaining": quota.remaining,
+                        "reset": quota.reset,
+                    }
+                    for (i, resource), quota in self._quotas.items()
+                    if i == index
+                }
+                for index in range(len(self.clients))
+            ],
+            "waiting": len(self._waiters),
+        }
+        if self.breakers is not None:
+            stats["circuits"] = self.breakers.stats()
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.stats()
+        if self.transport is not None:
+            stats["transport"] = self.transport.stats()
+        return stats
+
+
+class PrioritizedClient(object):   # pylint: disable=R0903
+    """A client sends requests with a priority via
+    :class:`GithubScheduler`.
+    """
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def request(self, path, params=None, **kwargs):
+        """Same as :meth:`GithubScheduler.request` with :attr:`priority`."""
+        return self.scheduler.request(path, params, priority=self.priority,
+                                      **kwargs)
@@ -0,0 +1,664 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Backends of state shared by processes and nodes.
+
+A backend is a key-value store with expiry.  Operations of a step are sent
+as one batch, which is one round trip of a network backend:
+
+- ``("get", key)`` returns value or ``None``
+- ``("set", key, value, ttl, nx)`` returns False if ``nx`` and key exists
+- ``("delete", key)`` returns None
+"""
+from __future__ import print_function, division, unicode_literals
+
+import binascii
+import collections
+import json
+import sqlite3
+import time
+import zlib
+
+from tornado import gen
+from tornado import ioloop
+from tornado import iostream
+from tornado import locks
+from tornado import tcpclient
+from tornado.log import gen_log
+
+from .cache import LRUCache
+
+# Value of a commit no pull request has.
+_NOT_FOUND = "-"
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL
+)
+"""
+
+# Number of writes between purges of expired rows.
+_PURGE_EVERY = 1000
+
+
+def get_owner(owner, name, workers):
+    """Returns index of the worker process owns writes of repository
+    ``owner/name``, the same in all processes.
+    """
+    return zlib.crc32("{}/{}".format(owner, name).encode("utf8")) % workers
+
+
+class StateError(Exception):
+    """Backend failed, such as connection lost or error reply."""
+
+
+class StateBackend(object):
+    """Base class of backends, subclasses implement :meth:`run`."""
+    def __init__(self, prefix=""):
+        """Initialize
+
+        :param str prefix: prefix of all keys
+        """
+        self.prefix = prefix
+
+        #: Number of batches.
+        self.batches = 0
+        #: Number of operations.
+        self.operations = 0
+
+    def run(self, ops):
+        """Run operations in one batch, returns a future resolves to list of
+        results.
+
+        :raises StateError: if the backend failed
+        """
+        raise NotImplementedError()     # pragma: no cover
+
+    def _run(self, ops):
+        self.batches += 1
+        self.operations += len(ops)
+        return self.run(ops)
+
+    def _key(self, *parts):
+        return self.prefix + ":".join("{}".format(part) for part in parts)
+
+    def _pull_key(self, key):
+        return self._key("pull", "/".join(key))
+
+    @gen.coroutine
+    def begin_lookup(self, key, lock_ttl):
+        """Get pull request found by commit ``key``, and take the lock of
+        looking it up if not found.
+
+        :param key: ``(owner, name, sha)``
+        :returns: ``(found, num, locked)``, ``num`` is ``None`` if no pull
+                  request has the commit
+        """
+        value, locked = yield self._run([
+            ("get", self._pull_key(key)),
+            ("set", self._key("lock", "/".join(key)), "1", lock_ttl, True),
+        ])
+        if value is not None:
+            # The lock taken needlessly expires soon, nobody waits for it.
+            raise gen.Return((True, _parse_num(value), False))
+        raise gen.Return((False, None, locked))
+
+    @gen.coroutine
+    def get_pull(self, key):
+        """Returns ``(found, num)`` of commit ``key``."""
+        value, = yield self._run([("get", self._pull_key(key))])
+        raise gen.Return((value is not None, _parse_num(value)))
+
+    @gen.coroutine
+    def finish_lookup(self, key, num, ttl):
+        """Set number of pull request of commit ``key`` for ``ttl`` seconds
+        and release the lock of looking it up.
+        """
+        yield self._run([
+            ("set", self._pull_key(key),
+             _NOT_FOUND if num is None else str(num), ttl, False),
+            ("delete", self._key("lock", "/".join(key))),
+        ])
+
+    def set_pulls(self, keys, num, ttl):
+        """Set number of pull request of commits ``keys`` for ``ttl``
+        seconds, such as commits indexed from a webhook.
+
+        :param keys: list of ``(owner, name, sha)``
+        """
+        return self._run([("set", self._pull_key(key), str(num), ttl, False)
+                          for key in keys])
+
+    @gen.coroutine
+    def add_keys(self, keys, ttl):
+        """Add keys of builds for ``ttl`` seconds.
+
+        :returns: list of bool, False if the key exists
+        """
+        results = yield self._run([
+            ("set", self._dedup_key(key), "1", ttl, True) for key in keys
+        ])
+        raise gen.Return([bool(result) for result in results])
+
+    @gen.coroutine
+    def has_key(self, key):
+        value, = yield self._run([("get", self._dedup_key(key))])
+        raise gen.Return(value is not None)
+
+    def set_keys(self, keys, ttl):
+        """Keep keys of builds ``ttl`` seconds from now."""
+        return self._run([("set", self._dedup_key(key), "1", ttl, False)
+                          for key in keys])
+
+    def remove_keys(self, keys):
+        return self._run([("delete", self._dedup_key(key)) for key in keys])
+
+    def _dedup_key(self, key):
+        return self._key("dedup", binascii.hexlify(key).decode("ascii"))
+
+    @gen.coroutine
+    def get_comment_id(self, key):
+        """Returns id of status comment of pull request ``key``, or
+        ``None``.
+
+        :param key: ``(owner, name, num)``
+        """
+        value, = yield self._run([("get", self._comment_key("comment", key))])
+        raise gen.Return(None if value is None else int(value))
+
+    def set_comment_id(self, key, comment_id, ttl):
+        return self._run([("set", self._comment_key("comment", key),
+                           str(comment_id), ttl, False)])
+
+    def _comment_key(self, kind, key):
+        return self._key(kind, "/".join(map(str, key)))
+
+    @gen.coroutine
+    def begin_comment(self, key, lock_ttl):
+        """Take the lock of writing status comment of pull request ``key``,
+        and get id and statuses of the comment.
+
+        :param key: ``(owner, name, num)``
+        :returns: ``(locked, comment_id, statuses)``, ``statuses`` is list
+                  of ``(builder, status)`` written by all processes
+        """
+        locked, comment_id, statuses = yield self._run([
+            ("set", self._comment_key("comment-lock", key), "1", lock_ttl,
+             True),
+            ("get", self._comment_key("comment", key)),
+            ("get", self._comment_key("statuses", key)),
+        ])
+        raise gen.Return((
+            bool(locked),
+            None if comment_id is None else int(comment_id),
+            [] if statuses is None else [
+                tuple(status) for status in json.loads(statuses)],
+        ))
+
+    def finish_comment(self, key, comment_id, statuses, ttl):
+        """Set id and statuses of status comment of pull request ``key`` for
+        ``ttl`` seconds, and release the lock of writing it.
+        """
+        return self._run([
+            ("set", self._comment_key("comment", key), str(comment_id), ttl,
+             False),
+            ("set", self._comment_key("statuses", key),
+             json.dumps(list(statuses)), ttl, False),
+            ("delete", self._comment_key("comment-lock", key)),
+        ])
+
+    def release_comment(self, key):
+        """Release the lock of writing status comment of ``key``."""
+        return self._run([("delete", self._comment_key("comment-lock", key))])
+
+    @gen.coroutine
+    def get_deployment_id(self, key):
+        """Returns id of deployment of build ``key``, or ``None``.
+
+        :param key: ``(owner, name, sha, environment, number)``
+        """
+        value, = yield self._run([
+            ("get", self._key("deployment", "/".join(map(str, key))))])
+        raise gen.Return(None if value is None else int(value))
+
+    def set_deployment_id(self, key, deployment_id, ttl):
+        return self._run([("set", self._key("deployment",
+                                            "/".join(map(str, key))),
+                           str(deployment_id), ttl, False)])
+
+    @gen.coroutine
+    def exchange_quotas(self, quotas, names):
+        """Get quotas of ``names`` published by all processes, and publish
+        quotas seen by current process, in one batch.
+
+        :param quotas: ``{name: (remaining, reset)}`` to publish, kept until
+                       reset
+        :param names: names of quotas to get
+        :returns: ``{name: (remaining, reset)}`` published before
+        """
+        now = time.time()
+        ops = [("get", self._key("quota", name)) for name in names]
+        ops.extend(
+            ("set", self._key("quota", name),
+             "{}:{}".format(remaining, reset), max(reset - now, 1), False)
+            for name, (remaining, reset) in quotas.items()
+        )
+        results = yield self._run(ops)
+
+        published = {}
+        for name, value in zip(names, results):
+            if value is not None:
+                remaining, reset = value.split(":")
+                published[name] = (int(remaining), int(reset))
+        raise gen.Return(published)
+
+    def close(self):
+        pass
+
+    def stats(self):
+        """Returns number of batches and operations."""
+        return {
+            "backend": self.name,
+            "batches": self.batches,
+            "operations": self.operations,
+        }
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        gen_log.warning("Could not update state: %s", future.exception())
+
+
+def _parse_num(value):
+    if value is None or value == _NOT_FOUND:
+        return None
+    return int(value)
+
+
+class MemoryBackend(StateBackend):
+    """Keeps state in current process."""
+    name = "memory"
+
+    def __init__(self, size=100000, prefix="", timer=time.time):
+        super(MemoryBackend, self).__init__(prefix)
+        self._values = LRUCache(size=size, timer=timer)
+
+    @gen.coroutine
+    def run(self, ops):
+        results = []
+        for op in ops:
+            if op[0] == "get":
+                results.append(self._values.get(op[1]))
+            elif op[0] == "set":
+                _, key, value, ttl, nx = op
+                if nx and key in self._values:
+                    results.append(False)
+                else:
+                    self._values.set(key, value, ttl=ttl)
+                    results.append(True)
+            else:
+                self._values.pop(op[1])
+                results.append(None)
+        raise gen.Return(results)
+
+
+class SQLiteBackend(StateBackend):
+    """Keeps state in a SQLite database in WAL mode, shared by processes of
+    a host.  A batch is a transaction.
+    """
+    name = "sqlite"
+
+    def __init__(self, path, timeout=0.1, prefix="", timer=time.time):
+        """Initialize
+
+        :param str path: path of the database file
+        :param timeout:
+            seconds to wait for a lock of other processes, the IOLoop is
+            blocked while waiting
+        """
+        super(SQLiteBackend, self).__init__(prefix)
+        self.path = path
+        self.timer = timer
+
+        self._conn = sqlite3.connect(path, timeout=timeout,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SQLITE_SCHEMA)
+        self._writes = 0
+
+    @gen.coroutine
+    def run(self, ops):
+        try:
+            results = self._run_batch(ops)
+        except sqlite3.Error as e:
+            raise StateError("SQLite failed: {}".format(e))
+        raise gen.Return(results)
+
+    def _run_batch(self, ops):
+        now = self.timer()
+        results = []
+        conn = self._conn
+        writes = any(op[0] != "get" for op in ops)
+        if writes:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            for op in ops:
+                results.append(self._run_op(conn, op, now))
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        if writes:
+            conn.execute("COMMIT")
+            self._written()
+        return results
+
+    @staticmethod
+    def _run_op(conn, op, now):
+        if op[0] == "get":
+            row = conn.execute(
+                "SELECT value FROM state WHERE key = ? AND expires > ?",
+                (op[1], now),
+            ).fetchone()
+            return None if row is None else row[0]
+
+        if op[0] == "set":
+            _, key, value, ttl, nx = op
+            if nx:
+                conn.execute(
+                    "DELETE FROM state WHERE key = ? AND expires <= ?",
+                    (key, now))
+                return conn.execute(
+                    "INSERT OR IGNORE INTO state (key, value, expires) "
+                    "VALUES (?, ?, ?)", (key, value, now + ttl),
+                ).rowcount == 1
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires) "
+                "VALUES (?, ?, ?)", (key, value, now + ttl))
+            return True
+
+        conn.execute("DELETE FROM state WHERE key = ?", (op[1],))
+        return None
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self):
+        """Remove expired rows."""
+        self._conn.execute("DELETE FROM state WHERE expires <= ?",
+                           (self.timer(),))
+
+    def close(self):
+        self._conn.close()
+
+
+def encode_command(*args):
+    """Returns a command in Redis serialization protocol."""
+    parts = [b"*" + str(len(args)).encode("ascii") + b"\r\n"]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = "{}".format(arg).encode("utf8")
+        parts.append(b"$" + str(len(arg)).encode("ascii") + b"\r\n" + arg +
+                     b"\r\n")
+    return b"".join(parts)
+
+
+class RedisBackend(StateBackend):
+    """Keeps state in a server speaks Redis protocol, shared by nodes.  A
+    batch is sent as a pipeline, replies of concurrent batches are read in
+    order on one connection.
+    """
+    name = "redis"
+
+    def __init__(self, host="127.0.0.1", port=6379,  # pylint: disable=R0913
+                 db=0, password=None, prefix="", timeout=5):
+        super(RedisBackend, self).__init__(prefix)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+
+        self._stream = None
+        self._connect_lock = locks.Lock()
+        # Futures of replies not read yet, in order of commands.
+        self._waiters = collections.deque()
+
+    @gen.coroutine
+    def _connect(self):
+        with (yield self._connect_lock.acquire()):
+            if self._stream is not None:
+                raise gen.Return(self._stream)
+
+            stream = yield gen.with_timeout(
+                time.time() + self.timeout,
+                tcpclient.TCPClient().connect(self.host, self.port))
+            stream.set_nodelay(True)
+            self._read_replies(stream)
+
+            setup = []
+            if self.password:
+                setup.append(("AUTH", self.password))
+            if self.db:
+                setup.append(("SELECT", self.db))
+            if setup:
+                try:
+                    yield self._send(stream, setup)
+                except StateError as e:
+                    # Commands must not run unauthenticated or on db 0.
+                    stream.close()
+                    raise StateError("Could not set up {}:{}: {}".format(
+                        self.host, self.port, e))
+            self._stream = stream
+            raise gen.Return(stream)
+
+    @gen.coroutine
+    def _send(self, stream, commands):
+        try:
+            stream.write(b"".join(encode_command(*command)
+                                  for command in commands))
+        except iostream.StreamClosedError as e:
+            raise StateError("Connection lost: {}".format(e))
+
+        futures = []
+        for _ in commands:
+            future = gen.Future()
+            self._waiters.append(future)
+            futures.append(future)
+        try:
+            replies = yield gen.with_timeout(
+                time.time() + self.timeout, gen.multi(futures),
+                quiet_exceptions=(StateError,))
+        except gen.TimeoutError:
+            # Replies of later commands would be taken as these.
+            stream.close()
+            raise StateError("No reply from {}:{} in {} seconds".format(
+                self.host, self.port, self.timeout))
+        raise gen.Return(replies)
+
+    @gen.coroutine
+    def _read_replies(self, stream):
+        try:
+            while True:
+                reply = yield self._read_reply(stream)
+                future = self._waiters.popleft()
+                if isinstance(reply, StateError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (iostream.StreamClosedError, IndexError) as e:
+            gen_log.warning("Connection to %s:%s is lost: %r",
+                            self.host, self.port, e)
+        finally:
+            if self._stream is stream:
+                self._stream = None
+            stream.close()
+            waiters, self._waiters = self._waiters, collections.deque()
+            for future in waiters:
+                future.set_exception(StateError("Connection lost"))
+
+    @gen.coroutine
+    def _read_reply(self, stream):
+        line = yield stream.read_until(b"\r\n")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            raise gen.Return(rest.decode("utf8"))
+        if kind == b"-":
+            raise gen.Return(StateError(rest.decode("utf8")))
+        if kind == b":":
+            raise gen.Return(int(rest))
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                raise gen.Return(None)
+            data = yield stream.read_bytes(length + 2)
+            raise gen.Return(data[:-2].decode("utf8"))
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                raise gen.Return(None)
+            items = []
+            for _ in range(length):
+                item = yield self._read_reply(stream)
+                items.append(item)
+            raise gen.Return(items)
+        raise iostream.StreamClosedError(
+            "Unknown reply {!r}".format(line))
+
+    @staticmethod
+    def _to_command(op):
+        if op[0] == "get":
+            return ("GET", op[1])
+        if op[0] == "set":
+            _, key, value, ttl, nx = op
+            command = ("SET", key, value, "PX", max(int(ttl * 1000), 1))
+            return command + ("NX",) if nx else command
+        return ("DEL", op[1])
+
+    @gen.coroutine
+    def run(self, ops):
+        try:
+            stream = yield self._connect()
+        except (gen.TimeoutError, IOError) as e:
+            raise StateError("Could not connect to {}:{}: {}".format(
+                self.host, self.port, e))
+
+        replies = yield self._send(stream, [self._to_command(op)
+                                            for op in ops])
+        results = []
+        for op, reply in zip(ops, replies):
+            if op[0] == "set":
+                results.append(reply == "OK")
+            elif op[0] == "get":
+                results.append(reply)
+            else:
+                results.append(None)
+        raise gen.Return(results)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+
+#: Backends by name.
+BACKENDS = {
+    backend.name: backend
+    for backend in (MemoryBackend, SQLiteBackend, RedisBackend)
+}
+
+
+def make_backend(config):
+    """Returns backend of ``[state]`` config.
+
+    :raises ValueError: if backend is unknown
+    """
+    name = config.get("backend", "memory")
+    prefix = config.get("prefix", "hindsight:")
+    if name == "memory":
+        return MemoryBackend(size=config.get("size", 100000), prefix=prefix)
+    if name == "sqlite":
+        return SQLiteBackend(config["path"],
+                             timeout=config.get("busy_timeout", 0.1),
+                             prefix=prefix)
+    if name == "redis":
+        return RedisBackend(
+            host=config.get("host", "127.0.0.1"),
+            port=config.get("port", 6379),
+            db=config.get("db", 0),
+            password=config.get("password") or None,
+            prefix=prefix,
+            timeout=config.get("timeout", 5),
+        )
+    raise ValueError("Unknown state backend {!r}, expects one of {}".format(
+        name, ", ".join(sorted(BACKENDS))))
+
+
+class StateDedupSet(object):
+    """Same as :class:`~hindsight.dedup.DedupSet` but keeps keys in a
+    :class:`StateBackend`, so a build resent to another process or node is
+    suppressed too.
+    """
+    def __init__(self, backend, window=600, inflight_ttl=60):
+        """Initialize
+
+        :type backend: :class:`StateBackend`
+        :param window: seconds to remember a key
+        :param inflight_ttl: seconds to keep a key being reported, so a key
+                             left by a crashed process expires
+        """
+        self.backend = backend
+        self.window = window
+        self.inflight_ttl = inflight_ttl
+
+        #: Number of keys checked.
+        self.checked = 0
+        #: Number of duplicates suppressed.
+        self.suppressed = 0
+
+        self._inflight = set()
+
+    @gen.coroutine
+    def begin_all(self, keys):
+        """Start reporting builds with ``keys`` in one batch.  If the
+        backend fails, builds are reported rather than dropped.
+
+        :returns: list of bool, False if it's a duplicate
+        """
+        self.checked += len(keys)
+        try:
+            results = yield self.backend.add_keys(keys, self.inflight_ttl)
+        except StateError as e:
+            gen_log.warning("Could not check duplicate builds: %s", e)
+            raise gen.Return([True] * len(keys))
+
+        for key, added in zip(keys, results):
+            if added:
+                self._inflight.add(key)
+            else:
+                self.suppressed += 1
+        raise gen.Return(results)
+
+    def finish_all(self, keys, reported=True):
+        """Finish reporting builds with ``keys``, they are remembered only
+        if ``reported``.  Returns a future, failure is logged.
+        """
+        for key in keys:
+            self._inflight.discard(key)
+        if reported:
+            future = self.backend.set_keys(keys, self.window)
+        else:
+            future = self.backend.remove_keys(keys)
+        ioloop.IOLoop.current().add_future(future, _log_failure)
+        return future
+
+    def stats(self):
+        """Returns number of checked and suppressed builds."""
+        return {
+            "checked": self.checked,
+            "suppressed": self.suppressed,
+            "inflight": len(self._inflight),
+        }
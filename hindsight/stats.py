@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Runtime statistics."""
+from __future__ import print_function, division, unicode_literals
+
+from tornado import web
+
+
+class StatsHandler(web.RequestHandler):
+    """Returns statistics of application in JSON."""
+    def get(self):
+        self.write(self.application.get_stats())
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Per-request tracing of reporting phases."""
+from __future__ import print_function, division, unicode_literals
+
+import collections
+import cProfile
+import io
+import itertools
+import pstats
+import time
+
+from tornado import gen
+from tornado import web
+
+from .cache import LRUCache
+from .metrics import now
+
+
+class Span(object):
+    """A timed phase of a trace, used as context manager."""
+    __slots__ = ("name", "tags", "start", "end", "error")
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.start = None
+        self.end = None
+        self.error = None
+
+    def set(self, **tags):
+        """Set tags, such as outcome of the phase."""
+        self.tags.update(tags)
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = now()
+        if exc_type is not None and not issubclass(
+                exc_type, (gen.Return, StopIteration)):
+            self.error = "{}: {}".format(exc_type.__name__, exc_value)
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "offset": self.start - origin if self.start else None,
+            "duration": self.end - self.start if self.end else None,
+            "tags": self.tags,
+            "error": self.error,
+        }
+
+
+class Trace(object):
+    """Spans of a request."""
+    def __init__(self, trace_id, name, max_spans=200):
+        self.id = trace_id
+        self.name = name
+        self.max_spans = max_spans
+        self.time = time.time()
+        self.start = now()
+        self.end = None
+        self.tags = {}
+        self.spans = []
+        #: Spans dropped because of ``max_spans``.
+        self.dropped = 0
+        #: Repositories the trace touched.
+        self.repos = set()
+        #: Text of profile if sampled.
+        self.profile = None
+
+    def span(self, name, **tags):
+        """Returns a new :class:`Span`."""
+        span = Span(name, tags)
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+        return span
+
+    def set(self, **tags):
+        self.tags.update(tags)
+
+    def add_repo(self, repo):
+        """Mark the trace touched ``repo``."""
+        self.repos.add(repo)
+
+    @property
+    def duration(self):
+        return (self.end or now()) - self.start
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "time": self.time,
+            "duration": self.duration,
+            "tags": self.tags,
+            "repos": sorted(self.repos),
+            "spans": [span.to_dict(self.start) for span in self.spans],
+            "dropped": self.dropped,
+            "profile": self.profile,
+        }
+
+
+class _NullSpan(object):
+    """Span does nothing, used when tracing is disabled."""
+    __slots__ = ()
+
+    def set(self, **tags):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _NullTrace(object):
+    """Trace does nothing, used when tracing is disabled."""
+    __slots__ = ()
+
+    def span(self, name, **tags):
+        return _NULL_SPAN
+
+    def set(self, **tags):
+        pass
+
+    def add_repo(self, repo):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+#: Trace used when tracing is disabled.
+NULL_TRACE = _NullTrace()
+
+
+class Tracer(object):
+    """Keeps the last ``size`` traces and the slowest trace of each
+    repository in the last ``slowest_ttl`` seconds.
+    """
+    def __init__(self, size=100, max_repos=1024, slowest_ttl=3600,
+                 profile_every=0, max_spans=200):
+        """Initialize
+
+        :param int size: number of recent traces to keep
+        :param int max_repos: max number of repositories of slowest traces
+        :param slowest_ttl: seconds to keep a slowest trace
+        :param int profile_every: profile one in every ``profile_every``
+                                  traces with cProfile, 0 disables it
+        :param int max_spans: max number of spans in a trace
+        """
+        self.profile_every = profile_every
+        self.max_spans = max_spans
+
+        self._recent = collections.deque(maxlen=size)
+        self._slowest = LRUCache(size=max_repos, ttl=slowest_ttl)
+        self._ids = itertools.count(1)
+
+        # Only one profiler can be enabled at a time.
+        self._profiling = None
+        self._profiler = None
+
+    def start(self, name):
+        """Returns a new :class:`Trace` which may be profiled."""
+        trace = Trace(next(self._ids), name, self.max_spans)
+        if (self.profile_every and self._profiling is None and
+                trace.id % self.profile_every == 0):
+            self._profiling = trace
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return trace
+
+    def finish(self, trace):
+        """Record ``trace``."""
+        trace.end = now()
+        if self._profiling is trace:
+            self._profiler.disable()
+            trace.profile = self._format_profile(self._profiler)
+            self._profiling = self._profiler = None
+
+        self._recent.append(trace)
+        for repo in trace.repos:
+            slowest = self._slowest.get(repo)
+            if slowest is None or trace.duration > slowest.duration:
+                self._slowest.set(repo, trace)
+
+    @staticmethod
+    def _format_profile(profiler, limit=30):
+        """Returns text of top ``limit`` functions by cumulative time, the
+        profile covers other requests run at the same time.
+        """
+        stream = io.StringIO() if str is not bytes else io.BytesIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def to_dict(self):
+        return {
+            "recent": [trace.to_dict() for trace in reversed(self._recent)],
+            "slowest": {
+                repo: trace.to_dict() for repo, trace in self._slowest.items()
+            },
+        }
+
+
+class TracesHandler(web.RequestHandler):
+    """Returns recent and slowest traces in JSON."""
+    def get(self):
+        self.write(self.application.tracer.to_dict())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Pooled HTTP transport of Github clients."""
+from __future__ import print_function, division, unicode_literals
+
+import asyncio
+
+from tornado import httpclient
+from tornado import locks
+
+from .metrics import now
+
+#: Backends of transport.
+BACKENDS = ("simple", "curl")
+
+
+def _make_http2_callback():
+    import pycurl
+
+    def prepare_curl(curl):
+        curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2_0)
+    return prepare_curl
+
+
+class PooledTransport(object):
+    """Sends requests of Github clients via one HTTP client of its own.
+    At most ``max_clients`` requests are in flight, others wait in order, so
+    wait time and saturation of the pool are known.
+
+    The ``curl`` backend needs ``pycurl``, it keeps connections alive and
+    reuses them, ``simple`` opens a connection for each request.
+    """
+    def __init__(self, backend="simple",  # pylint: disable=R0913
+                 max_clients=10, connect_timeout=20, request_timeout=20,
+                 http2=False, metrics=None):
+        """Initialize
+
+        :param str backend: ``simple`` or ``curl``
+        :param int max_clients: max number of requests in flight
+        :param connect_timeout: seconds to wait for connecting
+        :param request_timeout: seconds to wait for a response
+        :param bool http2: use HTTP/2, only with ``curl``
+        :param metrics: metrics to record wait time of requests
+        :type metrics: :class:`~hindsight.metrics.PipelineMetrics`
+        :raises ValueError: if options are invalid
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Unknown HTTP backend {!r}, expects one of {}"
+                             .format(backend, ", ".join(BACKENDS)))
+        if http2 and backend != "curl":
+            raise ValueError("HTTP/2 requires curl backend")
+
+        self.backend = backend
+        self.max_clients = max_clients
+        self.metrics = metrics
+
+        defaults = {
+            "connect_timeout": connect_timeout,
+            "request_timeout": request_timeout,
+        }
+        if backend == "curl":
+            from tornado.curl_httpclient import CurlAsyncHTTPClient
+            if http2:
+                defaults["prepare_curl_callback"] = _make_http2_callback()
+            self.client = CurlAsyncHTTPClient(
+                force_instance=True, max_clients=max_clients,
+                defaults=defaults)
+        else:
+            self.client = httpclient.AsyncHTTPClient(
+                force_instance=True, max_clients=max_clients,
+                defaults=defaults)
+
+        #: Number of requests in flight.
+        self.active = 0
+        #: Number of requests waiting for a free slot.
+        self.waiting = 0
+        #: Number of requests sent when the pool was full.
+        self.waited = 0
+        #: Total seconds of waiting.
+        self.wait_seconds = 0
+
+        self._semaphore = locks.Semaphore(max_clients)
+
+    async def fetch(self, request, **kwargs):
+        """Same as :meth:`tornado.httpclient.AsyncHTTPClient.fetch`."""
+        start = now()
+        if self.waiting or self.active >= self.max_clients:
+            self.waited += 1
+        self.waiting += 1
+        acquiring = self._semaphore.acquire()
+        try:
+            await acquiring
+        except asyncio.CancelledError:
+            if acquiring.done() and not acquiring.cancelled():
+                # Acquired but cancelled before resumed.
+                self._semaphore.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+        wait = now() - start
+        self.wait_seconds += wait
+        if self.metrics is not None:
+            self.metrics.pool_wait_seconds.labels().observe(wait)
+
+        self.active += 1
+        try:
+            resp = await self.client.fetch(request, **kwargs)
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+        return resp
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        """Returns usage of the pool."""
+        return {
+            "backend": self.backend,
+            "max_clients": self.max_clients,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waited": self.waited,
+            "wait_seconds": self.wait_seconds,
+        }
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Github webhook."""
+from __future__ import print_function, division, unicode_literals
+
+import hashlib
+import hmac
+import json
+
+from tornado import web
+from tornado.log import gen_log
+
+
+def verify_signature(secret, body, signature):
+    """Returns True if ``signature`` in ``X-Hub-Signature`` header is the
+    HMAC hex digest of ``body`` with ``secret``.
+    """
+    if not signature or "=" not in signature:
+        return False
+
+    algorithm, digest = signature.split("=", 1)
+    if algorithm not in ("sha1", "sha256"):
+        return False
+
+    expected = hmac.new(secret.encode("utf8"), body,
+                        getattr(hashlib, algorithm)).hexdigest()
+    return hmac.compare_digest(expected, str(digest))
+
+
+class GithubWebhookHandler(web.RequestHandler):
+    """Consumes ``pull_request`` and ``push`` events to map commits to pull
+    requests in :class:`~hindsight.index.PullRequestIndex` before builds
+    report them.  Mapped commits are shared with other processes via
+    :attr:`~hindsight.app.Application.state`, which may receive the builds.
+    """
+    #: Seconds to gather index writes before saving.
+    save_delay = 5
+
+    async def post(self):
+        signature = (self.request.headers.get("X-Hub-Signature-256") or
+                     self.request.headers.get("X-Hub-Signature"))
+        secret = self.application.config["github"]["webhook_secret"]
+        if not verify_signature(secret, self.request.body, signature):
+            gen_log.warning("Github webhook signature mismatch")
+            raise web.HTTPError(403)
+
+        event = self.request.headers.get("X-Github-Event")
+        try:
+            payload = json.loads(self.request.body.decode("utf8"))
+            repository = payload.get("repository")
+        except (ValueError, AttributeError):
+            gen_log.warning("Malformed Github webhook %s", event)
+            raise web.HTTPError(400)
+        if not repository:
+            # Such as ping and installation events of an organization.
+            self.set_status(204)
+            return
+        owner, name = repository["full_name"].split("/", 1)
+
+        index = self.application.pull_index
+        num, shas = None, []
+        if event == "pull_request":
+            num, shas = self._on_pull_request(index, owner, name, payload)
+        elif event == "push":
+            num, shas = self._on_push(index, owner, name, payload)
+
+        index.save_later(self.save_delay)
+        if shas:
+            await self.application.share_pulls(owner, name, shas, num)
+        self.write("OK")
+
+    @staticmethod
+    def _on_pull_request(index, owner, name, payload):
+        """Returns number of pull request and its mapped shas."""
+        if payload["action"] in ("opened", "reopened", "synchronize",
+                                 "closed"):
+            pull = payload["pull_request"]
+            return pull["number"], index.add_pull(owner, name, pull)
+        return None, []
+
+    @staticmethod
+    def _on_push(index, owner, name, payload):
+        """Returns number of pull request and the pushed shas."""
+        ref = payload["ref"]
+        if not ref.startswith("refs/heads/"):
+            return None, []
+
+        num = index.get_branch(owner, name, ref[len("refs/heads/"):])
+        if num is None:
+            return None, []
+
+        shas = [commit["id"] for commit in payload["commits"]]
+        for sha in shas:
+            index.add(owner, name, sha, num)
+        return num, shas
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Background workers to report builds."""
+from __future__ import print_function, division, unicode_literals
+
+import collections
+
+from tornado import gen
+from tornado import ioloop
+from tornado import queues
+from tornado.log import gen_log
+
+QueueFull = queues.QueueFull
+
+
+class WorkerPool(object):
+    """A fixed number of coroutines on the IOLoop drain a queue of jobs.
+    Jobs of the same repository are limited to ``per_repo`` concurrent
+    workers, a job of a busy repository is parked and handled by a worker of
+    that repository when it finishes, so other workers go on with jobs of
+    other repositories.
+    """
+    def __init__(self, handle, workers=4, per_repo=2, max_queue=0):
+        """Initialize
+
+        :param handle:
+            coroutine function accepts
+            :class:`asyncat.repository.Repository` and arguments passed to
+            :meth:`put`
+        :param int workers: number of workers
+        :param int per_repo: max number of workers on one repository
+        :param int max_queue: max number of queued jobs, 0 for unlimited
+        """
+        self.workers = workers
+        self.per_repo = per_repo
+        self.queue = queues.Queue(maxsize=max_queue)
+
+        #: Number of workers are handling a job.
+        self.busy = 0
+        self.processed = 0
+        self.failed = 0
+
+        self._handle = handle
+        # (owner, name) -> number of workers on the repository
+        self._running = {}
+        # (owner, name) -> deque of jobs waiting for a worker of repository
+        self._parked = {}
+        self._parked_count = 0
+        self._started = False
+
+    def start(self):
+        """Spawn workers on current IOLoop."""
+        if self._started:
+            return
+
+        self._started = True
+        io_loop = ioloop.IOLoop.current()
+        for _ in range(self.workers):
+            io_loop.spawn_callback(self._work)
+
+    def put(self, repo, *args):
+        """Enqueue a job of ``repo``, returns a future resolves when the job
+        is in the queue.
+        """
+        self.start()
+        return self.queue.put((repo, args))
+
+    def put_nowait(self, repo, *args):
+        """Enqueue a job of ``repo`` without blocking.
+
+        :raises QueueFull: if the queue is full
+        """
+        if self.full():
+            raise QueueFull()
+        self.start()
+        self.queue.put_nowait((repo, args))
+
+    def full(self):
+        """Returns True if queued and parked jobs reach ``max_queue``."""
+        if self.queue.full():
+            return True
+        return (self.queue.maxsize > 0 and
+                self.queue.qsize() + self._parked_count >= self.queue.maxsize)
+
+    def join(self, timeout=None):
+        """Returns a future resolves when all queued jobs are handled."""
+        return self.queue.join(timeout)
+
+    @gen.coroutine
+    def _work(self):
+        while True:
+            repo, args = yield self.queue.get()
+            key = (repo.owner, repo.label)
+            if self._running.get(key, 0) >= self.per_repo:
+                self._parked.setdefault(key, collections.deque()).append(
+                    (repo, args))
+                self._parked_count += 1
+                continue
+
+            self._running[key] = self._running.get(key, 0) + 1
+            try:
+                while True:
+                    yield self._run(repo, args)
+                    # Parked jobs of the repository go first.
+                    parked = self._parked.get(key)
+                    if not parked:
+                        break
+                    repo, args = parked.popleft()
+                    self._parked_count -= 1
+                    if not parked:
+                        del self._parked[key]
+            finally:
+                self._running[key] -= 1
+                if not self._running[key]:
+                    del self._running[key]
+
+    @gen.coroutine
+    def _run(self, repo, args):
+        self.busy += 1
+        try:
+            yield self._handle(repo, *args)
+        except Exception:   # pylint: disable=W0703
+            self.failed += 1
+            gen_log.error("Failed to handle job of %s/%s",
+                          repo.owner, repo.label, exc_info=True)
+        else:
+            self.processed += 1
+        finally:
+            self.busy -= 1
+            self.queue.task_done()
+
+    def stats(self):
+        """Returns queue depth and worker utilization."""
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "utilization": self.busy / self.workers if self.workers else 0,
+            "queue": self.queue.qsize() + self._parked_count,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
@@ -18,6 +18,15 @@ from tornado import testing
 from hindsight.app import Application
 
 
+class FakeTimer(object):
+    """Timer can be moved forward by test."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
 class HindsightTestCase(testing.AsyncHTTPTestCase):
     """Base class of test cases."""
     def setUp(self):
@@ -69,6 +78,15 @@ class HindsightTestCase(testing.AsyncHTTPTestCase):
 
         return future
 
+    @staticmethod
+    def wait_for(future):
+        """Returns side effect of a mocked coroutine function, which waits
+        for ``future``.
+        """
+        async def side_effect(*args, **kwargs):
+            return await future
+        return side_effect
+
     def make_body(self, data):
         """Make request body with urlencoded format."""
         return urlencode(data)
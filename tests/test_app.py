@@ -3,9 +3,32 @@
 """Application test cases."""
 from __future__ import print_function, division, unicode_literals
 
+import json
+import os
+import shutil
+import tempfile
+
 import mock
 
-from hindsight.app import main
+# Imported before IOLoop is patched so it binds the real class.
+import tornado.simple_httpclient  # noqa: F401
+
+from tornado import concurrent
+from tornado import gen
+from tornado import testing
+
+from asyncat.client import GithubError
+from asyncat.repository import PullRequest
+
+from hindsight.app import Application, main
+from hindsight.deployment import BuildbotBuild, BuildStatus
+from hindsight.finder import NoSuchPullRequest
+from hindsight.journal import BuildJournal
+from hindsight.resilience import CircuitOpen
+from hindsight.tracing import Trace
+from hindsight.worker import QueueFull, WorkerPool
+
+from . import HindsightTestCase
 
 
 def test_main():
@@ -22,3 +45,419 @@ def test_main():
             main()
 
         assert mock_ioloop.start.called
+
+
+def test_main_check_state():
+    """Main function checks state before forking."""
+    import sys
+
+    with mock.patch("hindsight.app.process.fork_processes") as mock_fork, \
+            mock.patch.object(sys, "argv", ["hindsight", "tests/cfg.toml",
+                                            "--workers", "2"]):
+        try:
+            main()
+        except SystemExit as e:
+            assert e.code == 2
+        else:
+            raise AssertionError("SystemExit not raised")
+    assert not mock_fork.called
+
+
+def test_main_uvloop():
+    """Main function with uvloop."""
+    import sys
+
+    mock_uvloop = mock.Mock()
+    with mock.patch("hindsight.app.ioloop.IOLoop", autospec=True), \
+            mock.patch("hindsight.app.httpserver.HTTPServer"), \
+            mock.patch.dict(sys.modules, {"uvloop": mock_uvloop}), \
+            mock.patch("asyncio.set_event_loop_policy") as mock_set_policy, \
+            mock.patch.object(sys, "argv",
+                              ["hindsight", "tests/cfg.toml", "--uvloop"]):
+        main()
+
+    mock_set_policy.assert_called_once_with(
+        mock_uvloop.EventLoopPolicy.return_value)
+
+
+class FindPullTestCase(HindsightTestCase):
+    """Tests Application.find_pull."""
+    def setUp(self):
+        super(FindPullTestCase, self).setUp()
+        self.mock_repo = mock.Mock(owner="asyncat", label="demo")
+        self.mock_find = self.auto_patch(
+            "hindsight.finder.PullRequestFinder.find", autospec=True)
+
+    @testing.gen_test
+    def test_cache_found_pull(self):
+        mock_pull = mock.Mock()
+        self.mock_find.return_value = mock_pull
+
+        pull = yield self._app.find_pull(self.mock_repo, "sha")
+        self.assertIs(pull, mock_pull)
+        trace = Trace(1, "test")
+        pull = yield self._app.find_pull(self.mock_repo, "sha", trace)
+        self.assertIs(pull, mock_pull)
+
+        span = trace.to_dict()["spans"][0]
+        self.assertEqual(span["tags"], {"sha": "sha", "source": "cache"})
+        self.assertIsNotNone(span["offset"])
+        self.assertIsNotNone(span["duration"])
+
+        self.assertEqual(self.mock_find.call_count, 1)
+        self.assertEqual(self._app.pull_cache.hits, 1)
+        self.assertEqual(self._app.pull_cache.misses, 1)
+
+    @testing.gen_test
+    def test_cache_not_found(self):
+        self.mock_find.side_effect = NoSuchPullRequest()
+
+        with self.assertRaises(NoSuchPullRequest):
+            yield self._app.find_pull(self.mock_repo, "sha")
+        with self.assertRaises(NoSuchPullRequest):
+            yield self._app.find_pull(self.mock_repo, "sha")
+
+        self.assertEqual(self.mock_find.call_count, 1)
+
+    @testing.gen_test
+    def test_coalesce_concurrent_lookups(self):
+        future = concurrent.Future()
+        self.mock_find.side_effect = self.wait_for(future)
+
+        futures = [gen.convert_yielded(
+            self._app.find_pull(self.mock_repo, "sha")) for _ in range(3)]
+        yield gen.moment
+        mock_pull = mock.Mock()
+        future.set_result(mock_pull)
+        pulls = yield futures
+
+        self.assertEqual(pulls, [mock_pull] * 3)
+        self.assertEqual(self.mock_find.call_count, 1)
+
+        yield gen.moment
+        self.assertEqual(self._app.get_stats()["inflight_pulls"], 0)
+
+    @testing.gen_test
+    def test_coalesce_error(self):
+        future = concurrent.Future()
+        self.mock_find.side_effect = self.wait_for(future)
+
+        futures = [gen.convert_yielded(
+            self._app.find_pull(self.mock_repo, "sha")) for _ in range(2)]
+        yield gen.moment
+        future.set_exception(GithubError())
+
+        for f in futures:
+            with self.assertRaises(GithubError):
+                yield f
+
+        self.assertEqual(self.mock_find.call_count, 1)
+
+    def test_stats(self):
+        resp = self.fetch("/stats")
+        self.assertEqual(resp.code, 200)
+        data = json.loads(resp.body.decode("utf8"))
+        self.assertEqual(data["pull_cache"]["size"], 0)
+
+
+class JournalTestCase(HindsightTestCase):
+    """Tests builds kept in journal."""
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "journal.db")
+        self.mock_report_build = self.auto_patch(
+            "hindsight.app.Application.report_build", autospec=True)
+        self.mock_report_build.return_value = None
+
+    def tearDown(self):
+        super(JournalTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def _prepare(self, workers=1):
+        self._app.workers = WorkerPool(self._app._report_queued_build,
+                                       workers=workers)
+        self._app.journal = BuildJournal(self.path, flush_interval=0)
+
+    def test_ack_reported_build(self):
+        self._prepare()
+        build = mock.Mock(**{"to_record.return_value": {}})
+        self._app.enqueue_build(mock.Mock(owner="o", label="n"), build)
+        self.io_loop.run_sync(self._app.workers.join)
+
+        self.assertEqual(self.mock_report_build.call_count, 1)
+        self.assertEqual(list(self._app.journal.iter_pending()), [])
+        self.assertEqual(self._app.get_stats()["journal"]["commits"], 2)
+
+    def test_defer_circuit_open(self):
+        self._prepare()
+        self.mock_report_build.side_effect = [
+            CircuitOpen(("o/n", "pull"), 0.01), None]
+        build = mock.Mock(**{"to_record.return_value": {}})
+        self._app.enqueue_build(mock.Mock(owner="o", label="n"), build)
+        self.io_loop.run_sync(self._app.workers.join)
+        self.assertEqual(len(list(self._app.journal.iter_pending())), 1)
+
+        self.io_loop.run_sync(lambda: gen.sleep(0.05))
+        self.io_loop.run_sync(self._app.workers.join)
+        self.assertEqual(self.mock_report_build.call_count, 2)
+        self.assertEqual(list(self._app.journal.iter_pending()), [])
+
+    def test_replay(self):
+        self._prepare(workers=0)
+        payload = {
+            "event": "buildStarted",
+            "payload": {"build": {"properties": [
+                ["buildername", "rundeploy", "Builder"],
+                ["revision", "sha", "Build"],
+            ]}},
+        }
+        self._app.enqueue_build(mock.Mock(owner="o", label="n"),
+                                BuildbotBuild(payload))
+        self._app.journal.close()
+
+        self._prepare()
+        self.assertEqual(self._app.replay_journal(), 1)
+        self.io_loop.run_sync(self._app.workers.join)
+
+        _, repo, build = self.mock_report_build.call_args[0]
+        self.assertEqual((repo.owner, repo.label), ("o", "n"))
+        self.assertEqual(build.get_sha(), "sha")
+        self.assertEqual(list(self._app.journal.iter_pending()), [])
+
+    def test_queue_full(self):
+        self._prepare(workers=0)
+        self._app.workers.queue = mock.Mock(**{"full.return_value": True})
+
+        with self.assertRaises(QueueFull):
+            self._app.enqueue_build(mock.Mock(), mock.Mock())
+
+
+class ReloadConfigTestCase(HindsightTestCase):
+    """Tests reloading repository configs."""
+    def get_app(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, "cfg.toml")
+        shutil.copy(self.get_file_path("cfg.toml"), self.config_file)
+        return Application(self.config_file)
+
+    def tearDown(self):
+        super(ReloadConfigTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def _append_repo(self, name):
+        with open(self.config_file, "a") as f:
+            f.write('\n[repo.{0}]\nowner = "asyncat"\nname = "{0}"\n'
+                    'secret = "{0}-secret"\n'.format(name))
+
+    def test_reuse_repo(self):
+        build = mock.Mock(**{"get_status.return_value": "pending"})
+        repo = self._app.get_repo("asyncat", "demo", build)
+        self.assertIs(self._app.get_repo("asyncat", "demo", build), repo)
+
+    @testing.gen_test
+    def test_reload(self):
+        build = mock.Mock(**{"get_status.return_value": "pending"})
+        repo = self._app.get_repo("asyncat", "demo", build)
+        self._append_repo("other")
+
+        reloaded = yield self._app.reload_config()
+        self.assertTrue(reloaded)
+        self.assertEqual(self._app.find_repo_config("other-secret")["name"],
+                         "other")
+        self.assertEqual(list(self._app.iter_repos()),
+                         [("asyncat", "demo"), ("asyncat", "other")])
+        self.assertIsNot(self._app.get_repo("asyncat", "demo", build), repo)
+        self.assertEqual(self._app.get_stats()["repos"],
+                         {"count": 2, "reloads": 1})
+
+    @testing.gen_test
+    def test_keep_registry_if_invalid(self):
+        registry = self._app.registry
+        with open(self.config_file, "a") as f:
+            f.write("[repo.broken\n")
+
+        reloaded = yield self._app.reload_config()
+        self.assertFalse(reloaded)
+        self.assertIs(self._app.registry, registry)
+
+    @testing.gen_test
+    def test_reload_if_changed(self):
+        reloaded = yield self._app.reload_if_changed()
+        self.assertFalse(reloaded)
+
+        self._append_repo("other")
+        os.utime(self.config_file, (0, 0))
+        reloaded = yield self._app.reload_if_changed()
+        self.assertTrue(reloaded)
+        self.assertEqual(len(self._app.registry), 2)
+
+    @testing.gen_test
+    def test_no_reload_after_signal(self):
+        self._append_repo("other")
+        os.utime(self.config_file, (0, 0))
+        reloaded = yield self._app.reload_config()
+        self.assertTrue(reloaded)
+
+        # Reloaded by SIGHUP already.
+        reloaded = yield self._app.reload_if_changed()
+        self.assertFalse(reloaded)
+        self.assertEqual(self._app.reloads, 1)
+
+
+class ProcessesTestCase(HindsightTestCase):
+    """Tests applications of two worker processes."""
+    def get_app(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, "cfg.toml")
+        shutil.copy(self.get_file_path("cfg.toml"), self.config_file)
+        with open(self.config_file, "a") as f:
+            f.write('\n[ingest]\nmode = "async"\n'
+                    '[journal]\npath = "{0}/journal.db"\n'
+                    'flush_interval = 0\n'
+                    '[state]\nbackend = "sqlite"\n'
+                    'path = "{0}/state.db"\n'
+                    '[dedup]\nenabled = true\n'.format(self.tmpdir))
+        return self._make_app(0)
+
+    def _make_app(self, index):
+        app = Application(self.config_file, process_index=index,
+                          processes=2)
+        app.report_build = mock.Mock(return_value=self.make_future(None))
+        return app
+
+    def tearDown(self):
+        super(ProcessesTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared_state_required(self):
+        with self.assertRaises(ValueError):
+            Application(self.get_file_path("cfg.toml"), processes=2)
+
+    def test_hand_over_builds(self):
+        other = self._make_app(1)
+        owned = next(app for app in (self._app, other)
+                     if app.owns_repo("asyncat", "demo"))
+        receiver = other if owned is self._app else self._app
+
+        build = BuildbotBuild.from_record({"sha": "sha", "name": "rundeploy"})
+        receiver.enqueue_build(
+            receiver.get_repo("asyncat", "demo", build), build)
+        self.assertEqual(receiver.workers.queue.qsize(), 0)
+        self.assertEqual(receiver.replay_journal(), 0)
+
+        self.assertEqual(owned.replay_journal(), 1)
+        self.assertEqual(owned.replay_journal(), 0)
+        self.io_loop.run_sync(owned.workers.join)
+        self.assertEqual(owned.report_build.call_count, 1)
+        self.assertEqual(list(owned.journal.iter_pending()), [])
+        self.assertEqual(owned.get_stats()["process"]["count"], 2)
+
+    def test_indexed_repos(self):
+        other = self._make_app(1)
+        # Builds are handed over to the owner, which indexes the repository.
+        self.assertEqual(
+            sorted(list(self._app.iter_indexed_repos()) +
+                   list(other.iter_indexed_repos())),
+            sorted(self._app.iter_repos()))
+
+        # Without journal any process may report any repository.
+        other.journal = None
+        self.assertEqual(list(other.iter_indexed_repos()),
+                         list(other.iter_repos()))
+
+    @testing.gen_test
+    def test_share_pulls(self):
+        mock_find = self.auto_patch(
+            "hindsight.finder.PullRequestFinder.find", autospec=True)
+        mock_find.return_value = mock.Mock(num=12)
+        repo = mock.Mock(owner="asyncat", label="demo")
+        yield self._app.find_pull(repo, "sha")
+
+        pull = mock.Mock()
+        repo.pull.return_value = self.make_future(pull)
+        found = yield self._make_app(1).find_pull(repo, "sha")
+        self.assertIs(found, pull)
+        repo.pull.assert_called_once_with(12)
+        self.assertEqual(mock_find.call_count, 1)
+
+    @testing.gen_test
+    def test_wait_shared_lookup(self):
+        mock_find = self.auto_patch(
+            "hindsight.finder.PullRequestFinder.find", autospec=True)
+        finding = concurrent.Future()
+        mock_find.side_effect = self.wait_for(finding)
+        repo = mock.Mock(owner="asyncat", label="demo")
+        first = gen.convert_yielded(self._app.find_pull(repo, "sha"))
+        yield gen.moment
+
+        # Waits for the lookup of the first process.
+        second = gen.convert_yielded(self._make_app(1).find_pull(repo, "sha"))
+        yield gen.sleep(0.05)
+        finding.set_result(mock.Mock(num=12))
+        pull = mock.Mock()
+        repo.pull.return_value = self.make_future(pull)
+
+        found = yield second
+        self.assertIs(found, pull)
+        yield first
+        self.assertEqual(mock_find.call_count, 1)
+
+
+class ReportBuildTestCase(HindsightTestCase):
+    """Tests Application.report_build."""
+    @testing.gen_test
+    def test_edit_status_comment(self):
+        cached = PullRequest(mock.Mock(), mock.Mock(), 1)
+        client = cached.client
+        self._app.find_pull = mock.Mock(
+            return_value=self.make_future(cached))
+        self._app.status_board = mock.Mock()
+        self._app.status_board.stats.return_value = {}
+
+        build = mock.Mock()
+        repo = mock.Mock()
+        yield self._app.report_build(repo, build)
+
+        pull, builder, status = self._app.status_board.update.call_args[0]
+        self.assertEqual((pull.num, builder, status),
+                         (1, build.get_name(), build.get_status()))
+        self.assertIs(pull.client, repo.client)
+        self.assertIs(pull.repo, repo)
+        # The cached one is shared by builds of other priorities.
+        self.assertIs(cached.client, client)
+        self.assertFalse(repo.client.request.called)
+        self.assertIn("comments", self._app.get_stats())
+
+    @testing.gen_test
+    def test_skip_pull_lookup(self):
+        self._app.find_pull = mock.Mock()
+        self._app.registry.get_config = mock.Mock(
+            return_value={"reporters": ["status"]})
+        repo = mock.Mock(owner="asyncat", label="demo",
+                         base_path="/repos/asyncat/demo")
+        repo.create_status.return_value = self.make_future(None)
+
+        yield self._app.report_build(repo, mock.Mock(**{
+            "get_sha.return_value": "sha",
+            "get_status.return_value": BuildStatus.success,
+        }))
+        self.assertFalse(self._app.find_pull.called)
+        self.assertEqual(repo.create_status.call_args[0], ("sha", "success"))
+
+    def test_metrics(self):
+        self._app.find_pull = mock.Mock(
+            return_value=self.make_future(NoSuchPullRequest("sha")))
+        build = mock.Mock(**{"get_name.return_value": "rundeploy"})
+        self.io_loop.run_sync(lambda: self._app.report_build(
+            mock.Mock(owner="asyncat", label="demo"), build))
+
+        resp = self.fetch("/metrics")
+        self.assertEqual(resp.code, 200)
+        body = resp.body.decode("utf8")
+        self.assertIn('hindsight_reports_total{repo="asyncat/demo",'
+                      'builder="rundeploy",result="not_found"} 1', body)
+        self.assertIn('hindsight_report_seconds_count{repo="asyncat/demo",'
+                      'builder="rundeploy"} 1', body)
+        self.assertIn('hindsight_cache_requests_total{cache="pull",'
+                      'result="miss"} 0', body)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""LRUCache test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import pytest
+
+from hindsight.cache import LRUCache
+
+from . import FakeTimer
+
+
+def test_get_and_set():
+    cache = LRUCache(size=2, ttl=10, timer=FakeTimer())
+    cache.set("a", 1)
+
+    assert cache["a"] == 1
+    assert "a" in cache
+    assert cache.get("b") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_expire():
+    timer = FakeTimer()
+    cache = LRUCache(size=2, ttl=10, timer=timer)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+
+    timer.now += 5
+    assert "b" not in cache
+    with pytest.raises(KeyError):
+        cache["b"]
+    assert cache["a"] == 1
+
+    timer.now += 5
+    assert cache.get("a", 0) == 0
+
+
+def test_evict_least_recently_used():
+    cache = LRUCache(size=2, ttl=10, timer=FakeTimer())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache["a"]
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert "b" not in cache
+    assert "a" in cache
+    assert "c" in cache
+    assert cache.items() == [("a", 1), ("c", 3)]
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+
+    cache.clear()
+    assert len(cache) == 0
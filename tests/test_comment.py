@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""StatusBoard test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import mock
+
+from asyncat.client import GithubError
+from tornado import concurrent
+from tornado import gen
+from tornado import testing
+
+from hindsight.comment import StatusBoard
+from hindsight.deployment import BuildStatus
+from hindsight.state import MemoryBackend
+
+from . import HindsightTestCase
+
+
+class StatusBoardTestCase(HindsightTestCase):
+    """Tests StatusBoard."""
+    def setUp(self):
+        super(StatusBoardTestCase, self).setUp()
+        self.board = StatusBoard(debounce=0.01)
+        self.pull = mock.Mock(num=1)
+        self.pull.repo.owner = "owner"
+        self.pull.repo.label = "name"
+        self.pull.repo.base_path = "/repos/owner/name"
+        self.pull.create_comment.return_value = self.make_future(
+            mock.Mock(data={"id": 10}))
+        self.pull.client.request.return_value = self.make_future(None)
+
+    @staticmethod
+    def wait_written():
+        """Wait for the debounced write."""
+        return gen.sleep(0.03)
+
+    @testing.gen_test
+    def test_merge_updates(self):
+        self.board.update(self.pull, "a", BuildStatus.pending)
+        self.board.update(self.pull, "b", BuildStatus.pending)
+        self.board.update(self.pull, "a", BuildStatus.success)
+        self.assertFalse(self.pull.create_comment.called)
+        yield self.wait_written()
+        self.pull.create_comment.assert_called_once_with(
+            "Deployment status\n\n"
+            "| Builder | Status |\n"
+            "| --- | --- |\n"
+            "| a | success |\n"
+            "| b | pending |"
+        )
+
+        self.board.update(self.pull, "b", BuildStatus.failure)
+        yield self.wait_written()
+        path, = self.pull.client.request.call_args[0]
+        self.assertEqual(path, "/repos/owner/name/issues/comments/10")
+        self.assertEqual(self.pull.client.request.call_args[1]["method"],
+                         "PATCH")
+        self.assertIn("| b | failure |",
+                      self.pull.client.request.call_args[1]["params"]["body"])
+
+        self.assertEqual(self.board.stats(),
+                         {"pulls": 1, "creates": 1, "edits": 1,
+                          "failures": 0})
+
+    @testing.gen_test
+    def test_update_while_writing(self):
+        created = concurrent.Future()
+        self.pull.create_comment.return_value = created
+
+        self.board.update(self.pull, "a", BuildStatus.pending)
+        yield gen.sleep(0.02)
+        self.board.update(self.pull, "a", BuildStatus.success)
+
+        created.set_result(mock.Mock(data={"id": 10}))
+        yield self.wait_written()
+        self.assertEqual(self.board.creates, 1)
+        self.assertEqual(self.board.edits, 1)
+
+    @testing.gen_test
+    def test_retry_failed_write(self):
+        self.pull.create_comment.side_effect = [
+            self.make_future(GithubError(mock.Mock(code=502,
+                                                   body=b"Error"))),
+            self.make_future(mock.Mock(data={"id": 10})),
+        ]
+        with mock.patch("hindsight.comment.gen_log") as mock_log:
+            self.board.update(self.pull, "a", BuildStatus.pending)
+            yield gen.sleep(0.06)
+        self.assertEqual(mock_log.warning.call_count, 1)
+        self.assertEqual(self.pull.create_comment.call_count, 2)
+        self.assertEqual(self.board.stats(),
+                         {"pulls": 1, "creates": 1, "edits": 0,
+                          "failures": 1})
+
+    @testing.gen_test
+    def test_give_up_failed_write(self):
+        self.pull.create_comment.return_value = self.make_future(
+            GithubError(mock.Mock(code=403, body=b"Forbidden")))
+        with mock.patch("hindsight.comment.gen_log"):
+            self.board.update(self.pull, "a", BuildStatus.pending)
+            # Retried after 0.02, 0.04 and 0.08 seconds.
+            yield gen.sleep(0.2)
+        self.assertEqual(self.pull.create_comment.call_count, 4)
+
+        # Written with the next update.
+        self.pull.create_comment.return_value = self.make_future(
+            mock.Mock(data={"id": 10}))
+        self.board.update(self.pull, "b", BuildStatus.pending)
+        yield self.wait_written()
+        self.pull.create_comment.assert_called_with(self.board.render(
+            {"a": BuildStatus.pending, "b": BuildStatus.pending}))
+
+    @testing.gen_test
+    def test_recreate_deleted_comment(self):
+        self.board.update(self.pull, "a", BuildStatus.pending)
+        yield self.wait_written()
+
+        self.pull.client.request.return_value = self.make_future(
+            GithubError(mock.Mock(code=404, body=b"Not Found")))
+        self.board.update(self.pull, "a", BuildStatus.success)
+        yield self.wait_written()
+        self.assertEqual(self.board.creates, 2)
+
+    @testing.gen_test
+    def test_shared_comment_id(self):
+        state = MemoryBackend()
+        self.board.state = state
+        self.board.update(self.pull, "a", BuildStatus.pending)
+        yield self.wait_written()
+
+        # Another process edits the comment created by the first.
+        other = StatusBoard(debounce=0.01, state=state)
+        other.update(self.pull, "b", BuildStatus.pending)
+        yield self.wait_written()
+        self.assertEqual(other.stats(),
+                         {"pulls": 1, "creates": 0, "edits": 1,
+                          "failures": 0})
+
+    @testing.gen_test
+    def test_shared_statuses(self):
+        state = MemoryBackend()
+        self.board.state = state
+        other = StatusBoard(debounce=0.01, state=state)
+        self.board.update(self.pull, "a", BuildStatus.pending)
+        yield self.wait_written()
+        other.update(self.pull, "b", BuildStatus.pending)
+        yield self.wait_written()
+        self.board.update(self.pull, "a", BuildStatus.success)
+        yield self.wait_written()
+
+        # Rows written by the other process are kept.
+        self.assertEqual(
+            self.pull.client.request.call_args[1]["params"]["body"],
+            self.board.render({"a": BuildStatus.success,
+                               "b": BuildStatus.pending}))
+
+    @testing.gen_test
+    def test_create_once(self):
+        state = MemoryBackend()
+        self.board.state = state
+        other = StatusBoard(debounce=0.01, state=state)
+        created = concurrent.Future()
+        self.pull.create_comment.return_value = created
+
+        self.board.update(self.pull, "a", BuildStatus.pending)
+        yield gen.sleep(0.02)
+        # Waits for the first process to create the comment.
+        other.update(self.pull, "b", BuildStatus.pending)
+        yield gen.sleep(0.02)
+        self.assertEqual(other.stats()["edits"], 0)
+
+        created.set_result(mock.Mock(data={"id": 10}))
+        yield self.wait_written()
+        self.assertEqual(self.pull.create_comment.call_count, 1)
+        self.assertEqual(other.stats(),
+                         {"pulls": 1, "creates": 0, "edits": 1,
+                          "failures": 0})
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Dedup test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import hashlib
+
+import mock
+
+from hindsight.dedup import BloomFilter, DedupSet, make_key
+from hindsight.deployment import BuildStatus
+
+from . import FakeTimer
+
+
+def make_build(number=1, status=BuildStatus.pending):
+    return mock.Mock(**{
+        "get_name.return_value": "rundeploy",
+        "get_sha.return_value": "sha",
+        "get_status.return_value": status,
+        "get_number.return_value": number,
+    })
+
+
+def digest(i):
+    return hashlib.sha1(str(i).encode("utf8")).digest()[:16]
+
+
+def test_make_key():
+    key = make_key("secret", make_build())
+    assert len(key) == 16
+    assert key == make_key("secret", make_build())
+    assert key != make_key("other", make_build())
+    assert key != make_key("secret", make_build(number=2))
+    assert key != make_key("secret", make_build(status=BuildStatus.success))
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(digest(i))
+
+    assert all(digest(i) in bloom for i in range(1000))
+    false_positives = sum(digest(i) in bloom for i in range(1000, 11000))
+    assert false_positives < 300
+
+
+def test_window():
+    timer = FakeTimer()
+    dedup = DedupSet(window=60, timer=timer)
+
+    assert dedup.begin(b"a")
+    # In progress.
+    assert not dedup.begin(b"a")
+    dedup.finish(b"a")
+    assert not dedup.begin(b"a")
+
+    timer.now += 61
+    assert dedup.begin(b"a")
+    stats = dedup.stats()
+    assert (stats["checked"], stats["suppressed"], stats["inflight"]) == (
+        4, 2, 1)
+
+
+def test_retry_failed():
+    dedup = DedupSet()
+    assert dedup.begin(b"a")
+    dedup.finish(b"a", reported=False)
+    assert dedup.begin(b"a")
+
+
+def test_bloom_rotation():
+    timer = FakeTimer()
+    dedup = DedupSet(size=1, window=60, bloom_capacity=100, timer=timer)
+
+    assert dedup.begin(digest(1))
+    dedup.finish(digest(1))
+    assert dedup.begin(digest(2))
+    dedup.finish(digest(2))
+    # Evicted from the exact cache, still in the Bloom filter.
+    assert not dedup.begin(digest(1))
+
+    timer.now += 30
+    assert not dedup.begin(digest(1))
+    timer.now += 30
+    assert dedup.begin(digest(1))
@@ -7,12 +7,21 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import base64
+import copy
+import json
 
 import mock
 
 from asyncat.client import GithubError
 
+from hindsight.deployment import (BuildbotBuild, BuildbotWebhook,
+                                  BuildStatus)
+from hindsight.dedup import DedupSet
 from hindsight.finder import NoSuchPullRequest
+from hindsight.journal import JournalError
+from hindsight.resilience import CircuitOpen
+from hindsight.tracing import Tracer
+from hindsight.worker import WorkerPool
 
 from . import HindsightTestCase
 
@@ -24,6 +33,27 @@ class BuildbotTestCase(HindsightTestCase):
         with open(self.get_file_path("_buildbot-packets.json")) as f:
             return f.read()
 
+    def _get_batch_packets(self):
+        """Returns packets of builds on two commits and two builders."""
+        packets = [
+            x for x in json.loads(self._get_packets())
+            if x["event"] in ("buildStarted", "buildFinished")
+        ]
+        started, finished = packets
+
+        other_sha = copy.deepcopy(started)
+        for prop in other_sha["payload"]["build"]["properties"]:
+            if prop[0] == "revision":
+                prop[1] = "other-sha"
+
+        other_builder = copy.deepcopy(started)
+        for prop in other_builder["payload"]["build"]["properties"]:
+            if prop[0] == "buildername":
+                prop[1] = "other-builder"
+
+        return json.dumps(
+            [started, finished, started, other_sha, other_builder])
+
     def test_secret_mismatch(self):
         """Secret mismatch should returns 403."""
         resp = self.fetch("/deployment", body=self.make_body({
@@ -32,26 +62,40 @@ class BuildbotTestCase(HindsightTestCase):
         }), method="POST")
         self.assertEqual(resp.code, 403)
 
-    def _push(self):
+        resp = self.fetch("/deployment", body=self.make_body({
+            "secret": "secret",
+            "packets": self._get_batch_packets()
+        }), method="POST")
+        self.assertEqual(resp.code, 403)
+
+    def _push(self, packets=None):
         """Push event."""
         return self.fetch("/deployment", body=self.make_body({
             "secret": "mock-secret",
-            "packets": self._get_packets()
+            "packets": packets or self._get_packets()
         }), method="POST")
 
     @mock.patch("hindsight.app.Application.find_pull", autospec=True)
     def test_pull_not_found(self, mock_find_pull):
         """Pull request not found."""
-        mock_find_pull.return_value = self.make_future(NoSuchPullRequest())
+        mock_find_pull.side_effect = NoSuchPullRequest()
 
         resp = self._push()
         self.assertEqual(resp.code, 200)
         self.assertEqual(resp.body, b'OK')
 
-        mock_find_pull.return_value = self.make_future(GithubError())
+        mock_find_pull.side_effect = GithubError()
         resp = self._push()
         self.assertEqual(resp.code, 404)
 
+    @mock.patch("hindsight.app.Application.find_pull", autospec=True)
+    def test_circuit_open(self, mock_find_pull):
+        """Fails fast with Retry-After while the circuit is open."""
+        mock_find_pull.side_effect = CircuitOpen(("o/n", "search"), 12.5)
+        resp = self._push()
+        self.assertEqual(resp.code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "13")
+
     @mock.patch("hindsight.finder.PullRequestFinder.find", autospec=True)
     def test_find_pull_via_sha(self, mock_find):
         """Find pull request via sha in event."""
@@ -59,12 +103,125 @@ class BuildbotTestCase(HindsightTestCase):
         mock_pull = mock_pull_cls.return_value
         mock_pull.create_comment.return_value = self.make_future(None)
 
-        mock_find.return_value = self.make_future(mock_pull)
+        mock_find.return_value = mock_pull
 
         self._push()
 
         self.assertTrue(mock_pull.create_comment.called)
 
+    @mock.patch("hindsight.app.Application.find_pull", autospec=True)
+    def test_dedup(self, mock_find_pull):
+        """Duplicate builds are answered without reporting, unless the
+        first one failed.
+        """
+        self._app.dedup = DedupSet()
+        mock_find_pull.side_effect = GithubError()
+        self.assertEqual(self._push().code, 404)
+        self.assertEqual(self._push().code, 404)
+        self.assertEqual(mock_find_pull.call_count, 2)
+
+        mock_find_pull.side_effect = NoSuchPullRequest()
+        self.assertEqual(self._push().code, 200)
+        resp = self._push()
+        self.assertEqual((resp.code, resp.body), (200, b"OK"))
+        self.assertEqual(mock_find_pull.call_count, 3)
+        self.assertEqual(self._app.get_stats()["dedup"]["suppressed"], 1)
+
+    @mock.patch("hindsight.finder.PullRequestFinder.find", autospec=True)
+    def test_trace(self, mock_find):
+        """Phases of a request are traced."""
+        self._app.tracer = Tracer()
+        mock_find.side_effect = NoSuchPullRequest()
+
+        self._push()
+
+        traces = self._app.tracer.to_dict()
+        trace = traces["recent"][0]
+        self.assertEqual(trace["tags"], {"status": 200})
+        self.assertEqual(
+            [span["name"] for span in trace["spans"]],
+            ["parse", "get_repo", "report", "find_pull"],
+        )
+        self.assertEqual(trace["spans"][-1]["error"], "NoSuchPullRequest: ")
+        self.assertEqual(list(traces["slowest"]), ["asyncat/demo"])
+
+    def test_make_builds(self):
+        """Keep latest build of each builder and commit."""
+        handler = mock.Mock()
+        handler.request.headers = {}
+        handler.get_argument.return_value = self._get_batch_packets()
+
+        builds = BuildbotWebhook(handler).make_builds()
+        self.assertEqual(
+            [(b.get_name(), b.get_sha(), b.get_status()) for b in builds],
+            [
+                ("rundeploy", "235f37b19e0cf864e2801714d0392bfe42025b72",
+                 BuildStatus.success),
+                ("rundeploy", "other-sha", BuildStatus.pending),
+                ("other-builder", "235f37b19e0cf864e2801714d0392bfe42025b72",
+                 BuildStatus.pending),
+            ],
+        )
+
+    def test_record(self):
+        """Build is restored from its record without payload."""
+        handler = mock.Mock()
+        handler.request.headers = {}
+        handler.get_argument.return_value = self._get_batch_packets()
+
+        build = BuildbotWebhook(handler).make_builds()[0]
+        self.assertIsNone(build.payload)
+        self.assertEqual(build.get_number(), 2)
+
+        record = json.loads(json.dumps(build.to_record()))
+        restored = BuildbotBuild.from_record(record)
+        self.assertEqual(
+            (restored.get_name(), restored.get_sha(), restored.get_status()),
+            (build.get_name(), build.get_sha(), build.get_status()),
+        )
+
+    @mock.patch("hindsight.app.Application.find_pull", autospec=True)
+    def test_batch(self, mock_find_pull):
+        """Report latest build of each builder and commit, a failure doesn't
+        abort others.
+        """
+        mock_pull = mock.Mock()
+        mock_pull.create_comment.return_value = self.make_future(None)
+
+        async def _find_pull(app, repo, sha, trace=None):
+            if sha == "other-sha":
+                return mock_pull
+            raise GithubError()
+        mock_find_pull.side_effect = _find_pull
+
+        resp = self._push(self._get_batch_packets())
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.body, b"OK")
+        self.assertEqual(mock_find_pull.call_count, 2)
+        mock_pull.create_comment.assert_called_once_with(
+            "Deployment status BuildStatus.pending")
+
+    @mock.patch("hindsight.app.Application.report_build", autospec=True)
+    def test_async_ingest(self, mock_report_build):
+        """Responds 202 and reports build in background."""
+        handle = self._app._report_queued_build
+        self._app.workers = WorkerPool(handle, max_queue=1)
+
+        resp = self._push()
+        self.assertEqual(resp.code, 202)
+        self.io_loop.run_sync(self._app.workers.join)
+        self.assertEqual(mock_report_build.call_count, 1)
+
+        with mock.patch("hindsight.app.Application.enqueue_build",
+                        side_effect=JournalError("locked")):
+            resp = self._push()
+        self.assertEqual(resp.code, 503)
+
+        self._app.workers = WorkerPool(handle, workers=0, max_queue=1)
+        self._app.workers.queue.put_nowait(None)
+        resp = self._push()
+        self.assertEqual(resp.code, 503)
+
 
 class Buildbot9TestCase(HindsightTestCase):
     """Buildbot 9 test case."""
@@ -107,13 +264,13 @@ class Buildbot9TestCase(HindsightTestCase):
     @mock.patch("hindsight.app.Application.find_pull", autospec=True)
     def test_pull_not_found(self, mock_find_pull):
         """Could not found pull request."""
-        mock_find_pull.return_value = self.make_future(NoSuchPullRequest())
+        mock_find_pull.side_effect = NoSuchPullRequest()
 
         resp = self._push("done")
         self.assertEqual(resp.code, 200)
         self.assertEqual(resp.body, b'OK')
 
-        mock_find_pull.return_value = self.make_future(GithubError())
+        mock_find_pull.side_effect = GithubError()
         resp = self._push("done")
         self.assertEqual(resp.code, 404)
 
@@ -124,7 +281,7 @@ class Buildbot9TestCase(HindsightTestCase):
         mock_pull = mock_pull_cls.return_value
         mock_pull.create_comment.return_value = self.make_future(None)
 
-        mock_find.return_value = self.make_future(mock_pull)
+        mock_find.return_value = mock_pull
 
         self._push("done")
 
@@ -5,9 +5,15 @@ from __future__ import print_function, division, unicode_literals
 
 import mock
 
+from asyncat.client import GithubError
+from tornado import concurrent
+from tornado import gen
 from tornado import testing
 
+from hindsight.cache import LRUCache
 from hindsight.finder import PullRequestFinder, NoSuchPullRequest
+from hindsight.index import PullRequestIndex
+from hindsight.parsers import DEFAULT_PARSERS, make_parsers
 
 from . import HindsightTestCase
 
@@ -96,3 +102,145 @@ class PullRequestFinderTestCase(HindsightTestCase):
 
         with self.assertRaises(NoSuchPullRequest):
             yield self.finder.find()
+
+    @testing.gen_test
+    def test_find_via_index(self):
+        index = PullRequestIndex(mock.Mock())
+        index.add("owner", "repo-label", "sha", 3)
+        self.finder.index = index
+        self.mock_repo.make = lambda cls, *args: cls(None, *args)
+
+        pull = yield self.finder.find()
+        self.assertEqual(pull.num, 3)
+        self.assertFalse(self.mock_repo.search_pulls.called)
+        self.assertFalse(self.mock_repo.pull.called)
+
+    @testing.gen_test
+    def test_find_via_resolver(self):
+        self.finder.resolver = mock.Mock()
+        self.finder.resolver.resolve.return_value = self.make_future(4)
+        self.finder.index = PullRequestIndex(mock.Mock())
+        self.mock_repo.make = lambda cls, *args: cls(None, *args)
+
+        pull = yield self.finder.find()
+        self.assertEqual(pull.num, 4)
+        self.assertFalse(self.mock_repo.search_pulls.called)
+        self.assertEqual(
+            self.finder.index.get("owner", "repo-label", "sha"), 4)
+
+        self.finder.resolver.resolve.return_value = self.make_future(None)
+        self.mock_repo.commit.return_value = self.make_future(
+            mock.Mock(c={"parents": []}))
+        with self.assertRaises(NoSuchPullRequest):
+            yield PullRequestFinder(self.mock_repo, "sha1",
+                                    resolver=self.finder.resolver).find()
+
+    @testing.gen_test
+    def test_add_found_to_index(self):
+        index = PullRequestIndex(mock.Mock())
+        self.finder.index = index
+
+        resp = mock.create_autospec("tornado.httpclient.HTTPResponse")
+        resp.data = {"total_count": 1, "items": [{"number": 1}]}
+        self.mock_repo.search_pulls.return_value = self.make_future(resp)
+
+        yield self.finder.find()
+        self.assertEqual(index.get("owner", "repo-label", "sha"), 1)
+
+    @testing.gen_test
+    def test_find_via_message(self):
+        resp = mock.create_autospec("tornado.httpclient.HTTPResponse")
+        resp.data = {"total_count": 0}
+        self.mock_repo.search_pulls.return_value = self.make_future(resp)
+
+        commit = mock.create_autospec("asyncat.repository.Commit")
+        commit.c = {
+            "commit": {"message": "Merge pull request #5 from owner/branch"},
+            "parents": [{"sha": "sha0"}, {"sha": "sha1"}],
+        }
+        self.mock_repo.commit.return_value = self.make_future(commit)
+
+        cache = LRUCache()
+        self.finder.parsers = make_parsers(DEFAULT_PARSERS)
+        self.finder.commit_cache = cache
+        yield self.finder.find()
+
+        self.mock_repo.search_pulls.assert_called_once_with("sha")
+        self.mock_repo.pull.assert_called_with(5)
+        # Patches of files are not cached.
+        self.assertEqual(cache[("owner", "repo-label", "sha")], (
+            "Merge pull request #5 from owner/branch", ("sha0", "sha1")))
+
+        # Use cached commit.
+        finder = PullRequestFinder(
+            self.mock_repo, "sha", parsers=self.finder.parsers,
+            commit_cache=cache)
+        yield finder.find()
+        self.assertEqual(self.mock_repo.commit.call_count, 1)
+
+
+class SpeculativeFinderTestCase(PullRequestFinderTestCase):
+    """Tests PullRequestFinder in speculative mode."""
+    def setUp(self):
+        super(SpeculativeFinderTestCase, self).setUp()
+        self.finder.speculative = True
+
+    def _make_search(self, total_count, num=None):
+        resp = mock.create_autospec("tornado.httpclient.HTTPResponse")
+        resp.data = {"total_count": total_count, "items": [{"number": num}]}
+        return resp
+
+    def _make_commit(self, parents):
+        commit = mock.create_autospec("asyncat.repository.Commit")
+        commit.c = {"parents": [{"sha": sha} for sha in parents]}
+        return commit
+
+    @testing.gen_test
+    def test_parent_before_search(self):
+        sha_search = concurrent.Future()
+        self.mock_repo.search_pulls.side_effect = lambda sha: {
+            "sha": sha_search,
+            "sha1": self.make_future(self._make_search(1, 2)),
+        }[sha]
+        self.mock_repo.commit.return_value = self.make_future(
+            self._make_commit(["sha0", "sha1"]))
+
+        pull = yield self.finder.find()
+        self.assertIs(pull, self.mock_pull)
+        self.mock_repo.pull.assert_called_once_with(2)
+        # The loser is cancelled.
+        self.assertTrue(sha_search.cancelled())
+
+    @testing.gen_test
+    def test_search_before_commit(self):
+        commit = concurrent.Future()
+        self.mock_repo.commit.return_value = commit
+        self.mock_repo.search_pulls.return_value = self.make_future(
+            self._make_search(1, 1))
+
+        pull = yield self.finder.find()
+        self.assertIs(pull, self.mock_pull)
+        self.assertTrue(commit.cancelled())
+        self.mock_repo.search_pulls.assert_called_once_with("sha")
+
+    @testing.gen_test
+    def test_ignore_loser_error(self):
+        sha_search = concurrent.Future()
+        self.mock_repo.search_pulls.return_value = sha_search
+        self.mock_repo.commit.return_value = self.make_future(GithubError())
+
+        future = self.finder.find()
+        yield gen.moment
+        sha_search.set_result(self._make_search(1, 1))
+
+        pull = yield future
+        self.assertIs(pull, self.mock_pull)
+
+    @testing.gen_test
+    def test_raise_error(self):
+        self.mock_repo.search_pulls.return_value = self.make_future(
+            self._make_search(0))
+        self.mock_repo.commit.return_value = self.make_future(GithubError())
+
+        with self.assertRaises(GithubError):
+            yield self.finder.find()
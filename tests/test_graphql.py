@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""BatchResolver test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+import re
+
+import mock
+
+from asyncat.client import AsyncGithubClient
+from tornado import gen
+from tornado import testing
+from tornado import web
+
+from hindsight.finder import PullRequestFinder
+from hindsight.graphql import BatchResolver, GraphQLError
+from hindsight.parsers import DEFAULT_PARSERS, make_parsers
+
+from . import HindsightTestCase
+
+_REPO_RE = re.compile(
+    r'(r\d+): repository\(owner: "([^"]+)", name: "([^"]+)"\)')
+_COMMIT_RE = re.compile(r'(c\d+): object\(oid: "([^"]+)"\)')
+
+
+class StubGraphQLHandler(web.RequestHandler):
+    """Answers queries of :class:`BatchResolver` from ``pulls`` of
+    application.
+    """
+    def post(self):
+        query = json.loads(self.request.body.decode("utf8"))["query"]
+        self.application.queries.append(query)
+
+        if "fail" in query:
+            self.write({"errors": [{"message": "fail"}]})
+            return
+
+        data = {}
+        repo = None
+        for line in query.splitlines():
+            match = _REPO_RE.search(line)
+            if match:
+                alias, owner, name = match.groups()
+                repo = data[alias] = {}
+                continue
+
+            match = _COMMIT_RE.search(line)
+            if match:
+                alias, sha = match.groups()
+                num = self.application.pulls.get((owner, name, sha))
+                if num is None:
+                    repo[alias] = None
+                else:
+                    repo[alias] = {
+                        "associatedPullRequests": {
+                            "nodes": [{"number": num}],
+                        },
+                    }
+
+        self.write({"data": data})
+
+
+class BatchResolverTestCase(HindsightTestCase):
+    """Tests BatchResolver against a stub GraphQL server."""
+    def get_app(self):
+        app = web.Application([(r"/graphql", StubGraphQLHandler)])
+        app.queries = []
+        app.pulls = {
+            ("owner", "a", "sha1"): 1,
+            ("owner", "b", "sha2"): 2,
+        }
+        return app
+
+    def setUp(self):
+        super(BatchResolverTestCase, self).setUp()
+        client = AsyncGithubClient("token")
+        self.resolver = BatchResolver(client, max_batch=3, window=0.01,
+                                      host=self.get_url(""))
+
+    @testing.gen_test
+    def test_resolve_in_one_query(self):
+        nums = yield [
+            self.resolver.resolve("owner", "a", "sha1"),
+            self.resolver.resolve("owner", "a", "sha1"),
+            self.resolver.resolve("owner", "b", "sha2"),
+            self.resolver.resolve("owner", "b", "sha3"),
+        ]
+        self.assertEqual(nums, [1, 1, 2, None])
+        self.assertEqual(len(self._app.queries), 1)
+        self.assertEqual(self.resolver.stats(),
+                         {"queries": 1, "resolved": 3, "pending": 0})
+
+    @testing.gen_test
+    def test_flush_on_size(self):
+        futures = [
+            self.resolver.resolve("owner", "a", "sha{}".format(i))
+            for i in range(4)
+        ]
+        yield gen.moment
+        self.assertEqual(self.resolver.queries, 1)
+
+        nums = yield futures
+        self.assertEqual(nums, [None, 1, None, None])
+        self.assertEqual(self.resolver.queries, 2)
+
+    @testing.gen_test
+    def test_errors(self):
+        with self.assertRaises(GraphQLError):
+            yield self.resolver.resolve("owner", "fail", "sha1")
+
+    @testing.gen_test
+    def test_speculative_finder(self):
+        repo = mock.Mock(owner="owner", label="a")
+        repo.make = lambda cls, *args: cls(None, *args)
+        repo.commit.return_value = self.make_future(mock.Mock(c={
+            "commit": {"message": "Merge pull request #5 from owner/b"},
+            "parents": [{"sha": "sha0"}, {"sha": "sha3"}],
+        }))
+        finder = PullRequestFinder(repo, "sha9", speculative=True,
+                                   resolver=self.resolver,
+                                   parsers=make_parsers(DEFAULT_PARSERS))
+        repo.pull.side_effect = lambda num: self.make_future(num)
+
+        # The commit message wins, the cancelled resolving does not stop
+        # others in the same batch.
+        future = gen.convert_yielded(finder.find())
+        while not self.resolver.stats()["pending"]:
+            yield gen.moment
+        sibling = self.resolver.resolve("owner", "a", "sha1")
+        num = yield future
+        self.assertEqual(num, 5)
+        num = yield gen.with_timeout(self.io_loop.time() + 1, sibling)
+        self.assertEqual(num, 1)
+
+    def test_make_query(self):
+        query, aliases = BatchResolver.make_query([
+            ("owner", "a", "sha1"),
+            ("owner", "a", "sha2"),
+        ])
+        self.assertEqual(aliases, {
+            ("owner", "a", "sha1"): ("r0", "c0"),
+            ("owner", "a", "sha2"): ("r0", "c1"),
+        })
+        self.assertIn('r0: repository(owner: "owner", name: "a")', query)
+        self.assertIn('c1: object(oid: "sha2")', query)
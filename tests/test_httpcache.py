@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""ResponseCache test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+from tornado import gen
+from tornado import testing
+
+from hindsight.httpcache import ResponseCache
+
+SHA = "a" * 40
+
+
+def make_response(body=b'{"number": 1}', **headers):
+    return mock.Mock(body=body, headers=headers)
+
+
+def test_get_key():
+    get_key = ResponseCache.get_key
+    assert get_key("/repos/o/n/pulls/1") == "/repos/o/n/pulls/1"
+    assert get_key("/search/issues", {"q": "sha repo:o/n", "a": 1}) == (
+        "/search/issues?a=1&q=sha+repo%3Ao%2Fn")
+    assert get_key("/repos/o/n/pulls") is None
+    # Kept by the commit cache of the finder.
+    assert get_key("/repos/o/n/commits/" + SHA) is None
+    assert get_key("/repos/o/n/issues/1/comments", method="POST") is None
+    assert get_key("/repos/o/n/pulls/1",
+                   headers={"If-None-Match": '"x"'}) is None
+
+
+def test_set():
+    cache = ResponseCache()
+    assert not cache.set("/repos/o/n/pulls/1", make_response())
+    assert cache.set("/repos/o/n/pulls/1", make_response(ETag='"x"'))
+
+    response = cache.get("/repos/o/n/pulls/1")
+    assert response.data == {"number": 1}
+    assert response.validators() == {"If-None-Match": '"x"'}
+    assert response.headers["Etag"] == '"x"'
+    response.data["number"] = 2
+    assert response.data == {"number": 1}
+
+    assert cache.stats() == {"size": 1, "revalidated": 0, "misses": 2}
+
+
+class PersistTestCase(testing.AsyncTestCase):
+    """Tests saving and loading responses."""
+    def setUp(self):
+        super(PersistTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "responses.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(PersistTestCase, self).tearDown()
+
+    def test_save_load(self):
+        cache = ResponseCache(size=2, path=self.path)
+        cache.set("/repos/o/n/pulls/1", make_response(ETag='"1"'))
+        cache.set("/repos/o/n/pulls/2", make_response(
+            b'{"number": 2}', **{"Last-Modified": "Mon"}))
+        cache.get("/repos/o/n/pulls/1")
+        cache.save()
+
+        cache = ResponseCache(size=2, path=self.path)
+        self.assertEqual(cache.get("/repos/o/n/pulls/2").data, {"number": 2})
+        self.assertEqual(cache.get("/repos/o/n/pulls/2").validators(),
+                         {"If-Modified-Since": "Mon"})
+
+        # Recency is kept, so the least recently used one is evicted.
+        cache.set("/repos/o/n/pulls/3", make_response(ETag='"3"'))
+        self.assertIsNone(cache.get("/repos/o/n/pulls/1"))
+
+    @testing.gen_test
+    def test_save_in_executor(self):
+        cache = ResponseCache(path=self.path)
+        cache.set("/repos/o/n/pulls/1", make_response(ETag='"1"'))
+        threads = []
+        write = cache._write    # pylint: disable=W0212
+
+        def _write(entries):
+            threads.append(threading.current_thread())
+            write(entries)
+
+        cache._write = _write   # pylint: disable=W0212
+        cache.save_later(0)
+        while not threads or not os.path.exists(self.path):
+            yield gen.sleep(0.01)
+        yield gen.sleep(0.01)
+
+        self.assertIsNot(threads[0], threading.current_thread())
+        cache = ResponseCache(path=self.path)
+        self.assertEqual(cache.get("/repos/o/n/pulls/1").data, {"number": 1})
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""PullRequestIndex test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from asyncat.client import GithubError
+from tornado import gen
+from tornado import testing
+
+from hindsight.index import PullRequestIndex
+
+from . import HindsightTestCase
+
+
+def make_pull(num, updated_at, merge_commit_sha=None, state="closed",
+              full_name="owner/name"):
+    """Returns a pull request in Github's format."""
+    return {
+        "number": num,
+        "state": state,
+        "updated_at": updated_at,
+        "head": {
+            "sha": "head{}".format(num),
+            "ref": "branch{}".format(num),
+            "repo": {"full_name": full_name},
+        },
+        "merge_commit_sha": merge_commit_sha,
+    }
+
+
+class PullRequestIndexTestCase(HindsightTestCase):
+    """Tests PullRequestIndex."""
+    def setUp(self):
+        super(PullRequestIndexTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "index.json")
+        self.mock_client = mock.Mock()
+        self.index = PullRequestIndex(self.mock_client, path=self.path,
+                                      max_pages=2)
+        self.index.per_page = 2
+
+    def tearDown(self):
+        super(PullRequestIndexTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def make_response(self, data, etag=None):
+        resp = mock.Mock(data=data, headers={})
+        if etag is not None:
+            resp.headers["Etag"] = etag
+        return self.make_future(resp)
+
+    @testing.gen_test
+    def test_refresh(self):
+        self.mock_client.request.side_effect = [
+            self.make_response([
+                make_pull(3, "2018-01-03", "merge3"),
+                make_pull(2, "2018-01-02"),
+            ], etag="etag"),
+            self.make_response([make_pull(1, "2018-01-01")]),
+        ]
+        count = yield self.index.refresh("owner", "name")
+
+        self.assertEqual(count, 3)
+        self.assertEqual(self.index.get("owner", "name", "merge3"), 3)
+        self.assertEqual(self.index.get("owner", "name", "head1"), 1)
+        self.assertIsNone(self.index.get("owner", "name", "unknown"))
+        self.assertIsNone(self.index.get("owner", "other", "head1"))
+        self.assertEqual(self.index.stats(), {"commits": 4})
+
+        # Stop at the first pull request seen.
+        self.mock_client.request.side_effect = [
+            self.make_response([
+                make_pull(4, "2018-01-04"),
+                make_pull(3, "2018-01-03", "merge3"),
+            ]),
+        ]
+        count = yield self.index.refresh("owner", "name")
+        self.assertEqual(count, 1)
+
+        headers = self.mock_client.request.call_args[1]["headers"]
+        self.assertEqual(headers, {"If-None-Match": "etag"})
+
+    @testing.gen_test
+    def test_stop_at_max_pages(self):
+        self.mock_client.request.side_effect = [
+            self.make_response([make_pull(1, "2018-01-01")], etag="etag1"),
+        ]
+        yield self.index.refresh("owner", "name")
+
+        # More updated than max_pages since last refresh.
+        self.mock_client.request.side_effect = [
+            self.make_response([
+                make_pull(7, "2018-01-07"),
+                make_pull(6, "2018-01-06"),
+            ], etag="etag2"),
+            self.make_response([
+                make_pull(5, "2018-01-05"),
+                make_pull(4, "2018-01-04"),
+            ]),
+        ]
+        count = yield self.index.refresh("owner", "name")
+        self.assertEqual(count, 4)
+
+        # The gap is walked again.
+        self.mock_client.request.side_effect = [
+            self.make_response([
+                make_pull(7, "2018-01-07"),
+                make_pull(3, "2018-01-03"),
+            ], etag="etag3"),
+            self.make_response([
+                make_pull(2, "2018-01-02"),
+                make_pull(1, "2018-01-01"),
+            ]),
+        ]
+        count = yield self.index.refresh("owner", "name")
+        self.assertEqual(count, 3)
+        self.assertEqual(self.index.get("owner", "name", "head2"), 2)
+        headers = self.mock_client.request.call_args_list[-2][1]["headers"]
+        self.assertEqual(headers, {"If-None-Match": "etag1"})
+        self.assertEqual(self.index._since[("owner", "name")], "2018-01-07")
+        self.assertEqual(self.index._etags[("owner", "name")], "etag3")
+
+    @testing.gen_test
+    def test_not_modified(self):
+        self.mock_client.request.return_value = self.make_future(
+            GithubError(mock.Mock(code=304, body=b"")))
+        count = yield self.index.refresh("owner", "name")
+        self.assertEqual(count, 0)
+
+    @testing.gen_test
+    def test_refresh_all_and_load(self):
+        self.mock_client.request.side_effect = [
+            self.make_response([make_pull(1, "2018-01-01")], etag="etag"),
+            self.make_future(GithubError(mock.Mock(code=500, body=b""))),
+        ]
+        yield self.index.refresh_all([("owner", "a"), ("owner", "b")])
+
+        index = PullRequestIndex(self.mock_client, path=self.path)
+        self.assertEqual(index.get("owner", "a", "head1"), 1)
+        self.assertEqual(index._etags, {("owner", "a"): "etag"})
+        self.assertEqual(index._since, {("owner", "a"): "2018-01-01"})
+
+    def test_start(self):
+        self.mock_client.request.return_value = self.make_response([])
+        self.index.start(lambda: [("owner", "a")], 60)
+        self.assertTrue(self.index._periodic.is_running())
+        self.index._periodic.stop()
+
+    def test_branch(self):
+        self.index.add_pull("owner", "name", make_pull(1, "", state="open"))
+        self.index.add_pull("owner", "name", make_pull(
+            2, "", state="open", full_name="fork/name"))
+        self.assertEqual(self.index.get_branch("owner", "name", "branch1"), 1)
+        self.assertIsNone(self.index.get_branch("owner", "name", "branch2"))
+
+        self.index.add_pull("owner", "name", make_pull(1, ""))
+        self.assertIsNone(self.index.get_branch("owner", "name", "branch1"))
+
+    @testing.gen_test
+    def test_save_later(self):
+        self.index.add("owner", "name", "sha", 1)
+        self.index.save_later(0.01)
+        self.index.save_later(0.01)
+        self.assertFalse(os.path.exists(self.path))
+
+        yield gen.sleep(0.03)
+        index = PullRequestIndex(self.mock_client, path=self.path)
+        self.assertEqual(index.get("owner", "name", "sha"), 1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""BuildJournal test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from tornado import gen
+from tornado import testing
+
+from hindsight.journal import BuildJournal, JournalError
+
+
+class BuildJournalTestCase(testing.AsyncTestCase):
+    """Tests BuildJournal."""
+    def setUp(self):
+        super(BuildJournalTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "journal.db")
+
+    def tearDown(self):
+        super(BuildJournalTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay_after_reopen(self):
+        journal = BuildJournal(self.path)
+        first = journal.append("owner", "a", {"event": "buildStarted"})
+        journal.append("owner", "b", {"event": "buildFinished"})
+        journal.ack(first)
+        journal.close()
+
+        journal = BuildJournal(self.path)
+        self.assertEqual(
+            list(journal.iter_pending()),
+            [(first + 1, "owner", "b", {"event": "buildFinished"})],
+        )
+        journal.close()
+
+    def test_commit_in_batch(self):
+        journal = BuildJournal(self.path, batch_size=3, flush_interval=10)
+        journal.append("owner", "a", {})
+        journal.append("owner", "a", {})
+        self.assertEqual(journal.stats(),
+                         {"pending_writes": 2, "commits": 0})
+
+        journal.append("owner", "a", {})
+        self.assertEqual(journal.stats(),
+                         {"pending_writes": 0, "commits": 1})
+        journal.close()
+
+    @testing.gen_test
+    def test_commit_after_interval(self):
+        journal = BuildJournal(self.path, batch_size=100,
+                               flush_interval=0.01)
+        journal.append("owner", "a", {})
+        self.assertEqual(journal.commits, 0)
+
+        yield gen.sleep(0.05)
+        self.assertEqual(journal.commits, 1)
+        journal.close()
+
+    def test_commit_every_write(self):
+        journal = BuildJournal(self.path, flush_interval=0)
+        journal.append("owner", "a", {})
+        journal.append("owner", "a", {})
+        self.assertEqual(journal.commits, 2)
+        journal.close()
+
+    def test_pending_of_worker(self):
+        journal = BuildJournal(self.path, flush_interval=0)
+        first = journal.append("owner", "a", {})
+        second = journal.append("owner", "b", {}, worker=1)
+        third = journal.append("owner", "c", {}, worker=1)
+
+        ids = [row[0] for row in journal.iter_pending(worker=0)]
+        self.assertEqual(ids, [first])
+        ids = [row[0] for row in journal.iter_pending(worker=1,
+                                                      after=second)]
+        self.assertEqual(ids, [third])
+        self.assertEqual(len(list(journal.iter_pending())), 3)
+        journal.close()
+
+    @testing.gen_test
+    def test_shared(self):
+        journal = BuildJournal(self.path, flush_interval=0.01, timeout=0.01,
+                               shared=True)
+        other = sqlite3.connect(self.path, timeout=0.01)
+        first = journal.append("owner", "a", {})
+        second = journal.append("owner", "b", {})
+        # Committed at once, another process can write.
+        other.execute("DELETE FROM builds WHERE id = 0")
+        other.commit()
+        self.assertEqual(journal.commits, 2)
+
+        journal.ack(first)
+        ids = [row[0] for row in journal.iter_pending()]
+        self.assertEqual(ids, [second])
+        yield gen.sleep(0.05)
+        self.assertEqual(journal.stats(), {"pending_writes": 0, "commits": 3})
+
+        # Locked by another process.
+        other.execute("BEGIN IMMEDIATE")
+        with self.assertRaises(JournalError):
+            journal.append("owner", "c", {})
+        journal.ack(second)
+        yield gen.sleep(0.05)
+        self.assertEqual(journal.stats()["pending_writes"], 1)
+
+        other.rollback()
+        other.close()
+        journal.flush()
+        self.assertEqual(list(journal.iter_pending()), [])
+        journal.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Metrics test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import pytest
+
+from asyncat.client import GithubError
+from tornado import httpclient
+from tornado import simple_httpclient
+
+from hindsight.metrics import (Gauge, PipelineMetrics, Registry,
+                               get_error_code, get_github_call)
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests.", ("repo",))
+    histogram = registry.histogram("latency_seconds", "Latency.",
+                                   buckets=(0.1, 1))
+
+    counter.inc('a"b')
+    counter.labels('a"b').inc(2)
+    histogram.labels().observe(0.1)
+    histogram.labels().observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{repo="a\\"b"} 3',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 5.1",
+        "latency_seconds_count 2",
+    ]
+
+
+def test_gauge():
+    registry = Registry()
+    gauge = registry.register(Gauge("inflight", "In flight.", ("state",)))
+    gauge.labels("active").value = 2
+    assert registry.render().splitlines()[1:] == [
+        "# TYPE inflight gauge",
+        'inflight{state="active"} 2',
+    ]
+
+
+def test_labels_mismatch():
+    counter = Registry().counter("requests_total", "Requests.", ("repo",))
+    with pytest.raises(ValueError):
+        counter.labels()
+
+
+@pytest.mark.parametrize("args,expected", [
+    (("/search/issues", {"q": "sha repo:o/n"}), ("o/n", "search")),
+    (("/graphql", None, "POST"), ("", "graphql")),
+    (("/repos/o/n/commits/sha",), ("o/n", "commit")),
+    (("/repos/o/n/pulls/1",), ("o/n", "pull")),
+    (("/repos/o/n/issues/1/comments", {}, "POST"),
+     ("o/n", "create_comment")),
+    (("/repos/o/n/issues/comments/2", {}, "PATCH"),
+     ("o/n", "edit_comment")),
+    (("/repos/o/n",), ("o/n", "repo")),
+    (("/user",), ("", "other")),
+])
+def test_get_github_call(args, expected):
+    assert get_github_call(*args) == expected
+
+
+def test_bound_children():
+    metrics = PipelineMetrics()
+    call = metrics.github_call(("o/n", "pull"))
+    assert metrics.github_call(("o/n", "pull")) is call
+    call.observe(0.1)
+    call.observe(0.2, 502)
+    call.observe(0.3, 502)
+    call.retried()
+    assert metrics.github_seconds.labels("o/n", "pull").sum == (
+        pytest.approx(0.6))
+    assert metrics.github_errors.labels("o/n", "pull", 502).value == 2
+    assert metrics.github_retries.labels("o/n", "pull").value == 1
+
+    repo = metrics.bind_repo("o", "n")
+    repo.observe_report("deploy", 1, "reported")
+    repo.observe_report("deploy", 2, "reported")
+    assert metrics.report_seconds.labels("o/n", "deploy").sum == 3
+    assert metrics.reports.labels("o/n", "deploy", "reported").value == 2
+
+
+def _raise_from(error):
+    """Returns GithubError raised from ``error`` as asyncat does."""
+    try:
+        raise error
+    except Exception:   # pylint: disable=W0703
+        try:
+            raise GithubError(getattr(error, "response", None))
+        except GithubError as e:
+            return e
+
+
+def test_get_error_code():
+    assert get_error_code(GithubError()) == "connection"
+    assert get_error_code(_raise_from(
+        simple_httpclient.HTTPTimeoutError("Timeout during request"))) == (
+            "timeout")
+    assert get_error_code(_raise_from(
+        httpclient.HTTPClientError(599, "Operation timed out"))) == "timeout"
+    assert get_error_code(_raise_from(
+        httpclient.HTTPClientError(599, "Connection refused"))) == (
+            "connection")
+    assert get_error_code(ConnectionResetError()) == "connection"
+    assert get_error_code(TimeoutError()) == "timeout"
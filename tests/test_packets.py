@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Packets parser test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+
+import pytest
+
+from hindsight.packets import iter_packets
+
+
+def test_iter_packets():
+    packets = [
+        {"event": "buildStarted", "id": 1},
+        {"event": "stepStarted", "id": 2},
+        {"event": "buildFinished", "id": 3},
+    ]
+    events = frozenset(["buildStarted", "buildFinished"])
+
+    assert [p["id"] for p in iter_packets(json.dumps(packets), events)] == [
+        1, 3]
+    assert [p["id"] for p in iter_packets(
+        json.dumps(packets, indent=2), events)] == [1, 3]
+    assert list(iter_packets(" [ ] ", events)) == []
+
+
+@pytest.mark.parametrize("text", [
+    "{}", "", "[1]", "[{\"event\": \"a\"}", "[{} {}]", "[{},]",
+])
+def test_invalid_packets(text):
+    with pytest.raises(ValueError):
+        list(iter_packets(text, frozenset(["a"])))
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Message parsers test cases."""
+from __future__ import print_function, division, unicode_literals
+
+from hindsight.parsers import (DEFAULT_PARSERS, make_parsers,
+                               parse_pull_number)
+
+
+def test_builtin_parsers():
+    parsers = make_parsers(DEFAULT_PARSERS)
+
+    assert parse_pull_number(
+        parsers, "Merge pull request #12 from owner/branch\n\nTitle") == 12
+    assert parse_pull_number(
+        parsers, "Auto merge of #34 - owner:branch, r=someone\n\nTitle") == 34
+    assert parse_pull_number(parsers, "Fix bug (#56)") is None
+    assert parse_pull_number(parsers, "Revert \"Merge pull request #1 from "
+                                      "owner/branch\"") is None
+
+
+def test_squash_and_pattern():
+    parsers = make_parsers(["squash", r"^Closes PR-(\d+)$"])
+
+    assert parse_pull_number(parsers, "Fix bug (#56)\n\n* commit") == 56
+    assert parse_pull_number(parsers, "Fix bug\n\nCloses PR-78") == 78
+    assert parse_pull_number(parsers, "Fix bug") is None
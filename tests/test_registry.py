@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Repository registry test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from hindsight import parsers
+from hindsight.registry import RepoRegistry, get_signature, load_config
+
+
+class RepoRegistryTestCase(unittest.TestCase):
+    """Tests loading RepoRegistry."""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = self._path("cfg.toml")
+        self.directory = self._path("repos.d")
+        self.sqlite = self._path("repos.db")
+
+        os.mkdir(self.directory)
+        self._write(self.config_file, (
+            '[repos]\n'
+            'directory = "{}"\n'
+            'sqlite = "{}"\n'
+            '[repo.demo]\n'
+            'owner = "asyncat"\nname = "demo"\nsecret = "s1"\n'
+        ).format(self.directory, self.sqlite))
+        self._write(os.path.join(self.directory, "a.toml"), (
+            '[repo.a]\n'
+            'owner = "owner"\nname = "a"\nsecret = "s2"\n'
+            'builder = "deploy"\nmerge_parsers = ["squash"]\n'
+        ))
+
+        conn = sqlite3.connect(self.sqlite)
+        conn.execute("CREATE TABLE repos (name TEXT PRIMARY KEY, "
+                     "config TEXT)")
+        conn.execute("INSERT INTO repos VALUES (?, ?)", ("b", json.dumps({
+            "owner": "owner", "name": "b", "secret": "s3",
+        })))
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, filename):
+        return os.path.join(self.tmpdir, filename)
+
+    def _write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_load(self):
+        _, registry = load_config(self.config_file)
+
+        self.assertEqual(list(registry), [
+            ("asyncat", "demo"), ("owner", "a"), ("owner", "b")])
+        self.assertEqual(registry.find("s2", "deploy")["name"], "a")
+        self.assertEqual(registry.find("s3")["name"], "b")
+        with self.assertRaises(KeyError):
+            registry.find("s2")
+        with self.assertRaises(KeyError):
+            registry.find("unknown")
+
+        self.assertEqual(registry.get_parsers("owner", "a"),
+                         parsers.make_parsers(["squash"]))
+        self.assertEqual(registry.get_parsers("owner", "b"),
+                         parsers.make_parsers(parsers.DEFAULT_PARSERS))
+        self.assertIsNone(registry.get_parsers("owner", "c"))
+
+    def test_signature(self):
+        config, _ = load_config(self.config_file)
+        signature = get_signature(self.config_file, config)
+        self.assertEqual(get_signature(self.config_file, config), signature)
+
+        self._write(os.path.join(self.directory, "c.toml"), "")
+        self.assertNotEqual(get_signature(self.config_file, config),
+                            signature)
+
+
+def test_same_repo_with_builders():
+    registry = RepoRegistry([
+        {"owner": "o", "name": "n", "secret": "s", "builder": "a"},
+        {"owner": "o", "name": "n", "secret": "s", "builder": "b"},
+    ])
+
+    assert len(registry) == 1
+    assert registry.find("s", "b")["builder"] == "b"
+    assert registry.get_config("o", "n")["builder"] == "a"
+    assert registry.get_config("o", "other") is None
+
+
+def test_unknown_reporter():
+    try:
+        RepoRegistry([{"owner": "o", "name": "n", "secret": "s",
+                       "reporters": ["status", "email"]}])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError not raised")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Reporter test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import mock
+
+from tornado import testing
+
+from hindsight.deployment import BuildStatus
+from hindsight.reporter import (CommentReporter, CommitStatusReporter,
+                                DeploymentStatusReporter, make_reporters)
+from hindsight.state import MemoryBackend
+
+from . import HindsightTestCase
+
+
+def test_make_reporters():
+    reporters = make_reporters(None)
+    assert [type(r) for r in reporters] == [CommentReporter]
+
+    board = mock.Mock()
+    reporters = make_reporters({"reporters": ["comment", "status"]}, board)
+    assert [r.name for r in reporters] == ["status", "comment"]
+    assert reporters[1].status_board is board
+
+
+class ReporterTestCase(HindsightTestCase):
+    """Tests reporters."""
+    def setUp(self):
+        super(ReporterTestCase, self).setUp()
+        self.repo = mock.Mock(base_path="/repos/o/n", owner="o", label="n")
+        self.repo.client.request.return_value = self.make_future(
+            mock.Mock(data={"id": 7}))
+        self.build = mock.Mock(**{
+            "get_name.return_value": "rundeploy",
+            "get_sha.return_value": "sha",
+            "get_number.return_value": 1,
+            "get_status.return_value": BuildStatus.pending,
+        })
+
+    @testing.gen_test
+    def test_comment(self):
+        pull = mock.Mock()
+        pull.create_comment.return_value = self.make_future(None)
+        yield CommentReporter({}).report(self.repo, self.build, pull)
+        pull.create_comment.assert_called_once_with(
+            "Deployment status BuildStatus.pending")
+
+    @testing.gen_test
+    def test_commit_status(self):
+        self.repo.create_status.return_value = self.make_future(None)
+        reporter = CommitStatusReporter({"status_context": "ci/{builder}"})
+        yield reporter.report(self.repo, self.build)
+        self.repo.create_status.assert_called_once_with(
+            "sha", "pending", context="ci/rundeploy",
+            description="Deployment pending")
+
+        reporter.config["status_target_url"] = "https://ci/{builder}/{number}"
+        yield reporter.report(self.repo, self.build)
+        self.assertEqual(self.repo.create_status.call_args[1]["target_url"],
+                         "https://ci/rundeploy/1")
+
+    @testing.gen_test
+    def test_deployment_status(self):
+        reporter = DeploymentStatusReporter({})
+        yield reporter.report(self.repo, self.build)
+        self.build.get_status.return_value = BuildStatus.success
+        yield reporter.report(self.repo, self.build)
+
+        paths = [c[0][0] for c in self.repo.client.request.call_args_list]
+        self.assertEqual(paths, [
+            "/repos/o/n/deployments",
+            "/repos/o/n/deployments/7/statuses",
+            "/repos/o/n/deployments/7/statuses",
+        ])
+        calls = self.repo.client.request.call_args_list
+        self.assertEqual(calls[0][1]["params"]["environment"], "rundeploy")
+        self.assertEqual(calls[1][1]["params"], {"state": "in_progress"})
+        self.assertEqual(calls[2][1]["params"], {"state": "success"})
+
+    @testing.gen_test
+    def test_shared_deployment(self):
+        state = MemoryBackend()
+        yield DeploymentStatusReporter({}, state).report(self.repo,
+                                                         self.build)
+
+        # Another process, or reporter after reload, sets the same one.
+        self.build.get_status.return_value = BuildStatus.success
+        yield DeploymentStatusReporter({}, state).report(self.repo,
+                                                         self.build)
+        paths = [c[0][0] for c in self.repo.client.request.call_args_list]
+        self.assertEqual(paths, [
+            "/repos/o/n/deployments",
+            "/repos/o/n/deployments/7/statuses",
+            "/repos/o/n/deployments/7/statuses",
+        ])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Resilience test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import mock
+
+from asyncat.client import GithubError
+
+from hindsight.resilience import (Backoff, CircuitBreaker, CircuitBreakers,
+                                  CircuitOpen, is_idempotent, is_transient)
+
+from . import FakeTimer
+
+
+def make_error(code):
+    return GithubError(mock.Mock(code=code, body=b"error"))
+
+
+def test_is_transient():
+    assert is_transient(make_error(502))
+    assert is_transient(GithubError())
+    assert is_transient(IOError("Connection reset"))
+    assert not is_transient(make_error(404))
+    assert not is_transient(CircuitOpen(("o/n", "pull"), 10))
+    assert not is_transient(ValueError())
+
+
+def test_is_idempotent():
+    assert is_idempotent("/repos/o/n/pulls/1", "GET")
+    assert is_idempotent("/repos/o/n/issues/comments/1", "PATCH")
+    assert is_idempotent("/graphql", "POST")
+    assert not is_idempotent("/repos/o/n/issues/1/comments", "POST")
+
+
+def test_backoff():
+    backoff = Backoff(retries=3, base=1, cap=3)
+    for _ in range(20):
+        assert 0 <= backoff.delay(0) <= 1
+        assert 0 <= backoff.delay(5) <= 3
+
+
+def test_circuit_open_message():
+    error = CircuitOpen(("o/n", "pull"), 12.3)
+    assert error.key == ("o/n", "pull")
+    assert str(error) == "Circuit of o/n/pull is open, retry after 12s"
+
+
+def test_circuit_breaker():
+    timer = FakeTimer()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                             timer=timer)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    timer.now += 4
+    assert breaker.retry_after() == 6
+
+    # Only one probe is let through.
+    timer.now += 6
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # Opens again at once if the probe fails.
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 10
+
+    timer.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_circuit_breakers():
+    breakers = CircuitBreakers(failure_threshold=1, timer=FakeTimer())
+    breaker = breakers.get(("o/n", "pull"))
+    assert breakers.get(("o/n", "pull")) is breaker
+    breaker.record_failure()
+    breakers.get(("o/n", "commit"))
+
+    assert breakers.stats() == {"open": ["o/n/pull"], "rejected": 0}
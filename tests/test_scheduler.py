@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""GithubScheduler test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import mock
+
+from asyncat.client import GithubError
+from tornado import concurrent
+from tornado import gen
+from tornado import httpclient
+from tornado import testing
+
+from hindsight.httpcache import ResponseCache
+from hindsight.metrics import PipelineMetrics
+from hindsight.resilience import Backoff, CircuitBreakers, CircuitOpen
+from hindsight.scheduler import (PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL,
+                                 GithubScheduler, get_resource,
+                                 get_retry_after, is_rate_limited)
+from hindsight.state import MemoryBackend
+
+from . import HindsightTestCase
+
+
+def make_error(code, body):
+    """Returns GithubError of response."""
+    return GithubError(mock.Mock(code=code, body=body))
+
+
+def make_limited(**headers):
+    """Returns GithubError of a rate limited response with ``headers``,
+    raised from HTTPError as asyncat does.
+    """
+    response = mock.Mock(code=403, body=b"secondary rate limit",
+                         headers=headers)
+    try:
+        raise httpclient.HTTPClientError(403, response=response)
+    except httpclient.HTTPClientError:
+        try:
+            raise GithubError(response)
+        except GithubError as e:
+            return e
+
+
+def test_get_retry_after():
+    assert get_retry_after(make_limited(**{"Retry-After": "60"})) == 60
+    assert get_retry_after(make_limited()) is None
+    assert get_retry_after(make_error(403, b"rate limit")) is None
+
+
+def test_get_resource():
+    assert get_resource("/search/issues") == "search"
+    assert get_resource("/graphql") == "graphql"
+    assert get_resource("/repos/owner/name/pulls/1") == "core"
+
+
+def test_is_rate_limited():
+    assert is_rate_limited(make_error(403, b"API rate limit exceeded"))
+    assert not is_rate_limited(make_error(403, b"Forbidden"))
+    assert not is_rate_limited(make_error(404, b"rate limit"))
+
+
+def test_no_tokens():
+    try:
+        GithubScheduler([])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError not raised")
+
+
+def test_host():
+    scheduler = GithubScheduler(["a"], host="http://127.0.0.1:9000/")
+    assert scheduler.clients[0].get_url("/user") == (
+        "http://127.0.0.1:9000/user")
+
+
+def test_transport():
+    transport = mock.Mock()
+    scheduler = GithubScheduler(["a", "b"], transport=transport)
+    assert all(client._httpclient is transport
+               for client in scheduler.clients)
+    assert scheduler.stats()["transport"] is transport.stats.return_value
+
+
+class GithubSchedulerTestCase(HindsightTestCase):
+    """Tests GithubScheduler."""
+    def setUp(self):
+        super(GithubSchedulerTestCase, self).setUp()
+        self.now = 1000
+        self.scheduler = GithubScheduler(["a", "b"], timer=lambda: self.now)
+        self.scheduler.clients = [mock.Mock(), mock.Mock()]
+
+    def make_response(self, remaining, reset=2000):
+        return self.make_future(mock.Mock(headers={
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(reset),
+        }))
+
+    @testing.gen_test
+    def test_route_to_most_remaining(self):
+        client_a, client_b = self.scheduler.clients
+        client_a.request.return_value = self.make_response(5)
+        client_b.request.return_value = self.make_response(10)
+
+        yield self.scheduler.request("/repos/o/n")
+        yield self.scheduler.request("/repos/o/n")
+        self.assertEqual(client_a.request.call_count, 1)
+        self.assertEqual(client_b.request.call_count, 1)
+
+        yield self.scheduler.request("/repos/o/n")
+        self.assertEqual(client_b.request.call_count, 2)
+
+        # Search is limited separately.
+        yield self.scheduler.prioritized(PRIORITY_LOW).request(
+            "/search/issues", {"q": "sha"})
+        self.assertEqual(client_a.request.call_count, 2)
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["tokens"][1]["core"]["remaining"], 10)
+        self.assertEqual(stats["waiting"], 0)
+
+    @testing.gen_test
+    def test_sync_quotas(self):
+        client_a, client_b = self.scheduler.clients
+        client_a.request.return_value = self.make_response(0)
+        client_b.request.return_value = self.make_response(10)
+        yield self.scheduler.request("/repos/o/n")
+        yield self.scheduler.request("/repos/o/n")
+
+        # Another process uses the same tokens.
+        other = GithubScheduler(["a", "b"], timer=lambda: self.now)
+        other.clients = [mock.Mock(), mock.Mock()]
+        other.clients[1].request.return_value = self.make_response(8)
+
+        state = MemoryBackend()
+        yield self.scheduler.sync_quotas(state)
+        yield other.sync_quotas(state)
+        # Exhausted token of another process is not picked.
+        yield other.request("/repos/o/n")
+        self.assertFalse(other.clients[0].request.called)
+
+        yield other.sync_quotas(state)
+        yield self.scheduler.sync_quotas(state)
+        for scheduler in (self.scheduler, other):
+            tokens = scheduler.stats()["tokens"]
+            self.assertEqual(tokens[0]["core"]["remaining"], 0)
+            self.assertEqual(tokens[1]["core"]["remaining"], 8)
+
+    @testing.gen_test
+    def test_retry_other_token_when_limited(self):
+        client_a, client_b = self.scheduler.clients
+        client_a.request.return_value = self.make_future(
+            make_error(403, b"API rate limit exceeded"))
+        client_b.request.return_value = self.make_response(10)
+
+        yield self.scheduler.request("/repos/o/n")
+        self.assertEqual(client_a.request.call_count, 1)
+        self.assertEqual(client_b.request.call_count, 1)
+
+        client_b.request.return_value = self.make_future(
+            make_error(404, b"Not Found"))
+        with self.assertRaises(GithubError):
+            yield self.scheduler.request("/repos/o/n")
+
+    @testing.gen_test
+    def test_secondary_rate_limit(self):
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_response(4000, reset=4600)
+        yield self.scheduler.request("/repos/o/n")
+
+        client.request.side_effect = [
+            self.make_future(make_limited(**{"Retry-After": "60"})),
+            self.make_response(3998, reset=4600),
+        ]
+        future = gen.convert_yielded(self.scheduler.request("/repos/o/n"))
+        yield gen.moment
+        self.assertEqual(self.scheduler.stats()["waiting"], 1)
+        # The primary window is kept, wait for Retry-After only.
+        quota = self.scheduler.stats()["tokens"][0]["core"]
+        self.assertEqual(quota, {"remaining": 4000, "reset": 4600})
+        timeout = self.scheduler._wakeup_timeout
+        self.assertAlmostEqual(
+            timeout.when() - self.io_loop.asyncio_loop.time(), 61, delta=1)
+
+        self.now += 60
+        self.io_loop.remove_timeout(timeout)
+        self.scheduler._wakeup()
+        yield future
+        self.assertEqual(client.request.call_count, 3)
+
+        # Primary limit waits until reset.
+        client.request.side_effect = [
+            self.make_future(make_limited(**{
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": "4600",
+            })),
+        ]
+        future = gen.convert_yielded(self.scheduler.request("/repos/o/n"))
+        yield gen.moment
+        quota = self.scheduler.stats()["tokens"][0]["core"]
+        self.assertEqual(quota, {"remaining": 0, "reset": 4600})
+        self.io_loop.remove_timeout(self.scheduler._wakeup_timeout)
+        future.cancel()
+
+    @testing.gen_test
+    def test_metrics(self):
+        self.scheduler.metrics = PipelineMetrics()
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_response(10)
+        yield self.scheduler.request("/repos/o/n/commits/sha")
+
+        client.request.return_value = self.make_future(
+            make_error(404, b"Not Found"))
+        with self.assertRaises(GithubError):
+            yield self.scheduler.request("/repos/o/n/pulls/1")
+
+        # Failed without response.
+        client.request.return_value = self.make_future(GithubError())
+        with self.assertRaises(GithubError):
+            yield self.scheduler.request("/repos/o/n/pulls/1")
+        client.request.return_value = self.make_future(
+            ConnectionRefusedError())
+        with self.assertRaises(OSError):
+            yield self.scheduler.request("/repos/o/n/pulls/1")
+
+        metrics = self.scheduler.metrics
+        self.assertEqual(
+            sum(metrics.github_seconds.labels("o/n", "commit").counts), 1)
+        self.assertEqual(
+            metrics.github_errors.labels("o/n", "pull", 404).value, 1)
+        self.assertEqual(
+            metrics.github_errors.labels("o/n", "pull", "connection").value,
+            2)
+
+    @testing.gen_test
+    def test_wait_in_priority_order(self):
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_response(0, reset=1001)
+        yield self.scheduler.request("/repos/o/n")
+
+        order = []
+
+        @gen.coroutine
+        def _request(priority):
+            yield self.scheduler.request("/repos/o/n", priority=priority)
+            order.append(priority)
+
+        client.request.return_value = self.make_response(10)
+        futures = [_request(PRIORITY_LOW), _request(PRIORITY_HIGH)]
+        yield gen.moment
+        self.assertEqual(self.scheduler.stats()["waiting"], 2)
+
+        # Wake up at once instead of waiting reset.
+        self.now = 1002
+        self.io_loop.remove_timeout(self.scheduler._wakeup_timeout)
+        self.scheduler._wakeup()
+
+        yield futures
+        self.assertEqual(order, [PRIORITY_HIGH, PRIORITY_LOW])
+
+    @testing.gen_test
+    def test_wake_up_up_to_limit(self):
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_future(mock.Mock(headers={
+            "X-RateLimit-Limit": "2",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": "1001",
+        }))
+        yield self.scheduler.request("/search/issues")
+
+        order = []
+
+        @gen.coroutine
+        def _request(priority):
+            yield self.scheduler.request("/search/issues", priority=priority)
+            order.append(priority)
+
+        client.request.return_value = concurrent.Future()
+        futures = [_request(priority) for priority in (
+            PRIORITY_LOW, PRIORITY_HIGH, PRIORITY_NORMAL)]
+        yield gen.moment
+
+        # The limit of the last window is assumed after reset.
+        self.now = 1002
+        self.io_loop.remove_timeout(self.scheduler._wakeup_timeout)
+        self.scheduler._wakeup()
+        yield gen.moment
+        yield gen.moment
+        self.assertEqual(client.request.call_count, 3)
+        self.assertEqual(self.scheduler.stats()["waiting"], 1)
+
+        client.request.return_value.set_result(mock.Mock(headers={
+            "X-RateLimit-Remaining": "5",
+            "X-RateLimit-Reset": "1060",
+        }))
+        yield gen.moment
+        self.io_loop.remove_timeout(self.scheduler._wakeup_timeout)
+        self.scheduler._wakeup()
+        yield futures
+        self.assertEqual(order,
+                         [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW])
+
+    @testing.gen_test
+    def test_wake_up_on_earliest_reset(self):
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_response(0, reset=4600)
+        yield self.scheduler.request("/repos/o/n")
+        client.request.return_value = self.make_response(0, reset=1060)
+        yield self.scheduler.request("/search/issues")
+
+        client.request.return_value = self.make_response(10)
+        core = gen.convert_yielded(self.scheduler.request("/repos/o/n"))
+        yield gen.moment
+        loop = self.io_loop.asyncio_loop
+        self.assertAlmostEqual(
+            self.scheduler._wakeup_timeout.when() - loop.time(), 3601,
+            delta=1)
+
+        # Search resets sooner.
+        search = gen.convert_yielded(self.scheduler.request("/search/issues"))
+        yield gen.moment
+        self.assertAlmostEqual(
+            self.scheduler._wakeup_timeout.when() - loop.time(), 61,
+            delta=1)
+
+        self.now = 1061
+        self.io_loop.remove_timeout(self.scheduler._wakeup_timeout)
+        self.scheduler._wakeup()
+        yield search
+        # Core waits again.
+        self.assertFalse(core.done())
+        self.assertAlmostEqual(
+            self.scheduler._wakeup_timeout.when() - loop.time(), 3540,
+            delta=1)
+        self.io_loop.remove_timeout(self.scheduler._wakeup_timeout)
+        core.cancel()
+
+    @testing.gen_test
+    def test_retry_transient_errors(self):
+        self.scheduler.metrics = PipelineMetrics()
+        self.scheduler.backoff = Backoff(retries=2, base=0)
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.side_effect = [
+            self.make_future(make_error(502, b"Bad Gateway")),
+            self.make_response(10),
+        ]
+        yield self.scheduler.request("/repos/o/n/pulls/1")
+        self.assertEqual(client.request.call_count, 2)
+        self.assertEqual(
+            self.scheduler.metrics.github_retries.labels("o/n", "pull").value,
+            1)
+
+        # Gives up after retries.
+        client.request.side_effect = None
+        client.request.return_value = self.make_future(
+            make_error(502, b"Bad Gateway"))
+        with self.assertRaises(GithubError):
+            yield self.scheduler.request("/repos/o/n/pulls/1")
+        self.assertEqual(client.request.call_count, 5)
+
+        # Creating a comment is not retried, it may have been created.
+        with self.assertRaises(GithubError):
+            yield self.scheduler.request("/repos/o/n/issues/1/comments",
+                                         method="POST")
+        self.assertEqual(client.request.call_count, 6)
+
+    @testing.gen_test
+    def test_circuit_breaker(self):
+        breakers = CircuitBreakers(failure_threshold=2, reset_timeout=30,
+                                   timer=lambda: self.now)
+        self.scheduler.breakers = breakers
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_future(
+            make_error(502, b"Bad Gateway"))
+        for _ in range(2):
+            with self.assertRaises(GithubError):
+                yield self.scheduler.request("/repos/o/n/pulls/1")
+
+        with self.assertRaises(CircuitOpen) as context:
+            yield self.scheduler.request("/repos/o/n/pulls/1")
+        self.assertEqual(context.exception.retry_after, 30)
+        self.assertEqual(client.request.call_count, 2)
+        self.assertEqual(self.scheduler.stats()["circuits"],
+                         {"open": ["o/n/pull"], "rejected": 1})
+
+        # Other calls are not affected, and client errors don't count.
+        client.request.return_value = self.make_future(
+            make_error(404, b"Not Found"))
+        for _ in range(3):
+            with self.assertRaises(GithubError):
+                yield self.scheduler.request("/repos/o/n/commits/sha")
+
+        # A cancelled probe lets another one through.
+        self.now += 30
+        client.request.return_value = concurrent.Future()
+        probe = gen.convert_yielded(
+            self.scheduler.request("/repos/o/n/pulls/1"))
+        yield gen.moment
+        probe.cancel()
+        yield gen.moment
+        self.assertTrue(probe.cancelled())
+
+        # So does a probe failed with an unexpected error.
+        client.request.return_value = self.make_future(ValueError("Bad"))
+        with self.assertRaises(ValueError):
+            yield self.scheduler.request("/repos/o/n/pulls/1")
+
+        # Closes after a successful probe.
+        client.request.return_value = self.make_response(10)
+        yield self.scheduler.request("/repos/o/n/pulls/1")
+        yield self.scheduler.request("/repos/o/n/pulls/1")
+        self.assertEqual(self.scheduler.stats()["circuits"]["open"], [])
+
+    @testing.gen_test
+    def test_response_cache(self):
+        self.scheduler.response_cache = ResponseCache()
+        self.scheduler.clients = self.scheduler.clients[:1]
+        client = self.scheduler.clients[0]
+        client.request.return_value = self.make_future(mock.Mock(
+            body=b'{"number": 1}', headers={"ETag": '"x"'}))
+        yield self.scheduler.request("/repos/o/n/pulls/1")
+
+        client.request.return_value = self.make_future(
+            make_error(304, b""))
+        resp = yield self.scheduler.request("/repos/o/n/pulls/1")
+        self.assertEqual(resp.data, {"number": 1})
+        self.assertEqual(client.request.call_args[1]["headers"],
+                         {"If-None-Match": '"x"'})
+
+        self.assertEqual(self.scheduler.stats()["response_cache"], {
+            "size": 1, "revalidated": 1, "misses": 1})
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""State backends test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+
+from tornado import gen
+from tornado import iostream
+from tornado import tcpserver
+from tornado import testing
+
+from hindsight.state import (MemoryBackend, RedisBackend, SQLiteBackend,
+                             StateDedupSet, StateError, encode_command,
+                             get_owner, make_backend)
+
+from . import FakeTimer
+
+
+class FakeRedisServer(tcpserver.TCPServer):
+    """Stand-in server speaks Redis protocol, supports commands sent by
+    :class:`RedisBackend`.
+    """
+    def __init__(self):
+        super(FakeRedisServer, self).__init__()
+        # key -> (value, expires)
+        self.values = {}
+        self.commands = []
+        self.streams = []
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        self.streams.append(stream)
+        try:
+            while True:
+                line = yield stream.read_until(b"\r\n")
+                args = []
+                for _ in range(int(line[1:-2])):
+                    line = yield stream.read_until(b"\r\n")
+                    data = yield stream.read_bytes(int(line[1:-2]) + 2)
+                    args.append(data[:-2].decode("utf8"))
+                self.commands.append(args)
+                yield stream.write(self.execute(args))
+        except iostream.StreamClosedError:
+            pass
+
+    def execute(self, args):
+        name = args[0].upper()
+        now = time.time()
+        if name in ("AUTH", "SELECT"):
+            return b"+OK\r\n"
+        if name == "GET":
+            value, expires = self.values.get(args[1], (None, 0))
+            if value is None or expires <= now:
+                return b"$-1\r\n"
+            return encode_command(value)[4:]
+        if name == "SET":
+            key, value = args[1], args[2]
+            options = [arg.upper() for arg in args[3:]]
+            expires = float("inf")
+            if "PX" in options:
+                expires = now + int(options[options.index("PX") + 1]) / 1000
+            if "NX" in options and self.values.get(key, (None, 0))[1] > now:
+                return b"$-1\r\n"
+            self.values[key] = (value, expires)
+            return b"+OK\r\n"
+        if name == "DEL":
+            return ":{}\r\n".format(
+                int(self.values.pop(args[1], None) is not None),
+            ).encode("ascii")
+        return "-ERR unknown command '{}'\r\n".format(name).encode("utf8")
+
+
+def test_get_owner():
+    owners = {get_owner("o", str(i), 4) for i in range(100)}
+    assert owners == {0, 1, 2, 3}
+    assert get_owner("o", "n", 4) == get_owner("o", "n", 4)
+    assert get_owner("o", "n", 1) == 0
+
+
+def test_make_backend():
+    assert isinstance(make_backend({}), MemoryBackend)
+    backend = make_backend({"backend": "redis", "port": 6380})
+    assert (backend.port, backend.prefix) == (6380, "hindsight:")
+    try:
+        make_backend({"backend": "etcd"})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError not raised")
+
+
+class BackendTestsMixin(object):
+    """Tests of all backends, :meth:`make_backends` returns two backends
+    see the same state.
+    """
+    def setUp(self):
+        super(BackendTestsMixin, self).setUp()
+        self.backend, self.other = self.make_backends()
+
+    def tearDown(self):
+        self.backend.close()
+        self.other.close()
+        super(BackendTestsMixin, self).tearDown()
+
+    @testing.gen_test
+    def test_lookup(self):
+        key = ("o", "n", "sha")
+        result = yield self.backend.begin_lookup(key, 60)
+        self.assertEqual(result, (False, None, True))
+        # Being looked up.
+        result = yield self.other.begin_lookup(key, 60)
+        self.assertEqual(result, (False, None, False))
+
+        yield self.backend.finish_lookup(key, 12, 60)
+        yield self.backend.finish_lookup(("o", "n", "other"), None, 60)
+        result = yield self.other.begin_lookup(key, 60)
+        self.assertEqual(result, (True, 12, False))
+        result = yield self.other.get_pull(("o", "n", "other"))
+        self.assertEqual(result, (True, None))
+        result = yield self.other.get_pull(("o", "n", "unknown"))
+        self.assertEqual(result, (False, None))
+
+        # Lock is released.
+        result = yield self.other.begin_lookup(("o", "n", "other"), 60)
+        self.assertEqual(result, (True, None, False))
+
+    @testing.gen_test
+    def test_dedup(self):
+        dedup = StateDedupSet(self.backend, window=600, inflight_ttl=60)
+        other = StateDedupSet(self.other, window=600, inflight_ttl=60)
+
+        results = yield dedup.begin_all([b"a", b"b"])
+        self.assertEqual(results, [True, True])
+        # Being reported by another process.
+        results = yield other.begin_all([b"a", b"c"])
+        self.assertEqual(results, [False, True])
+
+        yield dedup.finish_all([b"a"], reported=False)
+        yield dedup.finish_all([b"b"])
+        results = yield other.begin_all([b"a", b"b"])
+        self.assertEqual(results, [True, False])
+        has_key = yield self.other.has_key(b"b")
+        self.assertTrue(has_key)
+
+        self.assertEqual(dedup.stats(),
+                         {"checked": 2, "suppressed": 0, "inflight": 0})
+        self.assertEqual(other.stats(),
+                         {"checked": 4, "suppressed": 2, "inflight": 2})
+
+    @testing.gen_test
+    def test_comment_ids(self):
+        key = ("o", "n", 12)
+        comment_id = yield self.other.get_comment_id(key)
+        self.assertIsNone(comment_id)
+        yield self.backend.set_comment_id(key, 34, 60)
+        comment_id = yield self.other.get_comment_id(key)
+        self.assertEqual(comment_id, 34)
+
+    @testing.gen_test
+    def test_comment_lock(self):
+        key = ("o", "n", 12)
+        result = yield self.backend.begin_comment(key, 60)
+        self.assertEqual(result, (True, None, []))
+        result = yield self.other.begin_comment(key, 60)
+        self.assertFalse(result[0])
+
+        yield self.backend.finish_comment(key, 34, [("a", "pending")], 60)
+        result = yield self.other.begin_comment(key, 60)
+        self.assertEqual(result, (True, 34, [("a", "pending")]))
+        yield self.other.release_comment(key)
+        result = yield self.backend.begin_comment(key, 60)
+        self.assertTrue(result[0])
+
+    @testing.gen_test
+    def test_quotas(self):
+        reset = int(time.time()) + 3600
+        published = yield self.backend.exchange_quotas(
+            {"t:core": (10, reset)}, ["t:core", "t:search"])
+        self.assertEqual(published, {})
+        published = yield self.other.exchange_quotas(
+            {"t:search": (3, reset)}, ["t:core", "t:search"])
+        self.assertEqual(published, {"t:core": (10, reset)})
+
+    @testing.gen_test
+    def test_one_batch(self):
+        yield self.backend.begin_lookup(("o", "n", "sha"), 60)
+        yield self.backend.add_keys([b"a", b"b", b"c"], 60)
+        self.assertEqual(self.backend.stats()["batches"], 2)
+        self.assertEqual(self.backend.stats()["operations"], 5)
+
+
+class MemoryBackendTestCase(BackendTestsMixin, testing.AsyncTestCase):
+    """Tests MemoryBackend."""
+    def make_backends(self):
+        backend = MemoryBackend()
+        # Processes of the same backend.
+        return backend, backend
+
+    def tearDown(self):
+        super(MemoryBackendTestCase, self).tearDown()
+        self.assertEqual(self.backend.stats()["backend"], "memory")
+
+
+class SQLiteBackendTestCase(BackendTestsMixin, testing.AsyncTestCase):
+    """Tests SQLiteBackend opened by two processes."""
+    def make_backends(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, "state.db")
+        self.timer = FakeTimer()
+        return (SQLiteBackend(path, timer=self.timer),
+                SQLiteBackend(path, timer=self.timer))
+
+    def tearDown(self):
+        super(SQLiteBackendTestCase, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    @testing.gen_test
+    def test_expires(self):
+        key = ("o", "n", "sha")
+        yield self.backend.finish_lookup(key, 12, ttl=10)
+        self.timer.now += 10
+        result = yield self.other.get_pull(key)
+        self.assertEqual(result, (False, None))
+
+        # A key left by a crashed process expires.
+        dedup = StateDedupSet(self.backend, inflight_ttl=60)
+        results = yield dedup.begin_all([b"a"])
+        self.assertEqual(results, [True])
+        self.timer.now += 60
+        results = yield StateDedupSet(self.other).begin_all([b"a"])
+        self.assertEqual(results, [True])
+
+        self.backend.purge()
+        results = yield dedup.begin_all([b"b"])
+        self.assertEqual(results, [True])
+
+    @testing.gen_test
+    def test_locked(self):
+        # pylint: disable=W0212
+        self.other._conn.execute("BEGIN IMMEDIATE")
+        try:
+            with self.assertRaises(StateError):
+                yield self.backend.begin_lookup(("o", "n", "sha"), 60)
+            results = yield StateDedupSet(self.backend).begin_all([b"a"])
+            self.assertEqual(results, [True])
+        finally:
+            self.other._conn.execute("ROLLBACK")
+
+        result = yield self.backend.begin_lookup(("o", "n", "sha"), 60)
+        self.assertEqual(result, (False, None, True))
+
+
+class RedisBackendTestCase(BackendTestsMixin, testing.AsyncTestCase):
+    """Tests RedisBackend with a stand-in server."""
+    def make_backends(self):
+        self.server = FakeRedisServer()
+        sock, self.port = testing.bind_unused_port()
+        self.server.add_sockets([sock])
+        return (RedisBackend(port=self.port, prefix="h:"),
+                RedisBackend(port=self.port, prefix="h:", db=2,
+                             password="secret"))
+
+    def tearDown(self):
+        self.server.stop()
+        super(RedisBackendTestCase, self).tearDown()
+
+    @testing.gen_test
+    def test_commands(self):
+        yield [self.backend.add_keys([b"\x01"], 1.5),
+               self.backend.get_pull(("o", "n", "sha"))]
+        yield self.other.get_comment_id(("o", "n", 1))
+        self.assertEqual(self.server.commands, [
+            ["SET", "h:dedup:01", "1", "PX", "1500", "NX"],
+            ["GET", "h:pull:o/n/sha"],
+            ["AUTH", "secret"],
+            ["SELECT", "2"],
+            ["GET", "h:comment:o/n/1"],
+        ])
+        # Concurrent batches share a connection.
+        self.assertEqual(len(self.server.streams), 2)
+
+    @testing.gen_test
+    def test_error_reply(self):
+        stream = yield self.backend._connect()  # pylint: disable=W0212
+        with self.assertRaises(StateError):
+            yield self.backend._send(  # pylint: disable=W0212
+                stream, [("INCR", "a")])
+        # The connection is still usable.
+        result = yield self.backend.get_pull(("o", "n", "sha"))
+        self.assertEqual(result, (False, None))
+
+    @testing.gen_test
+    def test_reconnect(self):
+        yield self.backend.get_pull(("o", "n", "sha"))
+        self.server.streams[0].close()
+        yield gen.sleep(0.01)
+
+        yield self.backend.finish_lookup(("o", "n", "sha"), 12, 60)
+        result = yield self.backend.get_pull(("o", "n", "sha"))
+        self.assertEqual(result, (True, 12))
+        self.assertEqual(len(self.server.streams), 2)
+
+    @testing.gen_test
+    def test_no_reply(self):
+        self.server.execute = lambda args: b""
+        backend = RedisBackend(port=self.port, timeout=0.05)
+        with self.assertRaises(StateError):
+            yield backend.get_pull(("o", "n", "sha"))
+
+        # Reconnect after the timeout.
+        del self.server.execute
+        result = yield backend.get_pull(("o", "n", "sha"))
+        self.assertEqual(result, (False, None))
+        self.assertEqual(len(self.server.streams), 2)
+        backend.close()
+        yield gen.sleep(0.01)
+
+    @testing.gen_test
+    def test_write_closed(self):
+        stream = yield self.backend._connect()  # pylint: disable=W0212
+        stream.close()
+        with self.assertRaises(StateError):
+            yield self.backend._send(  # pylint: disable=W0212
+                stream, [("GET", "a")])
+        yield gen.sleep(0.01)
+
+    @testing.gen_test
+    def test_setup_failed(self):
+        execute = self.server.execute
+        self.server.execute = lambda args: (
+            b"-ERR invalid DB index\r\n" if args[0] == "SELECT"
+            else execute(args))
+        with self.assertRaises(StateError):
+            yield self.other.finish_lookup(("o", "n", "sha"), 12, 60)
+        self.assertEqual([command[0] for command in self.server.commands],
+                         ["AUTH", "SELECT"])
+
+        # Setup is done again on a new connection.
+        del self.server.execute
+        yield self.other.finish_lookup(("o", "n", "sha"), 12, 60)
+        self.assertEqual(len(self.server.streams), 2)
+        self.assertEqual(self.server.commands[2:4],
+                         [["AUTH", "secret"], ["SELECT", "2"]])
+        yield gen.sleep(0.01)
+
+    @testing.gen_test
+    def test_connect_failed(self):
+        sock, port = testing.bind_unused_port()
+        sock.close()
+        backend = RedisBackend(port=port, timeout=1)
+        with self.assertRaises(StateError):
+            yield backend.get_pull(("o", "n", "sha"))
+
+        dedup = StateDedupSet(backend)
+        results = yield dedup.begin_all([b"a"])
+        self.assertEqual(results, [True])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Tracing test cases."""
+from __future__ import print_function, division, unicode_literals
+
+from tornado import gen
+
+from hindsight.tracing import NULL_TRACE, Tracer
+
+
+def test_spans():
+    tracer = Tracer()
+    trace = tracer.start("deployment")
+
+    with trace.span("search", sha="sha") as span:
+        span.set(total_count=0)
+    try:
+        with trace.span("commit"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    try:
+        with trace.span("pull"):
+            raise gen.Return(1)
+    except gen.Return:
+        pass
+    tracer.finish(trace)
+
+    spans = tracer.to_dict()["recent"][0]["spans"]
+    assert [s["name"] for s in spans] == ["search", "commit", "pull"]
+    assert spans[0]["tags"] == {"sha": "sha", "total_count": 0}
+    assert [s["error"] for s in spans] == [None, "ValueError: boom", None]
+    assert all(s["duration"] >= 0 for s in spans)
+
+
+def test_ring_buffer_and_slowest():
+    tracer = Tracer(size=2)
+    traces = []
+    for i in range(3):
+        trace = tracer.start("deployment")
+        trace.add_repo("o/a" if i else "o/b")
+        trace.start -= i
+        tracer.finish(trace)
+        traces.append(trace)
+
+    data = tracer.to_dict()
+    assert [t["id"] for t in data["recent"]] == [3, 2]
+    assert data["slowest"]["o/a"]["id"] == 3
+    assert data["slowest"]["o/b"]["id"] == 1
+
+
+def test_max_spans():
+    trace = Tracer(max_spans=1).start("deployment")
+    trace.span("a")
+    trace.span("b")
+    assert len(trace.spans) == 1
+    assert trace.dropped == 1
+
+
+def test_profile_every():
+    tracer = Tracer(profile_every=2)
+    first = tracer.start("a")
+    tracer.finish(first)
+    second = tracer.start("b")
+    sum(range(1000))
+    tracer.finish(second)
+
+    assert first.profile is None
+    assert "function calls" in second.profile
+
+
+def test_null_trace():
+    with NULL_TRACE.span("search") as span:
+        span.set(total_count=1)
+    NULL_TRACE.add_repo("o/a")
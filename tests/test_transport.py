@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""PooledTransport test cases."""
+from __future__ import print_function, division, unicode_literals
+
+from tornado import gen
+from tornado import testing
+from tornado import web
+
+from hindsight.metrics import PipelineMetrics
+from hindsight.transport import PooledTransport
+
+
+class SlowHandler(web.RequestHandler):
+    @gen.coroutine
+    def get(self):
+        yield gen.sleep(0.05)
+        self.write("OK")
+
+
+def test_invalid_options():
+    for kwargs in ({"backend": "urllib"}, {"http2": True}):
+        try:
+            PooledTransport(**kwargs)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("ValueError not raised")
+
+
+class PooledTransportTestCase(testing.AsyncHTTPTestCase):
+    """Tests PooledTransport."""
+    def get_app(self):
+        return web.Application([(r"/", SlowHandler)])
+
+    @testing.gen_test
+    def test_saturation(self):
+        metrics = PipelineMetrics()
+        transport = PooledTransport(max_clients=2, request_timeout=5,
+                                    metrics=metrics)
+        futures = [gen.convert_yielded(transport.fetch(self.get_url("/")))
+                   for _ in range(3)]
+        yield gen.moment
+        self.assertEqual(transport.stats()["active"], 2)
+        self.assertEqual(transport.stats()["waiting"], 1)
+
+        responses = yield futures
+        self.assertEqual([resp.body for resp in responses], [b"OK"] * 3)
+
+        stats = transport.stats()
+        self.assertEqual((stats["active"], stats["waiting"], stats["waited"]),
+                         (0, 0, 1))
+        self.assertGreater(stats["wait_seconds"], 0.04)
+        self.assertEqual(
+            sum(metrics.pool_wait_seconds.labels().counts), 3)
+        transport.close()
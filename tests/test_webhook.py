@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Github webhook test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import hashlib
+import hmac
+import json
+
+from hindsight.state import MemoryBackend
+from hindsight.webhook import verify_signature
+
+from . import HindsightTestCase
+
+
+def sign(body, secret="mock-webhook-secret"):
+    """Returns X-Hub-Signature of body."""
+    digest = hmac.new(secret.encode("utf8"), body, hashlib.sha1).hexdigest()
+    return "sha1=" + digest
+
+
+def test_verify_signature():
+    assert verify_signature("secret", b"body", sign(b"body", "secret"))
+    assert not verify_signature("secret", b"body", sign(b"body", "other"))
+    assert not verify_signature("secret", b"body", "md5=xxx")
+    assert not verify_signature("secret", b"body", None)
+
+
+class GithubWebhookTestCase(HindsightTestCase):
+    """Tests GithubWebhookHandler."""
+    def _post(self, event, payload, signature=None):
+        body = json.dumps(payload).encode("utf8")
+        return self.fetch("/github", method="POST", body=body, headers={
+            "X-Github-Event": event,
+            "X-Hub-Signature": signature or sign(body),
+        })
+
+    def _make_pull_event(self, action, state="open"):
+        return {
+            "action": action,
+            "repository": {"full_name": "asyncat/demo"},
+            "pull_request": {
+                "number": 7,
+                "state": state,
+                "head": {
+                    "sha": "head",
+                    "ref": "feature",
+                    "repo": {"full_name": "asyncat/demo"},
+                },
+                "merge_commit_sha": "merge",
+            },
+        }
+
+    def test_signature_mismatch(self):
+        resp = self._post("ping", {}, signature="sha1=xxx")
+        self.assertEqual(resp.code, 403)
+
+    def test_pull_request_and_push(self):
+        index = self._app.pull_index
+
+        resp = self._post("pull_request", self._make_pull_event("opened"))
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(index.get("asyncat", "demo", "head"), 7)
+
+        self._post("push", {
+            "ref": "refs/heads/feature",
+            "repository": {"full_name": "asyncat/demo"},
+            "commits": [{"id": "pushed"}],
+        })
+        self.assertEqual(index.get("asyncat", "demo", "pushed"), 7)
+
+        self._post("pull_request", self._make_pull_event("closed", "closed"))
+        self.assertEqual(index.get("asyncat", "demo", "merge"), 7)
+
+        self._post("push", {
+            "ref": "refs/heads/feature",
+            "repository": {"full_name": "asyncat/demo"},
+            "commits": [{"id": "after-closed"}],
+        })
+        self.assertIsNone(index.get("asyncat", "demo", "after-closed"))
+
+    def test_ignore_events(self):
+        index = self._app.pull_index
+
+        self._post("pull_request", self._make_pull_event("labeled"))
+        self._post("push", {
+            "ref": "refs/tags/v1",
+            "repository": {"full_name": "asyncat/demo"},
+            "commits": [{"id": "tag"}],
+        })
+        self._post("issues", {"repository": {"full_name": "asyncat/demo"}})
+        self.assertEqual(index.stats(), {"commits": 0})
+
+    def test_malformed_body(self):
+        body = b"not json"
+        resp = self.fetch("/github", method="POST", body=body, headers={
+            "X-Github-Event": "push",
+            "X-Hub-Signature": sign(body),
+        })
+        self.assertEqual(resp.code, 400)
+        self.assertEqual(self._post("push", ["list"]).code, 400)
+
+    def test_no_repository(self):
+        resp = self._post("ping", {"zen": "Keep it simple."})
+        self.assertEqual(resp.code, 204)
+        resp = self._post("installation", {"installation": {"id": 1}})
+        self.assertEqual(resp.code, 204)
+
+    def test_share_with_processes(self):
+        self._app.state = MemoryBackend()
+        self._post("pull_request", self._make_pull_event("opened"))
+        self.assertEqual(
+            self.io_loop.run_sync(lambda: self._app.state.get_pull(
+                ("asyncat", "demo", "merge"))),
+            (True, 7))
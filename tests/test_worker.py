@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""WorkerPool test cases."""
+from __future__ import print_function, division, unicode_literals
+
+import mock
+
+from tornado import concurrent
+from tornado import gen
+from tornado import testing
+
+from hindsight.worker import QueueFull, WorkerPool
+
+
+class WorkerPoolTestCase(testing.AsyncTestCase):
+    """Tests WorkerPool."""
+    def setUp(self):
+        super(WorkerPoolTestCase, self).setUp()
+        self.futures = []
+        self.handled = []
+
+        def _handle(repo, build):
+            future = concurrent.Future()
+            self.futures.append(future)
+            self.handled.append((repo.label, build))
+            return future
+
+        self.pool = WorkerPool(_handle, workers=3, per_repo=1, max_queue=4)
+
+    def _make_repo(self, label):
+        return mock.Mock(owner="owner", label=label)
+
+    @testing.gen_test
+    def test_limit_per_repo(self):
+        self.pool.put_nowait(self._make_repo("a"), 1)
+        yield self.pool.put(self._make_repo("a"), 2)
+        self.pool.put_nowait(self._make_repo("b"), 3)
+        yield gen.moment
+        yield gen.moment
+
+        self.assertEqual(self.handled, [("a", 1), ("b", 3)])
+        stats = self.pool.stats()
+        self.assertEqual(stats["busy"], 2)
+        # ("a", 2) is parked until ("a", 1) is done.
+        self.assertEqual(stats["queue"], 1)
+
+        self.futures[0].set_result(None)
+        self.futures[1].set_exception(ValueError())
+        yield gen.moment
+        yield gen.moment
+        self.assertEqual(self.handled[-1], ("a", 2))
+
+        self.futures[2].set_result(None)
+        yield self.pool.join()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["processed"], 2)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["utilization"], 0)
+
+    @testing.gen_test
+    def test_isolate_busy_repo(self):
+        pool = WorkerPool(self.pool._handle, workers=3, per_repo=1)
+        for i in range(5):
+            pool.put_nowait(self._make_repo("a"), i)
+        pool.put_nowait(self._make_repo("b"), 5)
+        yield gen.moment
+        yield gen.moment
+
+        # Workers don't wait on the busy repository.
+        self.assertEqual(self.handled, [("a", 0), ("b", 5)])
+        self.assertEqual(pool.stats()["queue"], 4)
+
+        # The worker of "a" goes on with the parked jobs in order.
+        for future in self.futures:
+            future.set_result(None)
+            yield gen.moment
+            yield gen.moment
+        yield pool.join()
+        self.assertEqual([build for label, build in self.handled],
+                         [0, 5, 1, 2, 3, 4])
+        self.assertEqual(pool.stats()["processed"], 6)
+
+    def test_queue_full(self):
+        for i in range(4):
+            self.pool.queue.put_nowait(i)
+
+        with self.assertRaises(QueueFull):
+            self.pool.put_nowait(self._make_repo("a"), 5)